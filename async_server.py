@@ -0,0 +1,455 @@
+"""ShadowDesk on asyncio: the /webhook contract of main.py served as an ASGI app.
+
+Every pending webhook is a coroutine instead of a thread, and GPT and ElevenLabs are called through async
+clients that share one keep-alive connection pool, so thousands of webhooks can wait in one process.
+Announcements are still spoken one at a time, in the order they were accepted.
+
+    uvicorn async_server:app --host 0.0.0.0 --port 5000
+
+Configuration, templates, prompt compaction, caches, metrics, the ingest log and the audio player are
+shared with main.py, as are rate limiting, low-priority shedding and backlog word limits. Burst coalescing,
+STREAM_SUMMARY, priority ordering and BROADCAST are only available in main.py's threaded mode.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from urllib.parse import parse_qs
+
+import httpx
+import openai
+
+import main
+
+# === CONFIGURATION ===
+ASYNC_MAX_PENDING = int(os.getenv("ASYNC_MAX_PENDING", 5000)) # Webhooks accepted but not yet spoken before /webhook returns 503
+ASYNC_SUMMARY_CONCURRENCY = int(os.getenv("ASYNC_SUMMARY_CONCURRENCY", 32)) # GPT calls in flight
+ASYNC_SYNTH_CONCURRENCY = int(os.getenv("ASYNC_SYNTH_CONCURRENCY", 4)) # ElevenLabs/pyttsx3 renderings in flight
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", 64)) # Size of the shared HTTP connection pool
+ASYNC_KEEPALIVE_CONNECTIONS = int(os.getenv("ASYNC_KEEPALIVE_CONNECTIONS", 16)) # Idle connections kept open
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 60)) # Seconds per GPT/ElevenLabs request
+
+
+# === ASYNC PIPELINE ===
+class AsyncPipeline:
+    """Summarizes and renders webhooks concurrently, then speaks them strictly in arrival order."""
+
+    def __init__(self):
+        self.http_client = None
+        self.openai_client = None
+        self.summary_slots = asyncio.Semaphore(ASYNC_SUMMARY_CONCURRENCY)
+        self.synth_slots = asyncio.Semaphore(ASYNC_SYNTH_CONCURRENCY)
+        self.playback_queue = asyncio.Queue() # (seq, job, rendered future), in acceptance order
+        self.window = asyncio.Condition() # Guards next_play_seq for the render-ahead limit
+        self.next_seq = 0
+        self.next_play_seq = 0
+        self.pending = 0
+        self.tasks = set()
+
+    async def start(self):
+        limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_KEEPALIVE_CONNECTIONS)
+        self.http_client = httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT)
+        if main.OPENAI_API_KEY:
+            self.openai_client = openai.AsyncOpenAI(api_key=main.OPENAI_API_KEY, http_client=self.http_client)
+        self.spawn(self.playback_loop())
+        replayed = await asyncio.to_thread(main.recover_ingest_log)
+        for job_id, received_data in replayed:
+            self.submit(main.create_job(received_data, job_id))
+        if replayed:
+            logging.warning(f"Replaying {len(replayed)} unfinished job(s) from the ingest log.")
+        logging.info(f"Async pipeline started: {ASYNC_SUMMARY_CONCURRENCY} GPT and {ASYNC_SYNTH_CONCURRENCY} TTS calls in flight at most.")
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await self.http_client.aclose()
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task) # Keep a reference until it finishes
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, job):
+        """Queue an accepted job for summarizing, rendering and playback."""
+        rendered = asyncio.get_running_loop().create_future()
+        self.playback_queue.put_nowait((self.next_seq, job, rendered))
+        self.spawn(self.prepare(job, self.next_seq, rendered))
+        self.next_seq += 1
+        self.pending += 1
+
+    async def prepare(self, job, seq, rendered):
+        """Summarize and render one job; the result goes to rendered for the playback loop."""
+        try:
+            async with self.summary_slots:
+                main.set_job_status(job, "summarizing")
+                summary = await self.summarize(job["data"], main.backlog_word_limit(self.pending - 1))
+            with main.jobs_lock:
+                job["summary"] = summary
+
+            # Only render a few announcements ahead of the speaker so audio doesn't pile up in memory
+            async with self.window:
+                await self.window.wait_for(lambda: seq < self.next_play_seq + main.PLAYBACK_BUFFER_SIZE)
+            async with self.synth_slots:
+                main.set_job_status(job, "synthesizing")
+                stream = await self.synthesize(summary)
+            if stream is None and main.USE_ELEVENLABS and not main.TTS_FAILOVER:
+                rendered.set_result((None, "Text-to-speech failed."))
+                return
+            main.set_job_status(job, "buffered")
+            rendered.set_result((stream, None))
+        except Exception:
+            logging.exception(f"An unexpected error occurred while preparing job {job['id']}.")
+            rendered.set_result((None, "Internal error while processing job."))
+
+    async def summarize(self, received_data, max_words=None):
+        if not received_data:
+            return main.EMPTY_REQUEST_MESSAGE
+        prompt, announcement = main.choose_gpt_prompt(received_data, max_words)
+        if announcement:
+            return announcement
+        if self.openai_client is None:
+            return main.NO_CLIENT_MESSAGE
+
+        cache_key = main.summary_cache_key(received_data, max_words) if main.summary_cache else None
+        if cache_key:
+            cached = main.summary_cache.get(cache_key)
+            if cached:
+                return cached
+        try:
+            # Compacting a large body is CPU work; keep it off the event loop
+            messages = await asyncio.to_thread(main.build_gpt_messages, received_data, prompt)
+            started_at = time.time()
+            response = await self.openai_client.chat.completions.create(model=main.MODEL, messages=messages, temperature=0.7)
+            main.gpt_seconds.observe(time.time() - started_at, mode="async")
+            main.record_gpt_usage(response.usage)
+            summary = response.choices[0].message.content.strip()
+        except Exception:
+            logging.exception("An unexpected error occurred during GPT processing.")
+            main.failures.inc(engine="gpt")
+            return main.GPT_ERROR_MESSAGE
+        if cache_key and summary:
+            main.summary_cache.put(cache_key, summary)
+        return summary
+
+    async def synthesize(self, text):
+        """Async counterpart of main.synthesize_speech: an AudioStream (possibly still downloading), or None."""
+        if not main.USE_ELEVENLABS:
+            if not main.PYTTSX3_RENDER:
+                return None # Spoken live at playback
+            return await asyncio.to_thread(main.render_with_pyttsx3, text)
+
+        cached = main.cached_audio_stream(text, "elevenlabs")
+        if cached:
+            return cached
+
+        stream = None
+        if not main.TTS_FAILOVER or main.elevenlabs_breaker.allow_request():
+            stream = main.AudioStream(cache_key=main.audio_cache_key(text, "elevenlabs") if main.audio_cache else None)
+            first_data = asyncio.Event()
+            download = self.spawn(self.download_elevenlabs_audio(text, stream, first_data))
+            try:
+                await asyncio.wait_for(first_data.wait(), main.ELEVENLABS_FIRST_BYTE_DEADLINE if main.TTS_FAILOVER else None)
+            except asyncio.TimeoutError:
+                pass
+            if stream.chunks:
+                return stream
+            if not main.TTS_FAILOVER:
+                return None
+            reason = "error" if stream.done else "deadline"
+        else:
+            reason = "circuit_open"
+
+        main.tts_fallbacks.inc(reason=reason)
+        logging.warning(f"Falling back to pyttsx3 ({reason}) for: '{text}'")
+        fallback = await asyncio.to_thread(main.render_with_pyttsx3, text)
+        if fallback:
+            return fallback
+        if stream is not None:
+            await download
+            if stream.chunks:
+                return stream
+        return None
+
+    async def download_elevenlabs_audio(self, text, stream, first_data):
+        """Stream the ElevenLabs rendering of text into stream over the shared connection pool."""
+        url, headers, payload = main.build_elevenlabs_request(text)
+        try:
+            async with self.http_client.stream("POST", url, headers=headers, json=payload) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(4096):
+                    if not chunk:
+                        continue
+                    if stream.first_chunk_at is None:
+                        main.elevenlabs_ttfb_seconds.observe(time.time() - stream.started_at)
+                    stream.append(chunk)
+                    main.elevenlabs_bytes.inc(len(chunk))
+                    first_data.set()
+            stream.finish()
+        except Exception:
+            logging.exception("ElevenLabs audio download failed.")
+            stream.finish(failed=True)
+        finally:
+            first_data.set()
+
+        if stream.failed:
+            main.failures.inc(engine="elevenlabs")
+        elif main.audio_cache and stream.cache_key:
+            main.audio_cache.put(stream.cache_key, stream.read_all())
+        slow = stream.first_chunk_at is not None and stream.first_chunk_at - stream.started_at > main.ELEVENLABS_SLOW_THRESHOLD
+        main.elevenlabs_breaker.record(not stream.failed and not slow)
+
+    async def playback_loop(self):
+        """The only place audio is played: one announcement at a time, in acceptance order."""
+        while True:
+            seq, job, rendered = await self.playback_queue.get()
+            try:
+                stream, error = await rendered
+                if not error:
+                    error = await self.play(job, stream)
+                if error:
+                    main.set_job_status(job, "failed", error)
+                else:
+                    main.set_job_status(job, "done")
+            except Exception:
+                logging.exception(f"An unexpected error occurred while playing job {job['id']}.")
+                main.set_job_status(job, "failed", "Internal error while playing job.")
+            finally:
+                if main.ingest_log:
+                    main.ingest_log.mark_done(job["id"])
+                self.pending -= 1
+                async with self.window:
+                    self.next_play_seq = seq + 1
+                    self.window.notify_all()
+
+    async def play(self, job, stream):
+        """Play a rendered announcement on main.py's player. Returns an error message, or None."""
+        with main.jobs_lock:
+            summary = job["summary"]
+        if not summary:
+            return None
+        if stream is None:
+            main.set_job_status(job, "speaking")
+            success = await asyncio.to_thread(main.speak_with_pyttsx3, summary)
+        else:
+            success = await asyncio.to_thread(main.play_audio, stream, f"job {job['id']}",
+                                              lambda: main.set_job_status(job, "speaking"))
+        return None if success else "Audio playback failed."
+
+
+pipeline = None
+pending_depth = main.Gauge("shadowdesk_async_pending", "Webhooks accepted by async_server.py and not yet spoken.",
+                          lambda: pipeline.pending if pipeline else 0)
+
+
+# === ASGI APP ===
+async def send_response(send, status, body=b"", headers=None, content_type="application/json"):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    response_headers = [(b"content-length", str(len(body)).encode())]
+    if body:
+        response_headers.append((b"content-type", content_type.encode()))
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode(), value.encode()))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive, limit):
+    """The request body, or None once it grows past limit bytes."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def decode_webhook_body(content_type, body):
+    """Decode a webhook body the way main.parse_webhook_body does. Returns (received_data, error_message)."""
+    if "application/json" in content_type:
+        try:
+            return json.loads(body), None
+        except ValueError:
+            return None, "Invalid JSON format"
+    if "text/plain" in content_type:
+        try:
+            return body.decode("utf-8"), None
+        except UnicodeDecodeError:
+            return None, "Invalid UTF-8 encoding in text body"
+    try:
+        return body.decode("utf-8"), None
+    except UnicodeDecodeError:
+        return body, None
+
+
+def webhook_source(scope):
+    """The rate limiting key of a request, like main.webhook_source."""
+    if main.RATE_LIMIT_SOURCE_HEADER:
+        name = main.RATE_LIMIT_SOURCE_HEADER.lower().encode("latin-1")
+        source = main.forwarded_source(",".join(value.decode("latin-1") for key, value in scope["headers"] if key == name))
+        if source:
+            return source
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def accept_job(received_data, priority):
+    """Register a job unless it's a duplicate or too many are pending. Returns (job, duplicate_of) like
+    main.enqueue_unique_job. Nothing here awaits, so the thread lock is never held across a suspension."""
+    fingerprint = main.duplicate_fingerprint(received_data)
+    with main.duplicates_lock:
+        if fingerprint:
+            found, duplicate_of = main.find_recent_duplicate(fingerprint)
+            if found:
+                return None, duplicate_of
+        if pipeline.pending >= ASYNC_MAX_PENDING:
+            return None, None
+        if priority == "low" and main.SHED_QUEUE_DEPTH and pipeline.pending >= main.SHED_QUEUE_DEPTH:
+            logging.warning(f"Shedding a low-priority webhook with {pipeline.pending} pending.")
+            return None, None
+        job = main.create_job(received_data, priority=priority)
+        if fingerprint:
+            main.recent_payloads[fingerprint] = (job["id"], time.time())
+    return job, None
+
+
+async def handle_webhook(scope, receive, send):
+    headers = dict(scope["headers"])
+    content_length = headers.get(b"content-length")
+    if content_length and not content_length.isdigit():
+        main.webhook_requests.inc(outcome="bad_request")
+        await send_response(send, 400, {"error": "Invalid Content-Length header"})
+        return
+    if content_length and int(content_length) > main.MAX_WEBHOOK_BYTES:
+        main.webhook_requests.inc(outcome="too_large")
+        await send_response(send, 413, {"error": f"Request body exceeds {main.MAX_WEBHOOK_BYTES} bytes"})
+        return
+
+    if main.rate_limiter:
+        retry_after = main.rate_limiter.acquire(webhook_source(scope))
+        if retry_after:
+            main.webhook_requests.inc(outcome="rate_limited")
+            await send_response(send, 429, {"error": "Too many webhooks from this source"},
+                                {"Retry-After": str(math.ceil(retry_after))})
+            return
+
+    started_at = time.time()
+    body = await read_body(receive, main.MAX_WEBHOOK_BYTES)
+    if body is None:
+        main.webhook_requests.inc(outcome="too_large")
+        await send_response(send, 413, {"error": f"Request body exceeds {main.MAX_WEBHOOK_BYTES} bytes"})
+        return
+    received_data, error = decode_webhook_body(headers.get(b"content-type", b"").decode("latin-1"), body)
+    main.webhook_parse_seconds.observe(time.time() - started_at)
+    if error:
+        main.webhook_requests.inc(outcome="bad_request")
+        await send_response(send, 400, {"error": error})
+        return
+
+    priority = main.job_priority(received_data, {"X-Priority": headers.get(b"x-priority", b"").decode("latin-1")})
+    job, duplicate_of = accept_job(received_data, priority)
+    if duplicate_of:
+        main.webhook_requests.inc(outcome="duplicate")
+        status_url = f"/jobs/{duplicate_of}"
+        await send_response(send, 202, {"job_id": duplicate_of, "status": "duplicate", "status_url": status_url},
+                            {"Location": status_url})
+        return
+    if job is None:
+        logging.error("Too many pending webhooks; rejecting webhook.")
+        main.webhook_requests.inc(outcome="rejected")
+        await send_response(send, 503, {"error": "Job queue is full, try again later"})
+        return
+
+    if main.ingest_log:
+        main.ingest_log.append(job["id"], received_data)
+        # The fsync happens on the ingest log's writer thread; this coroutine just waits for it
+        if not await asyncio.to_thread(main.ingest_log.sync, main.INGEST_SYNC_TIMEOUT):
+            logging.error(f"Job {job['id']} did not reach the ingest log in time; rejecting webhook.")
+            main.withdraw_job(job, received_data, "not_durable", "Not recorded in the ingest log in time.")
+            main.webhook_requests.inc(outcome="not_durable")
+            await send_response(send, 503, {"error": "Could not record the webhook, try again later"})
+            return
+    pipeline.submit(job)
+    main.webhook_requests.inc(outcome="accepted")
+    status_url = f"/jobs/{job['id']}"
+    await send_response(send, 202, {"job_id": job["id"], "status": "queued", "status_url": status_url}, {"Location": status_url})
+
+
+async def handle_lifespan(receive, send):
+    global pipeline
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            pipeline = AsyncPipeline()
+            await pipeline.start()
+            main.start_audio_cache_warmup()
+            main.start_metrics_dump()
+            if main.broadcaster:
+                logging.warning("BROADCAST is not supported by async_server.py; run main.py to serve /events and /audio/<id>.")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await pipeline.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if path == "/webhook" and method == "POST":
+        try:
+            await handle_webhook(scope, receive, send)
+        except Exception:
+            logging.exception("An unexpected error occurred in the main webhook handler.")
+            main.webhook_requests.inc(outcome="error")
+            await send_response(send, 500, {"error": "Internal Server Error"})
+    elif path.startswith("/jobs/") and method == "GET":
+        job = main.get_job_view(path[len("/jobs/"):])
+        if job is None:
+            await send_response(send, 404, {"error": "Job not found"})
+        else:
+            await send_response(send, 200, job)
+    elif path == "/status" and method == "GET":
+        await send_response(send, 200, {
+            "pipeline": {"pending": pipeline.pending, "waiting_to_play": pipeline.playback_queue.qsize()},
+            "summary_cache": main.summary_cache.stats() if main.summary_cache else None,
+            "audio_cache": main.audio_cache.stats() if main.audio_cache else None,
+            "ingest_log": main.ingest_log.stats() if main.ingest_log else None,
+            "tts": main.get_tts_status(),
+        })
+    elif path == "/metrics" and method == "GET":
+        if parse_qs(scope.get("query_string", b"").decode()).get("format") == ["json"]:
+            await send_response(send, 200, main.metrics_snapshot())
+        else:
+            await send_response(send, 200, main.render_metrics().encode("utf-8"),
+                                content_type="text/plain; version=0.0.4; charset=utf-8")
+    elif path == "/playback" and method == "GET":
+        await send_response(send, 200, await asyncio.to_thread(lambda: main.get_player().status()))
+    elif path == "/playback/skip" and method == "POST":
+        await send_response(send, 200, {"skipped": await asyncio.to_thread(lambda: main.get_player().skip())})
+    elif path == "/playback/stop" and method == "POST":
+        await send_response(send, 200, {"stopped": await asyncio.to_thread(lambda: main.get_player().stop())})
+    else:
+        await send_response(send, 404, {"error": "Not found"})
+
+
+# === RUN SERVER ===
+if __name__ == "__main__":
+    import uvicorn
+    logging.info(f"--- Starting async server on host 0.0.0.0 port {main.LISTEN_PORT} ---")
+    uvicorn.run(app, host="0.0.0.0", port=main.LISTEN_PORT, log_level="warning")
@@ -0,0 +1,456 @@
+"""Offline benchmark for main.py.
+
+Starts local stand-ins for the OpenAI chat-completions API and the ElevenLabs text-to-speech endpoint,
+runs main.py against them with the null audio sink, and fires webhooks at a fixed rate. Payloads are taken
+from test_hook.md and requests.jsonl. Reports requests/s, p50/p95/p99 per pipeline stage and queue depth
+over time; save a run with --save and compare later runs against it with --baseline.
+
+    python benchmark.py --rate 20 --duration 30 --save baseline.json
+    python benchmark.py --rate 20 --duration 30 --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (name, from timestamp, to timestamp) - the job timestamps main.py records per status.
+# "summarize" runs until a synthesize worker picks the summary up, so it includes that wait.
+STAGES = [
+    ("queue_wait", "queued", "summarizing"),
+    ("summarize", "summarizing", "synthesizing"),
+    ("synthesize", "synthesizing", "buffered"),
+    ("speaker_wait", "buffered", "speaking"),
+    ("playback", "speaking", "done"),
+    ("end_to_end", "queued", "done"),
+]
+
+
+# === FAKE SERVERS ===
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections are expected; anything else is still reported
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class FakeServer:
+    """A ThreadingHTTPServer on a free local port, serving from its own thread."""
+
+    def __init__(self, handler, settings):
+        handler.settings = settings
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), handler)
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    settings = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass # Keep the benchmark output readable
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_error_response(self):
+        body = json.dumps({"error": {"message": "Injected failure", "type": "server_error"}}).encode()
+        self.send_response(500)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def should_fail(self):
+        return random.random() < self.settings["error_rate"]
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class FakeOpenAIHandler(FakeHandler):
+    """POST /v1/chat/completions; answers with a canned summary, streamed word by word when asked to."""
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = self.read_json()
+        time.sleep(self.settings["latency"])
+        if self.should_fail():
+            self.send_error_response()
+            return
+
+        summary = "Tech Master, a webhook arrived and ShadowDesk has summarized it in one suitably dramatic sentence."
+        if not request.get("stream"):
+            body = json.dumps({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "bench"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": summary}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in summary.split(" "):
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "bench"),
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.settings["chunk_interval"])
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+
+class FakeElevenLabsHandler(FakeHandler):
+    """POST /v1/text-to-speech/<voice>; streams filler bytes sized like a 128 kbps MP3 of the text."""
+
+    def do_POST(self):
+        if "/v1/text-to-speech/" not in self.path:
+            self.send_error(404)
+            return
+        request = self.read_json()
+        time.sleep(self.settings["latency"])
+        if self.should_fail():
+            self.send_error_response()
+            return
+
+        # About 15 characters of speech per second, 16000 bytes per second of audio
+        remaining = max(1, int(len(request.get("text", "")) / 15 * 16000))
+        chunk_size = self.settings["chunk_bytes"]
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            self.write_chunk(b"\0" * size)
+            remaining -= size
+            if remaining:
+                time.sleep(self.settings["chunk_interval"])
+        self.write_chunk(b"")
+
+
+# === PAYLOADS ===
+def load_payloads():
+    """Webhook bodies from the curl examples in test_hook.md and the entries of requests.jsonl."""
+    payloads = []
+    try:
+        with open(os.path.join(HERE, "test_hook.md"), encoding="utf-8") as f:
+            for body in re.findall(r"-d '(\{.*?\})'", f.read()):
+                try:
+                    payloads.append(json.loads(body))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(HERE, "requests.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                payloads.append({"event": entry.get("title", "Request"), "data": {"message": entry.get("body", "")}})
+    except FileNotFoundError:
+        pass
+    if not payloads:
+        payloads.append({"event": "Test Trigger", "data": {"name": "Bench", "message": "This is just a test webhook", "rating": 5}})
+    return payloads
+
+
+# === SERVER UNDER TEST ===
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(openai_port, elevenlabs_port, port, work_dir, overrides):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "ELEVENLABS_API_KEY": "bench",
+        "ELEVENLABS_API_BASE": f"http://127.0.0.1:{elevenlabs_port}",
+        "LISTEN_PORT": str(port),
+        "PLAYBACK_BACKEND": "null",
+        # Every request should reach the fake APIs; caches would only measure themselves
+        "SUMMARY_CACHE_SIZE": "0",
+        "SUMMARY_CACHE_PATH": "",
+        "AUDIO_CACHE_MAX_BYTES": "0",
+        "COLLAPSE_DUPLICATES": "false",
+        "USE_TEMPLATES": "false", # Most sample payloads match a built-in template and would skip GPT entirely
+        "INGEST_LOG_DIR": os.path.join(work_dir, "ingest_log"),
+        "JOB_HISTORY_SIZE": "100000",
+    })
+    env.update(overrides)
+    log = open(os.path.join(work_dir, "server.log"), "w")
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "main.py")], env=env, cwd=work_dir,
+                               stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"main.py exited early; see {log.name}")
+        try:
+            requests.get(base_url + "/status", timeout=1)
+            return process, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"main.py did not start listening on port {port}; see {log.name}")
+
+
+# === LOAD GENERATOR ===
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"count": len(values), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+
+def sample_status(base_url, samples, stop, interval):
+    started = time.time()
+    while not stop.is_set():
+        try:
+            pipeline = requests.get(base_url + "/status", timeout=5).json()["pipeline"]
+            samples.append({"t": round(time.time() - started, 2), **pipeline})
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            pass
+        stop.wait(interval)
+
+
+def run_load(base_url, payloads, rate, duration, concurrency):
+    """Open-loop load: one webhook every 1/rate seconds, regardless of how fast the server answers."""
+    session = requests.Session()
+    results = []
+    results_lock = threading.Lock()
+
+    def fire(payload):
+        sent = time.time()
+        try:
+            response = session.post(base_url + "/webhook", json=payload, timeout=60)
+            status = response.status_code
+            job_id = response.json().get("job_id") if status == 202 else None
+        except (requests.exceptions.RequestException, ValueError):
+            status, job_id = None, None
+        with results_lock:
+            results.append({"status": status, "job_id": job_id, "latency": time.time() - sent})
+
+    started = time.time()
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            delay = started + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, payloads[i % len(payloads)])
+    return results, time.time() - started
+
+
+def wait_for_jobs(base_url, job_ids, timeout):
+    """Poll GET /jobs/<id> until every job is done or failed. Returns the final job views."""
+    finished = {}
+    deadline = time.time() + timeout
+    pending = list(job_ids)
+    while pending and time.time() < deadline:
+        still_pending = []
+        for job_id in pending:
+            try:
+                job = requests.get(f"{base_url}/jobs/{job_id}", timeout=5).json()
+            except (requests.exceptions.RequestException, ValueError):
+                still_pending.append(job_id)
+                continue
+            if job.get("status") in ("done", "failed", "dropped"):
+                finished[job_id] = job
+            else:
+                still_pending.append(job_id)
+        pending = still_pending
+        if pending:
+            time.sleep(0.5)
+    return finished, pending
+
+
+def job_throughput(jobs):
+    """Finished jobs per second, from the first one queued to the last one finished."""
+    jobs = list(jobs)
+    if len(jobs) < 2:
+        return None
+    first = min(job["timestamps"]["queued"] for job in jobs)
+    last = max(job["timestamps"].get("done") or job["timestamps"].get("failed") or job["timestamps"].get("dropped") or first
+               for job in jobs)
+    return len(jobs) / (last - first) if last > first else None
+
+
+def summarize_run(results, elapsed, finished, unfinished, samples, args):
+    accepted = [r for r in results if r["status"] == 202]
+    stage_times = {name: [] for name, _, _ in STAGES}
+    for job in finished.values():
+        timestamps = job.get("timestamps", {})
+        for name, start, end in STAGES:
+            if start in timestamps and end in timestamps:
+                stage_times[name].append(timestamps[end] - timestamps[start])
+
+    depth_keys = [key for key in (samples[0] if samples else {}) if key != "t"]
+    return {
+        "settings": {key: getattr(args, key) for key in ("rate", "duration", "openai_latency", "elevenlabs_latency",
+                                                         "chunk_interval", "error_rate")},
+        "requests": len(results),
+        "requests_per_second": len(results) / elapsed if elapsed else 0,
+        "responses": {str(status): sum(1 for r in results if r["status"] == status)
+                      for status in sorted({r["status"] for r in results}, key=str)},
+        "webhook_latency": percentiles([r["latency"] for r in results]),
+        "jobs_done": sum(1 for job in finished.values() if job["status"] == "done"),
+        "jobs_failed": sum(1 for job in finished.values() if job["status"] == "failed"),
+        "jobs_dropped": sum(1 for job in finished.values() if job["status"] == "dropped"),
+        "jobs_unfinished": len(unfinished),
+        "jobs_per_second": job_throughput(finished.values()),
+        "accepted": len(accepted),
+        "stages": {name: percentiles(values) for name, values in stage_times.items()},
+        "queue_depth": {key: {"max": max(s.get(key, 0) for s in samples),
+                              "mean": sum(s.get(key, 0) for s in samples) / len(samples)} for key in depth_keys},
+        "queue_depth_timeline": samples,
+    }
+
+
+# === REPORT ===
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_report(report, baseline=None):
+    print(f"\nRequests: {report['requests']} at {report['requests_per_second']:.1f}/s  responses: {report['responses']}")
+    if report["jobs_per_second"]:
+        print(f"Jobs: {report['jobs_done']} done, {report['jobs_failed']} failed, {report.get('jobs_dropped', 0)} dropped,"
+              f" {report['jobs_unfinished']} unfinished,"
+              f" {report['jobs_per_second']:.2f} jobs/s through the speaker")
+
+    print(f"\n{'stage (ms)':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}" + ("  p95 vs baseline" if baseline else ""))
+    rows = [("webhook", report["webhook_latency"])] + list(report["stages"].items())
+    for name, stats in rows:
+        if not stats:
+            print(f"{name:<16}{0:>7}")
+            continue
+        line = f"{name:<16}{stats['count']:>7}" + "".join(f"{format_ms(stats[key]):>9}" for key in ("p50", "p95", "p99", "max"))
+        if baseline:
+            base = baseline["webhook_latency"] if name == "webhook" else baseline["stages"].get(name)
+            if base and base["p95"]:
+                line += f"  {(stats['p95'] - base['p95']) / base['p95'] * 100:+.0f}%"
+        print(line)
+
+    if report["queue_depth"]:
+        print("\nQueue depth   " + "  ".join(f"{key}: max {d['max']}, mean {d['mean']:.1f}" for key, d in report["queue_depth"].items()))
+        timeline = report["queue_depth_timeline"]
+        step = max(1, len(timeline) // 20)
+        for sample in timeline[::step]:
+            print(f"  t={sample['t']:>6.1f}s  " + "  ".join(f"{key}={sample.get(key, 0)}" for key in report["queue_depth"]))
+    if baseline:
+        print(f"\nBaseline: {baseline['requests_per_second']:.1f} requests/s, "
+              f"{baseline['jobs_per_second'] or 0:.2f} jobs/s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark main.py against local fake OpenAI and ElevenLabs servers.")
+    parser.add_argument("--rate", type=float, default=10, help="Webhooks per second")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=64, help="Max webhooks in flight")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Seconds before the fake OpenAI answers")
+    parser.add_argument("--elevenlabs-latency", type=float, default=0.3, help="Seconds before the fake ElevenLabs sends audio")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="Seconds between streamed chunks from both fakes")
+    parser.add_argument("--chunk-bytes", type=int, default=4096, help="Audio bytes per ElevenLabs chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake API calls that return HTTP 500")
+    parser.add_argument("--playback-rate", type=int, default=0,
+                        help="Audio bytes the null sink plays per second (0 = instant, 16000 ~ real time)")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="Seconds to wait for queued jobs after the load stops")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between /status samples")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for main.py")
+    parser.add_argument("--save", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a report saved with --save")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    overrides = dict(item.split("=", 1) for item in args.env)
+    overrides.setdefault("NULL_PLAYBACK_RATE", str(args.playback_rate))
+
+    openai_server = FakeServer(FakeOpenAIHandler, {"latency": args.openai_latency, "chunk_interval": args.chunk_interval,
+                                                   "error_rate": args.error_rate})
+    elevenlabs_server = FakeServer(FakeElevenLabsHandler, {"latency": args.elevenlabs_latency, "chunk_interval": args.chunk_interval,
+                                                           "chunk_bytes": args.chunk_bytes, "error_rate": args.error_rate})
+    work_dir = tempfile.mkdtemp(prefix="shadowdesk-bench-")
+    process, base_url = start_server(openai_server.port, elevenlabs_server.port, free_port(), work_dir, overrides)
+    print(f"main.py listening on {base_url}; logs in {work_dir}")
+
+    samples = []
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_status, args=(base_url, samples, stop, args.sample_interval), daemon=True)
+    sampler.start()
+    try:
+        payloads = load_payloads()
+        print(f"Sending {int(args.rate * args.duration)} webhooks at {args.rate}/s from {len(payloads)} payloads...")
+        results, elapsed = run_load(base_url, payloads, args.rate, args.duration, args.concurrency)
+        job_ids = [r["job_id"] for r in results if r["job_id"]]
+        print(f"Load done in {elapsed:.1f} s; waiting for {len(job_ids)} jobs to finish...")
+        finished, unfinished = wait_for_jobs(base_url, job_ids, args.drain_timeout)
+    finally:
+        stop.set()
+        sampler.join()
+        process.terminate()
+        process.wait()
+        openai_server.stop()
+        elevenlabs_server.stop()
+
+    report = summarize_run(results, elapsed, finished, unfinished, samples, args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
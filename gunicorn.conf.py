@@ -0,0 +1,10 @@
+"""gunicorn settings for `gunicorn main:app`; gunicorn loads this file from the working directory.
+
+Each worker starts its pipeline as soon as it has loaded the app, so unfinished jobs in the ingest log are
+replayed and the canned phrases are pre-rendered at startup rather than on the worker's first webhook.
+"""
+
+
+def post_worker_init(worker):
+    import main
+    main.start_pipeline()
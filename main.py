@@ -1,12 +1,42 @@
 import openai
-from flask import Flask, request, jsonify # Added jsonify for returning errors
+from flask import Flask, Response, request, jsonify, url_for, has_request_context
 import os
+import re
+import hashlib
+import json
+import math
+import html
 import logging
+import array
+import base64
+import heapq
+import queue
+import random
+import threading
+import uuid
+from collections import OrderedDict, deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import itertools
 import requests
+import subprocess
 import tempfile
 import time
-import pyttsx3
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import miniaudio # Optional: in-process audio decoding and playback
+except ImportError:
+    miniaudio = None
+try:
+    import tiktoken # Optional: exact token counts for the prompt budget
+except ImportError:
+    tiktoken = None
+try:
+    import fcntl # POSIX only; lets each worker process claim its own ingest log
+except ImportError:
+    fcntl = None
 import traceback # Import traceback module
 
 # Load environment variables from .env file
@@ -16,21 +46,97 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # Removed default key for clarity
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "EXAVITQu4vr4xnSDxMaL")
+ELEVENLABS_API_BASE = os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io").rstrip("/") # Point at a stand-in server for benchmarks
+ELEVENLABS_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.4, "similarity_boost": 0.7}
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4") # Allow overriding model via env
 LISTEN_PORT = int(os.getenv("LISTEN_PORT", 5000)) # Allow overriding port via env
 SPEECH_RATE = int(os.getenv("SPEECH_RATE", 180)) # Allow overriding rate via env
+PYTTSX3_RENDER = os.getenv("PYTTSX3_RENDER", "true").lower() == "true" # Render pyttsx3 speech to audio so it is cached and played like ElevenLabs clips
+TTS_FAILOVER = os.getenv("TTS_FAILOVER", "true").lower() == "true" # Speak with pyttsx3 when ElevenLabs is slow or failing
+ELEVENLABS_FIRST_BYTE_DEADLINE = float(os.getenv("ELEVENLABS_FIRST_BYTE_DEADLINE", 4)) # Seconds to wait for ElevenLabs audio before failing over
+ELEVENLABS_SLOW_THRESHOLD = float(os.getenv("ELEVENLABS_SLOW_THRESHOLD", ELEVENLABS_FIRST_BYTE_DEADLINE)) # Time-to-first-byte counted as a failure by the breaker
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 3)) # Consecutive ElevenLabs failures/slow responses that open the breaker
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 60)) # Seconds the breaker routes everything to pyttsx3 before retrying ElevenLabs
 USE_ELEVENLABS = bool(ELEVENLABS_API_KEY) # True if API key is present
+QUEUE_MODE = os.getenv("QUEUE_MODE", "true").lower() == "true" # Acknowledge webhooks with 202 and process them in the background
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 100)) # Max announcements waiting to be summarized before /webhook returns 503
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 2)) # Concurrent GPT summarizations
+SYNTH_WORKERS = int(os.getenv("SYNTH_WORKERS", 2)) # Concurrent TTS renderings
+SYNTH_QUEUE_SIZE = int(os.getenv("SYNTH_QUEUE_SIZE", 10)) # Summaries waiting to be synthesized
+PLAYBACK_BUFFER_SIZE = max(2, int(os.getenv("PLAYBACK_BUFFER_SIZE", 3))) # Announcements rendered ahead, counting the one playing
+STREAM_PLAYBACK = os.getenv("STREAM_PLAYBACK", "true").lower() == "true" # ffplay backend: pipe audio in as it downloads instead of via a temp file
+PLAYBACK_BACKEND = os.getenv("PLAYBACK_BACKEND", "auto").lower() # auto, miniaudio, ffplay or null
+NULL_PLAYBACK_RATE = int(os.getenv("NULL_PLAYBACK_RATE", 16000)) # null backend: audio bytes "played" per second (0 discards instantly)
+PLAYBACK_SAMPLE_RATE = int(os.getenv("PLAYBACK_SAMPLE_RATE", 44100)) # miniaudio output device rate
+PLAYBACK_CHANNELS = int(os.getenv("PLAYBACK_CHANNELS", 1)) # miniaudio output device channels
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", 500)) # Finished jobs kept around for GET /jobs/<id>
+
+STREAM_SUMMARY = os.getenv("STREAM_SUMMARY", "false").lower() == "true" # Stream GPT output and speak it sentence by sentence
+STREAM_MIN_FRAGMENT_CHARS = int(os.getenv("STREAM_MIN_FRAGMENT_CHARS", 40)) # Shortest fragment split at a comma/semicolon rather than a sentence end
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 256)) # Cached GPT summaries (0 disables the cache)
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", 3600)) # Seconds a cached summary stays valid
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "") # Optional JSON Lines file that keeps the cache across restarts
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 800)) # Most tokens of webhook content sent to GPT
+PROMPT_DROP_KEYS = {k.strip().replace("_", "").replace("-", "").lower() for k in os.getenv( # JSON keys left out of the prompt
+    "PROMPT_DROP_KEYS", "id,uuid,guid,token,signature,hash,checksum,headers,raw_headers,attachments,avatar_url,html_url,url,links").split(",") if k.strip()}
+MAX_WEBHOOK_BYTES = int(os.getenv("MAX_WEBHOOK_BYTES", 256 * 1024)) # Larger request bodies are rejected with 413
+USE_TEMPLATES = os.getenv("USE_TEMPLATES", "true").lower() == "true" # Announce known JSON payload shapes from local templates, skipping GPT
+TEMPLATES_PATH = os.getenv("TEMPLATES_PATH", "") # Optional JSON file with extra announcement templates
+TEMPLATE_MAX_FIELD_CHARS = int(os.getenv("TEMPLATE_MAX_FIELD_CHARS", 200)) # Longer field values are left for GPT to paraphrase
+TEMPLATE_EVENT_ROUTES = dict( # "event=template|gpt,..." forces one path for the given "event" values
+    (event.strip().lower(), route.strip().lower())
+    for event, _, route in (item.partition("=") for item in os.getenv("TEMPLATE_EVENT_ROUTES", "").split(",") if "=" in item)
+)
+COLLAPSE_DUPLICATES = os.getenv("COLLAPSE_DUPLICATES", "false").lower() == "true" # Announce identical payloads only once
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", 60)) # Seconds during which an identical payload counts as a duplicate
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0)) # Seconds to gather a burst of webhooks into one digest (0 disables coalescing)
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", 10)) # Most webhooks merged into a single digest
+COALESCE_BYPASS_EVENTS = {e.strip().lower() for e in os.getenv("COALESCE_BYPASS_EVENTS", "").split(",") if e.strip()} # "event" values announced immediately
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.getenv("LOCALAPPDATA") or os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"), "shadowdesk")) # State kept across restarts, outside the source tree
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(DATA_DIR, "audio_cache")) # Rendered ElevenLabs MP3s
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 100 * 1024 * 1024)) # Disk budget for the audio cache (0 disables it)
+INGEST_LOG_DIR = os.getenv("INGEST_LOG_DIR", os.path.join(DATA_DIR, "ingest_log")) # Write-ahead log of accepted webhooks (empty disables it)
+INGEST_SEGMENT_BYTES = int(os.getenv("INGEST_SEGMENT_BYTES", 4 * 1024 * 1024)) # New records per log segment before it is rotated and compacted
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "") # Optional JSON file the metrics are written to periodically
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", 60)) # Seconds between metrics dumps
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper() # DEBUG also logs every call on the webhook/pipeline hot path
+INGEST_SYNC_TIMEOUT = float(os.getenv("INGEST_SYNC_TIMEOUT", 10)) # Seconds a webhook waits for its log record to reach the disk before it is answered with 503
+PRIORITY_RULES = os.getenv("PRIORITY_RULES", "") # "field=value:high,rating<=2:high,event=heartbeat:low" - first match sets a job's priority class
+DEFAULT_PRIORITY = os.getenv("DEFAULT_PRIORITY", "normal").lower() # Class of jobs no rule (or X-Priority header) matches
+RATE_LIMIT_PER_SOURCE = float(os.getenv("RATE_LIMIT_PER_SOURCE", 0)) # Webhooks per second each source may send on average (0 disables rate limiting)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 20)) # Webhooks a source may send at once before it is limited
+RATE_LIMIT_SOURCE_HEADER = os.getenv("RATE_LIMIT_SOURCE_HEADER", "") # Header naming the source (e.g. X-Forwarded-For); default is the client address
+RATE_LIMIT_TRUSTED_HOPS = max(1, int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", 1))) # Proxies in front of the server that append to RATE_LIMIT_SOURCE_HEADER
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", 0)) # Waiting announcements beyond which low-priority webhooks are refused (0 disables shedding)
+LOW_PRIORITY_MAX_AGE = float(os.getenv("LOW_PRIORITY_MAX_AGE", 0)) # Seconds a low-priority job may wait before it is dropped unannounced (0 keeps them)
+BACKLOG_WORD_LIMITS = sorted( # "depth:words,..." - announcements get shorter as the waiting backlog reaches each depth
+    (int(depth), int(words))
+    for depth, _, words in (item.partition(":") for item in os.getenv("BACKLOG_WORD_LIMITS", "").split(",") if ":" in item)
+)
+BROADCAST = os.getenv("BROADCAST", "false").lower() == "true" # Serve announcements to remote listeners over /events and /audio/<id>
+BROADCAST_HISTORY = int(os.getenv("BROADCAST_HISTORY", 20)) # Recent clips kept in memory for late joiners
+BROADCAST_KEEPALIVE = float(os.getenv("BROADCAST_KEEPALIVE", 15)) # Seconds between keepalive comments on idle event streams
+SPEAKER_ADDRESS = os.getenv("SPEAKER_ADDRESS", "") # host:port or socket path of the speaker process (speaker.py); empty plays audio in this process
+SPEAKER_AUTHKEY = os.getenv("SPEAKER_AUTHKEY", "").encode("utf-8") # Shared secret between the workers and the speaker; required with SPEAKER_ADDRESS
+
+EMPTY_REQUEST_MESSAGE = "ShadowDesk senses a void... an empty request arrived."
+INVALID_DATA_MESSAGE = "ShadowDesk is perplexed by the formless void of data."
+NO_CLIENT_MESSAGE = "ShadowDesk is silent - the connection to the ether is broken."
+GPT_ERROR_MESSAGE = "ShadowDesk falters—a disturbance in the connection prevents the message."
+CANNED_PHRASES = [EMPTY_REQUEST_MESSAGE, INVALID_DATA_MESSAGE, NO_CLIENT_MESSAGE, GPT_ERROR_MESSAGE] # Pre-rendered into the audio cache
 
 # === INITIALIZE ===
 # Configure logging format
 logging.basicConfig(
-    level=logging.INFO,
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
     format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
 )
 
 logging.info("--- Initializing Application ---")
 
 # Validate essential configuration
+client = None
 if not OPENAI_API_KEY:
     logging.critical("FATAL: OPENAI_API_KEY environment variable not set.")
     # Consider exiting here if OpenAI is absolutely required
@@ -39,86 +145,713 @@ else:
     logging.info(f"OpenAI Client configured with model: {MODEL}")
     client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+if SPEAKER_ADDRESS and not SPEAKER_AUTHKEY:
+    # The speaker unpickles whatever an authenticated peer sends, so a guessable key would hand it over
+    logging.critical("FATAL: SPEAKER_ADDRESS is set but SPEAKER_AUTHKEY is not. Set it to a long random secret.")
+    raise SystemExit(1)
+
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_WEBHOOK_BYTES + 1 # Werkzeug stops reading a chunked body here; one byte over tells us it was too large
+
+# pyttsx3 runs on its own worker thread (see Pyttsx3Worker) and is initialized on first use
+logging.info(f"ElevenLabs TTS {'ENABLED' if USE_ELEVENLABS else 'DISABLED'}.")
+logging.info(f"pyttsx3 TTS {'DISABLED' if USE_ELEVENLABS else 'ENABLED (offline rendering ' + ('on' if PYTTSX3_RENDER else 'off') + ')'}.")
+# Nothing touches the audio device until the first clip plays; with SPEAKER_ADDRESS set it never does here
+if SPEAKER_ADDRESS:
+    logging.info(f"Announcements are played by the speaker process at {SPEAKER_ADDRESS}.")
+logging.info("--- Initialization Complete ---")
+
+
+# === METRICS ===
+# In-process counters and histograms, served in the Prometheus text format by GET /metrics and optionally
+# dumped as JSON to METRICS_DUMP_PATH. Labels are passed as keyword arguments: requests_total.inc(outcome="accepted").
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {} # sorted label items -> count
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {} # sorted label items -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, counts in self.values.items():
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    result.append((self.name + "_bucket", {**labels, "le": str(bound)}, cumulative))
+                result.append((self.name + "_sum", labels, counts[-1]))
+                result.append((self.name + "_count", labels, cumulative))
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(key), "count": sum(counts[:-1]), "sum": counts[-1],
+                     **{f"p{q}": self._quantile(counts, q / 100) for q in (50, 95, 99)}}
+                    for key, counts in self.values.items()]
+
+    def _quantile(self, counts, q):
+        # Upper bound of the bucket holding the q-th observation; good enough for dashboards
+        total = sum(counts[:-1])
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+
+class Gauge:
+    """A value read at scrape time, e.g. a queue depth."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read # () -> a number, or [(labels, value), ...]
+        metrics.append(self)
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, list):
+            return [(self.name, labels, v) for labels, v in value]
+        return [(self.name, {}, value)]
+
+    def snapshot(self):
+        return [{"labels": labels, "value": value} for _, labels, value in self.samples()]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_snapshot():
+    return {"timestamp": time.time(), "metrics": {metric.name: metric.snapshot() for metric in metrics}}
+
+
+def dump_metrics_periodically():
+    while True:
+        time.sleep(METRICS_DUMP_INTERVAL)
+        try:
+            tmp_path = METRICS_DUMP_PATH + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metrics_snapshot(), f, default=str)
+            os.replace(tmp_path, METRICS_DUMP_PATH)
+        except Exception:
+            logging.exception(f"Could not write metrics to {METRICS_DUMP_PATH}.")
+
+
+def start_metrics_dump():
+    """Start the METRICS_DUMP_PATH writer, once."""
+    global metrics_dump_started
+    if not METRICS_DUMP_PATH:
+        return
+    with metrics_dump_lock:
+        if metrics_dump_started:
+            return
+        metrics_dump_started = True
+    threading.Thread(target=dump_metrics_periodically, name="metrics-dump", daemon=True).start()
+
+
+metrics = [] # Every metric, in the order they are rendered
+metrics_dump_lock = threading.Lock()
+metrics_dump_started = False
+
+webhook_requests = Counter("shadowdesk_webhook_requests_total", "Webhook requests by outcome.")
+webhook_parse_seconds = Histogram("shadowdesk_webhook_parse_seconds", "Time spent reading and parsing the webhook body.")
+gpt_seconds = Histogram("shadowdesk_gpt_request_seconds", "GPT chat-completion latency (to the last token when streaming).")
+gpt_tokens = Counter("shadowdesk_gpt_tokens_total", "Tokens used by GPT calls, by kind (prompt, completion).")
+elevenlabs_ttfb_seconds = Histogram("shadowdesk_elevenlabs_ttfb_seconds", "ElevenLabs time to first audio byte.")
+elevenlabs_bytes = Counter("shadowdesk_elevenlabs_bytes_total", "Audio bytes downloaded from ElevenLabs.")
+pyttsx3_render_seconds = Histogram("shadowdesk_pyttsx3_render_seconds", "Time pyttsx3 takes to render an announcement to a file.")
+tts_fallbacks = Counter("shadowdesk_tts_fallbacks_total", "Announcements spoken by pyttsx3 instead of ElevenLabs, by reason.")
+playback_seconds = Histogram("shadowdesk_playback_seconds", "Time from the start of playback to its end, by backend.")
+first_audio_seconds = Histogram("shadowdesk_time_to_first_audio_seconds", "Time from requesting a clip's audio to the start of its playback, by backend.")
+failures = Counter("shadowdesk_failures_total", "Failed calls by engine (gpt, elevenlabs, pyttsx3, or the playback backend).")
+job_stage_seconds = Histogram("shadowdesk_job_stage_seconds", "Time jobs spend in each status (queued is the queue wait).")
+prompt_tokens_saved = Counter("shadowdesk_prompt_tokens_saved_total", "Estimated prompt tokens removed by prompt compaction.")
+template_announcements = Counter("shadowdesk_template_announcements_total", "Announcements rendered from a local template instead of GPT, by template.")
+jobs_finished = Counter("shadowdesk_jobs_finished_total", "Jobs that reached a final status (done, failed, dropped).")
+broadcast_bytes = Counter("shadowdesk_broadcast_bytes_total", "Audio bytes served to broadcast listeners from memory.")
+jobs_dropped = Counter("shadowdesk_jobs_dropped_total", "Queued jobs dropped unannounced, by reason (expired, evicted, not_durable).")
+
+
+# === SUMMARY CACHE ===
+class SummaryCache:
+    """LRU cache of GPT summaries with a TTL, optionally persisted as JSON Lines so it survives restarts."""
+
+    def __init__(self, max_entries, ttl, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict() # key -> (summary, created_at), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.appends = 0 # Lines appended to the file since it was last compacted
+        self.lock = threading.Lock()
+        if path:
+            self._load()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self.entries[key] # Expired
+            self.misses += 1
+            return None
+
+    def put(self, key, summary):
+        with self.lock:
+            created_at = time.time()
+            self.entries[key] = (summary, created_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.path:
+                self._append(key, summary, created_at)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # Torn write from a crash
+                    self.entries[record["key"]] = (record["summary"], record["created_at"])
+                    self.entries.move_to_end(record["key"])
+        except FileNotFoundError:
+            return
+        except Exception:
+            logging.exception(f"Could not load summary cache from {self.path}.")
+            return
+
+        now = time.time()
+        for key in [k for k, (_, created_at) in self.entries.items() if now - created_at >= self.ttl]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._compact()
+        logging.info(f"Loaded {len(self.entries)} cached summaries from {self.path}.")
+
+    def _append(self, key, summary, created_at):
+        # Caller holds self.lock
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "summary": summary, "created_at": created_at}) + "\n")
+            self.appends += 1
+            if self.appends > 2 * self.max_entries:
+                self._compact()
+        except Exception:
+            logging.exception(f"Could not write summary cache file {self.path}.")
+
+    def _compact(self):
+        # Caller holds self.lock (or is still in __init__). Rewrite the file with only the live entries.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, (summary, created_at) in self.entries.items():
+                f.write(json.dumps({"key": key, "summary": summary, "created_at": created_at}) + "\n")
+        os.replace(tmp_path, self.path)
+        self.appends = 0
+
+
+def normalize_payload(value):
+    """Canonical form of a payload: dict keys sorted, whitespace in strings collapsed."""
+    if isinstance(value, dict):
+        return {str(key).strip(): normalize_payload(value[key]) for key in sorted(value, key=str)}
+    if isinstance(value, list):
+        return [normalize_payload(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, bytes):
+        return normalize_payload(value.decode("utf-8", errors="replace"))
+    return value
+
+
+def payload_fingerprint(input_data, *extra):
+    """Hash of the normalized payload plus any extra key material (prompt variant, model, ...)."""
+    material = json.dumps(normalize_payload(input_data), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256("\x1f".join((material,) + extra).encode("utf-8")).hexdigest()
+
+
+def summary_cache_key(input_data, max_words=None):
+    # The prompt variant is the summarize_with_gpt branch the payload takes, plus any backlog word limit
+    if isinstance(input_data, DigestPayload):
+        variant = "digest"
+    else:
+        variant = "dict" if isinstance(input_data, dict) else "str"
+    if max_words:
+        variant += f":{max_words}"
+    return payload_fingerprint(input_data, variant, MODEL)
+
+
+summary_cache = SummaryCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL, SUMMARY_CACHE_PATH or None) if SUMMARY_CACHE_SIZE > 0 else None
+
+
+# === ANNOUNCEMENT TEMPLATES ===
+# JSON payloads with a known shape are announced from local templates instead of a GPT call. A template lists
+# where to find each field (case-insensitive, dotted paths) and a set of phrasings that are used in turn;
+# phrasings that need a field the payload lacks are skipped. Payloads no template matches go to GPT.
+class AnnouncementTemplate:
+    def __init__(self, name, fields, required, phrasings):
+        self.name = name
+        self.fields = fields # field -> candidate paths, e.g. {"name": ["data.name", "name"]}
+        self.required = required
+        self.phrasings = phrasings
+        self.next_index = random.randrange(len(phrasings)) # Start somewhere different after each restart
+        self.lock = threading.Lock()
 
-# Initialize TTS Engines (only if needed)
-engine = None
-if not USE_ELEVENLABS:
+    def extract(self, payload):
+        """The template's fields from payload, or None if a required field is missing or too long to read out."""
+        values = {}
+        for field, paths in self.fields.items():
+            for path in paths:
+                value = lookup_payload_path(payload, path)
+                if value is not None:
+                    values[field] = value
+                    break
+        if any(field not in values for field in self.required):
+            return None
+        if any(len(value) > TEMPLATE_MAX_FIELD_CHARS for value in values.values()):
+            return None # Long free text reads better paraphrased by GPT
+        return values
+
+    def render(self, values):
+        usable = [p for p in self.phrasings if all(f in values for f in re.findall(r"{(\w+)}", p))]
+        if not usable:
+            return None
+        with self.lock:
+            phrasing = usable[self.next_index % len(usable)]
+            self.next_index += 1
+        return phrasing.format(**values)
+
+
+def normalize_field_key(key):
+    return re.sub(r"[\s_-]+", "", str(key)).lower()
+
+
+def lookup_payload_path(payload, path):
+    """Follow a dotted path through nested dicts, matching keys case-insensitively. Returns text, or None."""
+    value = payload
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        keys = {normalize_field_key(key): key for key in value}
+        key = keys.get(normalize_field_key(part))
+        if key is None:
+            return None
+        value = value[key]
+    if isinstance(value, (dict, list)) or value is None or isinstance(value, bool):
+        return None
+    text = " ".join(str(value).split()).rstrip(".!? ")
+    return text or None
+
+
+def load_templates(path):
+    """Extra templates from a JSON file: a list of {"name", "fields", "required", "phrasings"} objects."""
     try:
-        engine = pyttsx3.init()
-        if engine: # Check if init succeeded
-             engine.setProperty('rate', SPEECH_RATE)
-             logging.info(f"pyttsx3 engine initialized with rate {SPEECH_RATE}.")
-        else:
-             logging.error("pyttsx3 engine initialization failed.")
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        templates = [AnnouncementTemplate(entry["name"], entry["fields"], entry.get("required", []), entry["phrasings"])
+                     for entry in entries]
     except Exception:
-        logging.exception("Failed to initialize pyttsx3 engine.")
-        engine = None # Ensure engine is None if init fails
+        logging.exception(f"Could not load announcement templates from {path}.")
+        return []
+    logging.info(f"Loaded {len(templates)} announcement template(s) from {path}.")
+    return templates
 
-logging.info(f"ElevenLabs TTS {'ENABLED' if USE_ELEVENLABS else 'DISABLED'}.")
-logging.info(f"pyttsx3 TTS {'ENABLED and initialized' if engine else ('DISABLED' if USE_ELEVENLABS else 'FAILED TO INITIALIZE')}.")
-logging.info("--- Initialization Complete ---")
+
+def payload_event(payload):
+    event = payload.get("event") if isinstance(payload, dict) else None
+    return event.strip().lower() if isinstance(event, str) else None
+
+
+def render_from_template(payload):
+    """Announce payload from the first matching template. Returns None when GPT should handle it."""
+    if not isinstance(payload, dict):
+        return None
+    route = TEMPLATE_EVENT_ROUTES.get(payload_event(payload))
+    if route == "gpt" or (route != "template" and not USE_TEMPLATES):
+        return None
+    for template in announcement_templates:
+        values = template.extract(payload)
+        if values is None:
+            continue
+        announcement = template.render(values)
+        if announcement:
+            template_announcements.inc(template=template.name)
+            logging.debug("Announcing from template '%s': '%s'", template.name, announcement)
+            return announcement
+    if route == "template":
+        logging.warning(f"Event '{payload_event(payload)}' is routed to templates, but none matched; using GPT.")
+    return None
+
+
+announcement_templates = [
+    # Name / Department / Location / Issue Description, at the top level or under "data"
+    AnnouncementTemplate(
+        "it_request",
+        {
+            "name": ["Name", "data.Name"],
+            "department": ["Department", "data.Department"],
+            "location": ["Location", "data.Location"],
+            "issue": ["Issue Description", "data.Issue Description"],
+        },
+        ["name", "issue"],
+        [
+            "Sir Cody of Technology, {name} of {department} in {location} summons you: {issue}.",
+            "A plea rises from {location}, Sir Cody. {name} of {department} reports: {issue}.",
+            "Sir Cody, {name} of {department} calls out from the shadows: {issue}.",
+            "Darkness gathers over {department}, Sir Cody. {name} speaks of trouble: {issue}.",
+            "Hark, Sir Cody of Technology. {name} seeks your aid: {issue}.",
+        ],
+    ),
+    # {"event": ..., "data": {"name": ..., "message": ..., "rating": ...}}
+    AnnouncementTemplate(
+        "rated_event",
+        {
+            "event": ["event"],
+            "name": ["data.name", "name"],
+            "message": ["data.message", "message"],
+            "rating": ["data.rating", "rating"],
+        },
+        ["name", "message"],
+        [
+            "Sir Cody of Technology, a message stirs from {name}: {message}.",
+            "Hark, Sir Cody. {name} sends word from the shadows: {message}.",
+            "A {event} echoes through the dark, Sir Cody. {name} proclaims: {message}.",
+            "From the depths, {name} whispers: {message}. The omens rate it {rating}.",
+            "Sir Cody, the spirits carry a {event} from {name}: {message}.",
+        ],
+    ),
+]
+if TEMPLATES_PATH:
+    announcement_templates[:0] = load_templates(TEMPLATES_PATH) # Custom templates take precedence
+
+
+# === PROMPT COMPACTION ===
+# Content sent to GPT is cleaned up and fitted into PROMPT_TOKEN_BUDGET: email bodies lose HTML, quoted
+# replies, signatures and disclaimers; JSON payloads lose empty and PROMPT_DROP_KEYS keys and are serialized
+# without whitespace instead of as a Python repr.
+QUOTE_HEADER = re.compile(
+    r"^(On .{1,200}wrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}|_{5,})\s*$",
+    re.IGNORECASE,
+)
+FORWARD_HEADER = re.compile(r"^From:\s.+$", re.IGNORECASE) # A quote header only below some new text
+SIGNATURE_DELIMITER = re.compile(r"^(--|__)\s*$|^Sent from my \w+", re.IGNORECASE)
+SIGN_OFF = re.compile(r"^(thanks|thank you|many thanks|regards|best regards|kind regards|warm regards|best|cheers|sincerely)[,.!]?\s*$", re.IGNORECASE)
+SIGN_OFF_KEEP_LINES = 3 # Lines kept after a sign-off: usually the name, title and department
+DISCLAIMER = re.compile(
+    r"(message|e-?mail|communication)s? (and any attachments? )?(is|are|may be|may contain)( \w+){0,3} (confidential|privileged)"
+    r"|privileged and confidential|intended (solely |only )?for the (use of the )?(individual|addressee|recipient)"
+    r"|intended recipient|(scanned|checked) for viruses|free (of|from) (any )?viruses|to unsubscribe",
+    re.IGNORECASE,
+)
+HTML_TAG = re.compile(r"<[a-zA-Z/!][^>]*>")
+token_encoding = None
+token_encoding_loaded = False
+
+
+def get_token_encoding():
+    """tiktoken's encoding for MODEL, loaded on first use; None means token counts are estimated."""
+    global token_encoding, token_encoding_loaded
+    if not token_encoding_loaded:
+        token_encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                token_encoding = tiktoken.encoding_for_model(MODEL)
+            except Exception:
+                logging.warning(f"tiktoken has no encoding for {MODEL}; estimating prompt tokens instead.")
+    return token_encoding
+
+
+def count_tokens(text):
+    encoding = get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4 # Roughly four characters per token for English text
+
+
+def strip_html(text):
+    if not HTML_TAG.search(text):
+        return text
+    text = re.sub(r"<(script|style)\b.*?</\1\s*>", " ", text, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r"<\s*(/p|/h\d)\b[^>]*>", "\n\n", text, flags=re.IGNORECASE) # Paragraphs stay apart, so a disclaimer is dropped on its own
+    text = re.sub(r"<\s*(br|/div|/li|/tr)\b[^>]*>", "\n", text, flags=re.IGNORECASE)
+    return html.unescape(HTML_TAG.sub(" ", text))
+
+
+def clean_email_text(text):
+    """The new part of an email: no HTML, quoted replies, signature blocks or legal disclaimers."""
+    kept = []
+    keep_after_sign_off = None
+    for line in strip_html(text).replace("\r\n", "\n").split("\n"):
+        line = " ".join(line.split())
+        if (line.startswith(">") or QUOTE_HEADER.match(line) or SIGNATURE_DELIMITER.match(line)
+                or (FORWARD_HEADER.match(line) and any(kept))):
+            break # Everything below is quoted history or signature
+        if keep_after_sign_off is not None:
+            if len(line) > 150 and DISCLAIMER.search(line):
+                break # A legal footer right under the signature
+            if line:
+                kept.append(line)
+                keep_after_sign_off -= 1
+                if keep_after_sign_off == 0:
+                    break
+            continue
+        kept.append(line)
+        if SIGN_OFF.match(line):
+            keep_after_sign_off = SIGN_OFF_KEEP_LINES
+
+    paragraphs = [p.strip() for p in "\n".join(kept).split("\n\n") if p.strip()]
+    while paragraphs and len(paragraphs[-1]) > 150 and DISCLAIMER.search(paragraphs[-1]):
+        paragraphs.pop() # Legal footers trail the email; the same words further up describe the problem
+    return re.sub(r"\n{3,}", "\n\n", "\n\n".join(paragraphs))
+
+
+def compact_payload(value):
+    """value without empty or irrelevant keys; long or multi-line strings are cleaned like email text."""
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if normalize_field_key(key) in PROMPT_DROP_KEYS:
+                continue
+            item = compact_payload(item)
+            if item not in (None, "", [], {}):
+                compacted[key] = item
+        return compacted
+    if isinstance(value, list):
+        return [item for item in (compact_payload(item) for item in value) if item not in (None, "", [], {})]
+    if isinstance(value, str):
+        if "\n" in value or "<" in value:
+            return clean_email_text(value) or value.strip()
+        return value.strip()
+    return value
+
+
+def compact_content(input_data):
+    """input_data as compact text for the GPT prompt."""
+    if isinstance(input_data, dict):
+        return json.dumps(compact_payload(input_data), ensure_ascii=False, separators=(",", ":"), default=str)
+    if isinstance(input_data, str):
+        return clean_email_text(input_data) or input_data.strip() # Never an empty prompt
+    return str(input_data)
+
+
+def fit_token_budget(text, budget):
+    """Cut text down to about budget tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = get_token_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:budget]) + "…"
+    return text[:budget * 4] + "…"
+
+
+def prepare_prompt_content(input_data):
+    """Compact content for the GPT prompt, within PROMPT_TOKEN_BUDGET; logs the token counts before and after."""
+    if isinstance(input_data, DigestPayload):
+        # Every request in the digest gets an equal share of the budget
+        share = max(1, PROMPT_TOKEN_BUDGET // max(1, len(input_data)))
+        original = "\n\n".join(f"Request {number}:\n{payload}" for number, payload in enumerate(input_data, start=1))
+        content = "\n\n".join(f"Request {number}:\n{fit_token_budget(compact_content(payload), share)}"
+                              for number, payload in enumerate(input_data, start=1))
+    else:
+        original = input_data if isinstance(input_data, str) else str(input_data)
+        content = fit_token_budget(compact_content(input_data), PROMPT_TOKEN_BUDGET)
+
+    before, after = count_tokens(original), count_tokens(content)
+    prompt_tokens_saved.inc(max(0, before - after))
+    logging.debug("Prompt content compacted from %s to %s tokens (budget %s).", before, after, PROMPT_TOKEN_BUDGET)
+    return content
 
 
 # === GPT SUMMARIZER ===
-def summarize_with_gpt(input_data):
-    logging.info("Entering summarize_with_gpt function.")
-    prompt = None # Initialize prompt
-    content_to_process = None # Initialize content_to_process
+class DigestPayload(list):
+    """Payloads from a burst of webhooks, summarized together as one digest announcement."""
 
-    try:
-        if isinstance(input_data, dict):
-            logging.info("Input data is dictionary (JSON assumed).")
-            content_to_process = str(input_data)
-            prompt = (
-                 "You are ShadowDesk, a dark, witty herald for the IT department. "
-                 "You have received structured data about an IT request. "
-                 "Craft ONE short spoken announcement (under 35 words) addressed to 'Sir Cody of Technology'. "
-                 "Mood: mysterious, slightly ominous; vary wording each time. "
-                 "Include—verbatim where possible—the submitter's Name, Department, and Location fields, "
-                 "and paraphrase the Issue Description field from the provided data structure. "
-                 "Return ONLY that single sentence."
-                 "IMPORTANT: Do not use technical terms, JSON keys, or words like 'extracted' or 'field' in your final output sentence."
-             )
-        elif isinstance(input_data, str):
-            logging.info("Input data is string (plain text assumed).")
-            content_to_process = input_data
-            prompt = (
-                "You are ShadowDesk, a dark, witty herald for the IT department, addressing 'Sir Cody of Technology'. "
-                "You have intercepted the raw text body of an incoming email concerning an IT service request. "
-                "Read the following email text carefully. "
-                "Distill its essential information into ONE single, concise spoken announcement (under 35 words). "
-                "Maintain a mysterious and slightly ominous tone, varying your phrasing each time for dramatic effect. "
-                "From the provided email text, identify and try to include the submitter's Name and their Department or Location *if these details are clearly mentioned within the text*. "
-                "Focus on capturing and briefly paraphrasing the core Issue or request described in the email. "
-                "Return ONLY the announcement sentence itself. No extra text or explanation."
-                "IMPORTANT: Avoid technical jargon, variable names like 'name' or 'issue', or meta-commentary like 'The email states...' or 'Request details:'. Just the announcement."
-            )
-        else:
-            logging.error(f"Invalid data type passed to summarize_with_gpt: {type(input_data)}")
-            return "ShadowDesk is perplexed by the formless void of data." # Return error message
 
-        if not client: # Check if client was initialized
-             logging.error("OpenAI client is not initialized (check API key). Cannot call GPT.")
-             return "ShadowDesk is silent - the connection to the ether is broken."
+def choose_gpt_prompt(input_data, max_words=None):
+    """Pick the system prompt for input_data. Returns (prompt, None), or (None, announcement) when a template
+    announces it locally or GPT can't be used. max_words shortens the announcement when the queue is backed up."""
+    if isinstance(input_data, DigestPayload):
+        logging.debug("Input data is a digest of %s requests.", len(input_data))
+        prompt = (
+            "You are ShadowDesk, a dark, witty herald for the IT department, addressing 'Sir Cody of Technology'. "
+            f"A burst of {len(input_data)} IT requests has arrived at once; each is given below as structured data or raw email text. "
+            "Craft ONE short spoken digest (under 60 words) that says how many requests arrived, "
+            "groups them by department, location or submitter where possible (for example: 'three new requests from Finance, ...'), "
+            "and names the most pressing issue. "
+            "Mood: mysterious, slightly ominous; vary wording each time. "
+            "Return ONLY the digest itself. No extra text or explanation."
+            "IMPORTANT: Do not use technical terms, JSON keys, request numbers, or words like 'extracted' or 'field' in your final output."
+        )
+    elif isinstance(input_data, dict):
+        logging.debug("Input data is dictionary (JSON assumed).")
+        announcement = render_from_template(input_data)
+        if announcement:
+            return None, announcement
+        prompt = (
+             "You are ShadowDesk, a dark, witty herald for the IT department. "
+             "You have received structured data about an IT request. "
+             "Craft ONE short spoken announcement (under 35 words) addressed to 'Sir Cody of Technology'. "
+             "Mood: mysterious, slightly ominous; vary wording each time. "
+             "Include—verbatim where possible—the submitter's Name, Department, and Location fields, "
+             "and paraphrase the Issue Description field from the provided data structure. "
+             "Return ONLY that single sentence."
+             "IMPORTANT: Do not use technical terms, JSON keys, or words like 'extracted' or 'field' in your final output sentence."
+         )
+    elif isinstance(input_data, str):
+        logging.debug("Input data is string (plain text assumed).")
+        prompt = (
+            "You are ShadowDesk, a dark, witty herald for the IT department, addressing 'Sir Cody of Technology'. "
+            "You have intercepted the raw text body of an incoming email concerning an IT service request. "
+            "Read the following email text carefully. "
+            "Distill its essential information into ONE single, concise spoken announcement (under 35 words). "
+            "Maintain a mysterious and slightly ominous tone, varying your phrasing each time for dramatic effect. "
+            "From the provided email text, identify and try to include the submitter's Name and their Department or Location *if these details are clearly mentioned within the text*. "
+            "Focus on capturing and briefly paraphrasing the core Issue or request described in the email. "
+            "Return ONLY the announcement sentence itself. No extra text or explanation."
+            "IMPORTANT: Avoid technical jargon, variable names like 'name' or 'issue', or meta-commentary like 'The email states...' or 'Request details:'. Just the announcement."
+        )
+    else:
+        logging.error(f"Invalid data type passed to summarize_with_gpt: {type(input_data)}")
+        return None, INVALID_DATA_MESSAGE # Return error message
+
+    if not client: # Check if client was initialized
+         logging.error("OpenAI client is not initialized (check API key). Cannot call GPT.")
+         return None, NO_CLIENT_MESSAGE
 
-        logging.info(f"Attempting GPT call with model {MODEL}.")
-        # Log first 100 chars of content being sent (avoid logging huge emails)
-        logging.debug(f"Content sent to GPT (first 100 chars): {content_to_process[:100]}")
+    if max_words:
+        prompt += f" The announcement queue is backed up: keep it under {max_words} words, overriding any length given above."
+    return prompt, None
 
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user",   "content": content_to_process}
-        ]
 
+def build_gpt_messages(input_data, prompt):
+    """Chat messages for a GPT call. Compacting the content is the costly part, so this runs only on a cache miss."""
+    logging.debug("Attempting GPT call with model %s.", MODEL)
+    content_to_process = prepare_prompt_content(input_data)
+    # Log first 100 chars of content being sent (avoid logging huge emails)
+    logging.debug("Content sent to GPT (first 100 chars): %s", content_to_process[:100])
+
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user",   "content": content_to_process}
+    ]
+    return messages
+
+
+def record_gpt_usage(usage):
+    if usage is None:
+        return
+    gpt_tokens.inc(usage.prompt_tokens or 0, kind="prompt")
+    gpt_tokens.inc(usage.completion_tokens or 0, kind="completion")
+
+
+def summarize_with_gpt(input_data, max_words=None):
+    logging.debug("Entering summarize_with_gpt function.")
+
+    try:
+        prompt, fallback = choose_gpt_prompt(input_data, max_words)
+        if fallback:
+            return fallback
+
+        cache_key = summary_cache_key(input_data, max_words) if summary_cache else None
+        if cache_key:
+            cached = summary_cache.get(cache_key)
+            if cached:
+                logging.debug("Using cached GPT summary: '%s'", cached)
+                return cached
+
+        messages = build_gpt_messages(input_data, prompt)
+
+        started_at = time.time()
         response = client.chat.completions.create(
             model=MODEL,
             messages=messages,
             temperature=0.7
         )
+        gpt_seconds.observe(time.time() - started_at, mode="complete")
+        record_gpt_usage(response.usage)
         summary = response.choices[0].message.content.strip()
-        logging.info(f"Successfully received GPT summary: '{summary}'")
-        logging.info("Exiting summarize_with_gpt function successfully.")
+        logging.debug("Successfully received GPT summary: '%s'", summary)
+        if cache_key and summary:
+            summary_cache.put(cache_key, summary)
+        logging.debug("Exiting summarize_with_gpt function successfully.")
         return summary
 
     # Catch OpenAI specific errors if desired (requires importing openai errors)
@@ -128,236 +861,2473 @@ def summarize_with_gpt(input_data):
     except Exception as e:
         # Use logging.exception to include traceback
         logging.exception("An unexpected error occurred during GPT processing.")
-        logging.info("Exiting summarize_with_gpt function with error.")
+        failures.inc(engine="gpt")
+        logging.debug("Exiting summarize_with_gpt function with error.")
         # Consider returning a more specific error message based on e if possible
-        return "ShadowDesk falters—a disturbance in the connection prevents the message."
+        return GPT_ERROR_MESSAGE
 
-# === TTS SPEAKER ===
-def speak_with_elevenlabs(text):
-    logging.info("Entering speak_with_elevenlabs function.")
-    if not text:
-        logging.warning("speak_with_elevenlabs called with empty text. Skipping.")
-        return False # Indicate failure
 
-    if not ELEVENLABS_API_KEY:
-        logging.error("ELEVENLABS_API_KEY not set. Cannot use ElevenLabs.")
-        return False # Indicate failure
+# Sentence ends, optionally followed by closing quotes/brackets, or clause punctuation; both need trailing whitespace
+FRAGMENT_BOUNDARY = re.compile(r'([.!?…]+["\'”’)\]]*|[,;:—–])\s+')
+# Words whose period is not a sentence end ("Dr. Smith"); single initials ("J. Smith") are covered separately.
+# Only words that rarely end a sentence belong here - "etc." or "Inc." often do.
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "sr", "jr", "prof", "rev", "gen", "capt", "lt", "sgt", "col",
+                 "mt", "ft", "dept", "bldg", "vs", "approx", "e.g", "i.e"}
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
-    headers = {
-        "Accept": "audio/mpeg", # Explicitly accept mpeg
-        "xi-api-key": ELEVENLABS_API_KEY,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {"stability": 0.4, "similarity_boost": 0.7}
-    }
-    tmp_path = None # Initialize tmp_path
 
+def ends_with_abbreviation(text):
+    """True when text ends in an abbreviation or initial whose period doesn't end the sentence."""
+    if not text.endswith(".") or text.endswith(".."):
+        return False
+    word = text.rsplit(None, 1)[-1].lstrip("\"'“‘([").rstrip(".").lower()
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def split_fragments(buffer):
+    """Split complete fragments off the front of buffer. Returns (fragments, remainder)."""
+    fragments = []
+    start = 0
+    for match in FRAGMENT_BOUNDARY.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        if ends_with_abbreviation(candidate):
+            continue # "Dr. Smith" stays in one fragment
+        is_sentence_end = match.group(1)[0] in ".!?…"
+        # Clause breaks only count once the fragment is long enough to sound natural on its own
+        if candidate and (is_sentence_end or len(candidate) >= STREAM_MIN_FRAGMENT_CHARS):
+            fragments.append(candidate)
+            start = match.end()
+    return fragments, buffer[start:]
+
+
+def summarize_with_gpt_stream(input_data, max_words=None):
+    """Like summarize_with_gpt, but yields the announcement in speakable fragments while GPT is still writing it."""
+    logging.debug("Entering summarize_with_gpt_stream function.")
+    prompt, fallback = choose_gpt_prompt(input_data, max_words)
+    if fallback:
+        yield fallback
+        return
+
+    cache_key = summary_cache_key(input_data, max_words) if summary_cache else None
+    if cache_key:
+        cached = summary_cache.get(cache_key)
+        if cached:
+            logging.debug("Using cached GPT summary: '%s'", cached)
+            ready, rest = split_fragments(cached)
+            yield from ready
+            if rest.strip():
+                yield rest.strip()
+            return
+
+    fragments = []
+    buffer = ""
     try:
-        logging.info(f"Sending request to ElevenLabs API for voice {ELEVENLABS_VOICE_ID}.")
-        response = requests.post(url, headers=headers, json=payload, stream=True, timeout=60) # Added timeout
+        messages = build_gpt_messages(input_data, prompt)
+        started_at = time.time()
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in response:
+            if not chunk.choices:
+                record_gpt_usage(getattr(chunk, "usage", None)) # The final chunk carries the usage
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            buffer += delta
+            ready, buffer = split_fragments(buffer)
+            for fragment in ready:
+                fragments.append(fragment)
+                yield fragment
+        if buffer.strip():
+            fragments.append(buffer.strip())
+            yield buffer.strip()
+        gpt_seconds.observe(time.time() - started_at, mode="stream")
+        logging.debug("Successfully streamed GPT summary in %s fragment(s): '%s'", len(fragments), ' '.join(fragments))
+        if cache_key and fragments:
+            summary_cache.put(cache_key, " ".join(fragments))
+    except Exception:
+        logging.exception("An unexpected error occurred during streamed GPT processing.")
+        failures.inc(engine="gpt")
+        if not fragments:
+            yield GPT_ERROR_MESSAGE
 
-        logging.info(f"ElevenLabs API response status code: {response.status_code}")
-        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+# === AUDIO CACHE ===
+class AudioCache:
+    """Rendered audio clips on disk, one file per key, evicting the least recently used once over max_bytes.
 
-        # Create temp file BEFORE writing
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            tmp_path = tmp.name # Store path immediately
-            logging.info(f"Saving ElevenLabs audio to temporary file: {tmp_path}")
-            bytes_written = 0
-            for chunk in response.iter_content(chunk_size=4096):
-                tmp.write(chunk)
-                bytes_written += len(chunk)
-            logging.info(f"Finished writing {bytes_written} bytes to temporary file.")
-
-        if bytes_written == 0:
-             logging.warning("ElevenLabs returned an empty audio stream.")
-             # Cleanup potentially empty file
-             if tmp_path and os.path.exists(tmp_path):
-                  os.remove(tmp_path)
-             return False # Indicate failure
-
-        # --- Play the file ---
-        logging.info(f"Attempting to play audio file: {tmp_path}")
-        # Use a more robust way to find ffplay or default player if possible
-        # For simplicity, keeping os.system for now
-        play_command = f'ffplay -nodisp -autoexit "{tmp_path}"'
-        logging.info(f"Executing playback command: {play_command}")
-        exit_code = os.system(play_command)
-        if exit_code != 0:
-            logging.error(f"Audio playback command failed with exit code {exit_code}. Is ffplay installed and in PATH?")
-            # Fallback or alternative playback method could be added here
-            return False # Indicate failure
+    The directory itself is the index and a file's mtime is its last use, so processes sharing the
+    directory (gunicorn workers, the speaker) share one budget and see each other's clips.
+    """
 
-        logging.info("Audio playback finished.")
-        logging.info("Exiting speak_with_elevenlabs function successfully.")
-        return True # Indicate success
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        entries, total_bytes = self._evict()
+        logging.info(f"Audio cache holds {entries} clip(s), {total_bytes} bytes, in {self.directory}.")
 
-    except requests.exceptions.RequestException as e:
-        # Catch specific requests errors (network, timeout, etc.)
-        logging.exception(f"ElevenLabs API request failed: {e}")
-        return False # Indicate failure
-    except Exception as e:
-        # Catch other potential errors (file writing, playback command)
-        logging.exception("An unexpected error occurred during ElevenLabs processing or playback.")
-        return False # Indicate failure
-    finally:
-        # --- Cleanup ---
-        if tmp_path and os.path.exists(tmp_path):
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".audio")
+
+    def _files(self):
+        """(last use, path, size) of every cached clip, least recently used first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            if name.endswith(".audio"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue # Evicted by another process meanwhile
+                files.append((stat.st_mtime, path, stat.st_size))
+        return sorted(files)
+
+    def _evict(self):
+        """Remove the least recently used clips until the directory fits max_bytes. Returns (entries, bytes)."""
+        files = self._files()
+        total_bytes = sum(size for _, _, size in files)
+        while total_bytes > self.max_bytes and files:
+            _, path, size = files.pop(0)
             try:
-                logging.info(f"Attempting to remove temporary file: {tmp_path}")
-                # Add a small delay before removing, might help on some systems
-                time.sleep(0.5)
-                os.remove(tmp_path)
-                logging.info("Temporary file removed successfully.")
-            except Exception as e:
-                # Log exception during cleanup but don't override primary return status
-                logging.exception(f"Error removing temporary file {tmp_path}: {e}")
+                os.remove(path)
+            except FileNotFoundError:
+                pass # Another process evicted it first
+            except OSError:
+                logging.exception(f"Could not remove cached audio {path}.")
+            total_bytes -= size
+        return len(files), total_bytes
 
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path) # Marks the clip as recently used, for every process
+        except FileNotFoundError:
+            audio = None
+        except OSError:
+            logging.exception(f"Could not read cached audio {key}.")
+            audio = None
+        with self.lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return audio
 
-def speak_with_pyttsx3(text):
-    logging.info("Entering speak_with_pyttsx3 function.")
-    if not text:
-        logging.warning("speak_with_pyttsx3 called with empty text. Skipping.")
-        return False # Indicate failure
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logging.exception(f"Could not write cached audio {key}.")
+            return
+        with self.lock:
+            self._evict()
 
-    if not engine:
-        logging.error("pyttsx3 engine is not initialized. Cannot speak.")
-        return False # Indicate failure
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
 
-    try:
-        logging.info(f"Speaking with pyttsx3 (rate {SPEECH_RATE}): '{text}'")
-        engine.say(text)
-        engine.runAndWait()
-        logging.info("pyttsx3 runAndWait finished.")
-        logging.info("Exiting speak_with_pyttsx3 function successfully.")
-        return True # Indicate success
-    except Exception as e:
-        logging.exception("An unexpected error occurred during pyttsx3 processing.")
-        logging.info("Exiting speak_with_pyttsx3 function with error.")
-        return False # Indicate failure
+    def stats(self):
+        files = self._files()
+        with self.lock:
+            return {"entries": len(files), "bytes": sum(size for _, _, size in files), "hits": self.hits, "misses": self.misses}
 
-def speak_text(text):
-    logging.info("Entering speak_text function.")
-    if not text:
-        logging.warning("speak_text called with empty text.")
-        return # Or return an error status if preferred
 
-    success = False
-    if USE_ELEVENLABS:
-        logging.info("Attempting TTS using ElevenLabs.")
-        success = speak_with_elevenlabs(text)
-        if not success:
-            logging.error("ElevenLabs TTS failed.")
-            # Optionally, add fallback to pyttsx3 here if desired
-            # logging.info("Falling back to pyttsx3.")
-            # success = speak_with_pyttsx3(text)
+def audio_cache_key(text, engine_name="elevenlabs"):
+    if engine_name == "elevenlabs":
+        material = [engine_name, text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS]
     else:
-        logging.info("Attempting TTS using pyttsx3.")
-        success = speak_with_pyttsx3(text)
-        if not success:
-             logging.error("pyttsx3 TTS failed.")
+        material = [engine_name, text, SPEECH_RATE]
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
 
-    if success:
-         logging.info("Exiting speak_text function successfully.")
-    else:
-         logging.info("Exiting speak_text function with errors.")
 
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES) if AUDIO_CACHE_MAX_BYTES > 0 else None
+warmup_lock = threading.Lock()
+warmup_started = False
 
-# === WEBHOOK ENDPOINT ===
-@app.route('/webhook', methods=['POST'])
-def handle_webhook():
-    logging.info("--- Webhook request received ---")
-    received_data = None
-    content_type = request.content_type
-    summary = None # Initialize summary
 
-    logging.info(f"Request Content-Type: {content_type}")
-    logging.debug(f"Request Headers: {request.headers}") # Log all headers at DEBUG level
+def prerender_canned_phrases():
+    """Make sure every fixed announcement is in the audio cache so it plays even when ElevenLabs is down."""
+    for phrase in CANNED_PHRASES:
+        if audio_cache_key(phrase, "elevenlabs" if USE_ELEVENLABS else "pyttsx3") in audio_cache:
+            continue
+        logging.info(f"Pre-rendering canned phrase: '{phrase}'")
+        if USE_ELEVENLABS:
+            rendered = synthesize_with_elevenlabs(phrase)
+        else:
+            rendered = render_with_pyttsx3(phrase)
+        if rendered is None:
+            logging.warning(f"Could not pre-render canned phrase: '{phrase}'")
+    logging.info(f"Canned phrases ready; audio cache: {audio_cache.stats()}")
 
-    try:
-        if content_type and 'application/json' in content_type: # More robust check
+
+def start_audio_cache_warmup():
+    """Pre-render canned phrases in the background, once."""
+    global warmup_started
+    if not audio_cache or not (USE_ELEVENLABS or PYTTSX3_RENDER):
+        return
+    with warmup_lock:
+        if warmup_started:
+            return
+        warmup_started = True
+    threading.Thread(target=prerender_canned_phrases, name="audio-cache-warmup", daemon=True).start()
+
+
+# === AUDIO PLAYBACK ===
+# Announcements are played by a single long-lived player, created on first use:
+#   miniaudio - decodes clips in-process as they download and feeds one output device that stays open
+#   ffplay    - fallback; starts one ffplay process per clip
+#   null      - discards the audio at NULL_PLAYBACK_RATE; for benchmarks and hosts without a sound card
+# With SPEAKER_ADDRESS set, clips are sent to the speaker process instead, which plays them on one of these.
+if miniaudio is not None:
+    class AudioStreamSource(miniaudio.StreamableSource):
+        """Feeds an AudioStream to a miniaudio decoder; reads block until the download catches up."""
+
+        def __init__(self, stream):
+            self.chunks = stream.iter_chunks()
+            self.data = bytearray() # Everything read so far, so the decoder can seek back while probing
+            self.position = 0
+
+        def read(self, num_bytes):
+            while len(self.data) < self.position + num_bytes:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break # Download finished; a short read ends the clip
+                self.data += chunk
+            data = bytes(self.data[self.position:self.position + num_bytes])
+            self.position += len(data)
+            return data
+
+        def seek(self, offset, origin):
+            self.position = offset if origin == miniaudio.SeekOrigin.START else self.position + offset
+            return True
+
+
+class PlaybackClip:
+    """One clip waiting in (or playing from) the miniaudio queue; samples keep growing until it is complete."""
+
+    def __init__(self, samples, label):
+        self.samples = samples
+        self.label = label
+        self.position = 0
+        self.complete = False # Set once the whole clip is decoded
+        self.skipped = False
+        self.decode_failed = False # The rest of the clip could not be decoded
+        self.started = threading.Event()
+        self.finished = threading.Event()
+
+
+class MiniaudioPlayer:
+    """In-process playback: clips are decoded to PCM while they download and queued for one always-open output device."""
+    name = "miniaudio"
+
+    def __init__(self):
+        self.lock = threading.Lock() # Held only briefly; the device callback takes it too
+        self.clips = deque()
+        self.current = None
+        self.played = 0
+        self.skipped = 0
+        self.device = miniaudio.PlaybackDevice(
+            output_format=miniaudio.SampleFormat.SIGNED16,
+            nchannels=PLAYBACK_CHANNELS,
+            sample_rate=PLAYBACK_SAMPLE_RATE,
+            app_name="ShadowDesk",
+        )
+        feeder = self._feed()
+        next(feeder) # Prime the generator as miniaudio expects
+        self.device.start(feeder)
+        logging.info(f"miniaudio output device opened: {self.device.backend}, {PLAYBACK_SAMPLE_RATE} Hz.")
+
+    def _feed(self):
+        """Device callback: fill each buffer from the current clip, moving on to queued clips, else silence."""
+        required_frames = yield b""
+        while True:
+            needed = required_frames * PLAYBACK_CHANNELS
+            out = array.array("h")
+            with self.lock:
+                while needed > 0 and (self.current or self.clips):
+                    if self.current is None:
+                        self.current = self.clips.popleft()
+                        self.current.started.set()
+                    clip = self.current
+                    chunk = clip.samples[clip.position:clip.position + needed]
+                    out.extend(chunk)
+                    clip.position += len(chunk)
+                    needed -= len(chunk)
+                    if clip.position >= len(clip.samples):
+                        if not clip.complete:
+                            break # Decoding fell behind the device; pad with silence until more arrives
+                        clip.finished.set()
+                        self.current = None
+                        self.played += 1
+            if needed > 0:
+                out.extend(array.array("h", bytes(needed * 2))) # Silence
+            required_frames = yield out
+
+    def _decode_rest(self, clip, blocks):
+        """Append the rest of a clip's samples as its download continues."""
+        try:
+            for block in blocks:
+                if clip.skipped:
+                    break # No one will hear the rest
+                with self.lock:
+                    clip.samples.extend(block)
+        except miniaudio.MiniaudioError:
+            logging.exception(f"Could not decode the rest of '{clip.label or 'clip'}'.")
+            clip.decode_failed = True
+        finally:
+            with self.lock:
+                clip.complete = True
+
+    def play(self, stream, label=None, on_start=None):
+        if not stream.wait_for_data():
+            logging.error("No audio to play.")
+            return False
+        try:
+            blocks = miniaudio.stream_any(
+                AudioStreamSource(stream),
+                source_format=miniaudio.FileFormat.WAV if stream.chunks[0].startswith(b"RIFF") else miniaudio.FileFormat.MP3,
+                output_format=miniaudio.SampleFormat.SIGNED16,
+                nchannels=PLAYBACK_CHANNELS,
+                sample_rate=PLAYBACK_SAMPLE_RATE,
+                frames_to_read=max(1, PLAYBACK_SAMPLE_RATE // 10),
+            )
+            first = next(blocks, None)
+        except miniaudio.MiniaudioError:
+            logging.exception("Could not decode audio clip.")
+            return False
+        if not first:
+            logging.error("No audio to play.")
+            return False
+
+        # Playback starts with the first block; the rest is decoded while the device plays
+        clip = PlaybackClip(first, label)
+        threading.Thread(target=self._decode_rest, args=(clip, blocks), name="miniaudio-decode", daemon=True).start()
+        with self.lock:
+            self.clips.append(clip)
+        clip.started.wait()
+        if not clip.skipped:
+            logging.debug("Playback started: %s", label or 'clip')
+            if on_start:
+                on_start()
+        clip.finished.wait()
+        logging.debug("Playback %s: %s", 'skipped' if clip.skipped else 'finished', label or 'clip')
+        if stream.failed:
+            logging.error(f"Audio stream failed; '{label or 'clip'}' was cut short.")
+        return not stream.failed and not clip.decode_failed
+
+    def _skip(self, clip):
+        # Caller holds self.lock
+        clip.skipped = True
+        clip.started.set()
+        clip.finished.set()
+        self.skipped += 1
+
+    def skip(self):
+        with self.lock:
+            if self.current is None:
+                return False
+            self._skip(self.current)
+            self.current = None
+            return True
+
+    def stop(self):
+        with self.lock:
+            stopped = 0
+            if self.current is not None:
+                self._skip(self.current)
+                self.current = None
+                stopped += 1
+            while self.clips:
+                self._skip(self.clips.popleft())
+                stopped += 1
+            return stopped
+
+    def status(self):
+        with self.lock:
+            return {
+                "backend": self.name,
+                "playing": self.current.label if self.current else None,
+                "queue_depth": len(self.clips),
+                "played": self.played,
+                "skipped": self.skipped,
+            }
+
+
+class FfplayPlayer:
+    """Fallback backend: one ffplay process per clip, streamed over stdin or played from a temp file."""
+    name = "ffplay"
+
+    def __init__(self):
+        self.play_lock = threading.Lock() # One clip at a time
+        self.lock = threading.Lock()
+        self.process = None
+        self.label = None
+        self.waiting = 0
+        self.played = 0
+        self.skipped = 0
+        self.skip_requested = False
+
+    def play(self, stream, label=None, on_start=None):
+        with self.lock:
+            self.waiting += 1
+        with self.play_lock:
+            with self.lock:
+                self.waiting -= 1
+                self.label = label
+                self.skip_requested = False
             try:
-                received_data = request.get_json() # Use get_json for better error handling
-                if received_data is None:
-                     logging.warning("Content-Type is JSON, but parsing returned None. Check JSON validity.")
-                     # Log raw body if possible (might be large)
-                     logging.debug(f"Raw request body (first 500 chars): {request.get_data(as_text=True)[:500]}")
+                if STREAM_PLAYBACK:
+                    success = self._play_stream(stream, on_start)
                 else:
-                     logging.info("Successfully parsed JSON data.")
-                     logging.debug(f"Received JSON data structure: {received_data}")
+                    success = self._play_file(stream, on_start)
+            finally:
+                with self.lock:
+                    self.process = None
+                    self.label = None
+                    if self.skip_requested:
+                        self.skipped += 1
+                        success = True # Skipped on purpose, not a playback failure
+                    elif success:
+                        self.played += 1
+            return success
 
-            except Exception as json_error: # Catch potential JSON parsing errors
-                 logging.exception("Error parsing JSON request body.")
-                 # Log raw body if possible (might be large)
-                 logging.debug(f"Raw request body (first 500 chars): {request.get_data(as_text=True)[:500]}")
-                 return jsonify({"error": "Invalid JSON format"}), 400 # Return specific error
+    def _start(self, play_command, **kwargs):
+        player = subprocess.Popen(play_command, **kwargs)
+        with self.lock:
+            self.process = player
+        return player
 
-        elif content_type and 'text/plain' in content_type:
-            try:
-                received_data = request.data.decode('utf-8')
-                logging.info("Successfully decoded text/plain data.")
-                logging.debug(f"Received text data (first 500 chars): {received_data[:500]}")
-            except UnicodeDecodeError:
-                 logging.exception("Error decoding request body as UTF-8 text.")
-                 return jsonify({"error": "Invalid UTF-8 encoding in text body"}), 400
-            except Exception:
-                 logging.exception("Error reading text request body.")
-                 return jsonify({"error": "Could not read text request body"}), 400
-        else:
-            # Handle unsupported or missing Content-Type
-            logging.warning(f"Unsupported or missing Content-Type: {content_type}. Attempting to read raw data as text.")
-            try:
-                # Try decoding as text, but don't assume it will work
-                received_data = request.data.decode('utf-8')
-                logging.info("Read raw data (decoded as text fallback).")
-                logging.debug(f"Received raw fallback data (first 500 chars): {received_data[:500]}")
-            except Exception:
-                # If decoding fails, maybe it's binary or empty
-                 received_data = request.data
-                 logging.warning(f"Could not decode raw data as text (length: {len(received_data)} bytes). Passing raw bytes might fail later.")
-                 # You might want to reject binary data here if you don't expect it
-                 # return jsonify({"error": "Unsupported content type and failed to read as text"}), 415
-
-        # --- Process the received data ---
-        if not received_data:
-            logging.warning("Received empty or unparseable request body.")
-            # Decide if you want to process empty requests or return an error
-            # return jsonify({"error": "Empty request body"}), 400
-            summary = "ShadowDesk senses a void... an empty request arrived."
-            logging.info(f"Using default summary for empty request: '{summary}'")
-        else:
-            # Call GPT
-            summary = summarize_with_gpt(received_data) # This function now returns error messages too
+    def _play_stream(self, stream, on_start):
+        """Pipe audio into ffplay's stdin as it arrives. Returns True on success."""
+        play_command = ["ffplay", "-nodisp", "-autoexit", "-loglevel", "error", "-i", "pipe:0"]
+        logging.debug("Streaming audio into: %s", ' '.join(play_command))
+        try:
+            # Start the player before the first chunk so its startup overlaps the download
+            player = self._start(play_command, stdin=subprocess.PIPE)
+        except OSError:
+            logging.exception("Could not start ffplay. Is ffplay installed and in PATH?")
+            return False
 
-        # --- Speak the summary (or error message from GPT) ---
-        if summary: # Check if summary is not None or empty
-            speak_text(summary)
-        else:
-             logging.error("Summary generation failed, nothing to speak.")
-             # Potentially speak a generic error message here?
-             # speak_text("ShadowDesk apologizes, an internal error occurred.")
+        bytes_written = 0
+        try:
+            for chunk in stream.iter_chunks():
+                if bytes_written == 0:
+                    if on_start:
+                        on_start()
+                player.stdin.write(chunk)
+                bytes_written += len(chunk)
+            player.stdin.close()
+        except (BrokenPipeError, OSError):
+            if not self.skip_requested:
+                logging.exception("Audio player closed its input early.")
 
-        logging.info("--- Webhook request processing complete ---")
-        # Return "204 No Content" only if everything seemed okay, otherwise Flask default is 200 OK
-        # Or consider returning the summary or an error status in the response body.
-        return '', 204
+        if stream.failed:
+            logging.error("Audio stream failed; stopping playback.")
+            player.kill()
+            player.wait()
+            return False
 
-    except Exception as e:
-        # Catch-all for any unexpected errors during request handling
-        logging.exception("An unexpected error occurred in the main webhook handler.")
-        # Return a generic server error response
-        return jsonify({"error": "Internal Server Error"}), 500
+        exit_code = player.wait()
+        if exit_code != 0 and not self.skip_requested:
+            logging.error(f"Audio playback command failed with exit code {exit_code}.")
+            return False
+        logging.debug("Audio playback finished (%s bytes streamed).", bytes_written)
+        return True
+
+    def _play_file(self, stream, on_start):
+        """Play MP3 bytes through ffplay from a temp file. Returns True on success."""
+        audio = stream.read_all()
+        if not audio:
+            logging.error("No audio to play.")
+            return False
+        tmp_path = None # Initialize tmp_path
+
+        try:
+            # Create temp file BEFORE writing
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+                tmp_path = tmp.name # Store path immediately
+                logging.debug("Saving audio to temporary file: %s", tmp_path)
+                tmp.write(audio)
+
+            # --- Play the file ---
+            play_command = ["ffplay", "-nodisp", "-autoexit", "-loglevel", "error", tmp_path]
+            logging.debug("Executing playback command: %s", ' '.join(play_command))
+            player = self._start(play_command)
+            if on_start:
+                on_start()
+            exit_code = player.wait()
+            if exit_code != 0 and not self.skip_requested:
+                logging.error(f"Audio playback command failed with exit code {exit_code}. Is ffplay installed and in PATH?")
+                return False # Indicate failure
+
+            logging.debug("Audio playback finished.")
+            return True # Indicate success
+
+        except Exception as e:
+            # Catch other potential errors (file writing, playback command)
+            logging.exception("An unexpected error occurred during audio playback.")
+            return False # Indicate failure
+        finally:
+            # --- Cleanup ---
+            if tmp_path and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path) # ffplay has exited, so the file is no longer in use
+                except Exception as e:
+                    # Log exception during cleanup but don't override primary return status
+                    logging.exception(f"Error removing temporary file {tmp_path}: {e}")
+
+    def skip(self):
+        with self.lock:
+            if self.process is None:
+                return False
+            self.skip_requested = True
+            self.process.kill()
+            return True
+
+    def stop(self):
+        # Clips waiting for ffplay are held by their callers; only the current one can be cut short
+        return 1 if self.skip() else 0
+
+    def status(self):
+        with self.lock:
+            return {
+                "backend": self.name,
+                "playing": self.label,
+                "queue_depth": self.waiting,
+                "played": self.played,
+                "skipped": self.skipped,
+            }
+
+
+class NullPlayer:
+    """Audio sink that reads clips and throws them away, taking as long as playing them roughly would."""
+    name = "null"
+
+    def __init__(self):
+        self.play_lock = threading.Lock() # One clip at a time, like a real speaker
+        self.lock = threading.Lock()
+        self.skip_event = threading.Event()
+        self.label = None
+        self.waiting = 0
+        self.played = 0
+        self.skipped = 0
+
+    def play(self, stream, label=None, on_start=None):
+        with self.lock:
+            self.waiting += 1
+        with self.play_lock:
+            with self.lock:
+                self.waiting -= 1
+                self.label = label
+            self.skip_event.clear()
+            bytes_played = 0
+            for chunk in stream.iter_chunks():
+                if bytes_played == 0 and on_start:
+                    on_start()
+                bytes_played += len(chunk)
+                if NULL_PLAYBACK_RATE and self.skip_event.wait(len(chunk) / NULL_PLAYBACK_RATE):
+                    break
+            with self.lock:
+                self.label = None
+                if self.skip_event.is_set():
+                    self.skipped += 1
+                    return True # Skipped on purpose, not a playback failure
+                if stream.failed or not bytes_played:
+                    return False
+                self.played += 1
+                return True
+
+    def skip(self):
+        with self.lock:
+            if self.label is None:
+                return False
+            self.skip_event.set()
+            return True
+
+    def stop(self):
+        return 1 if self.skip() else 0
+
+    def status(self):
+        with self.lock:
+            return {
+                "backend": self.name,
+                "playing": self.label,
+                "queue_depth": self.waiting,
+                "played": self.played,
+                "skipped": self.skipped,
+            }
+
+
+def parse_speaker_address(value):
+    """"host:port" is a TCP address; anything else is a Unix socket path or a Windows pipe name."""
+    host, _, port = value.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return value
+
+
+class SpeakerClient:
+    """Player for worker processes: hands every clip to the speaker process (speaker.py), which owns the audio device.
+
+    Each clip travels over its own connection. Audio is forwarded chunk by chunk while it is still
+    downloading, and the speaker reports when the clip starts and finishes, so play() blocks just like
+    a local player. The speaker plays clips from all workers one at a time, in the order they arrive.
+    """
+    name = "speaker"
+
+    def __init__(self, address):
+        if not SPEAKER_AUTHKEY:
+            raise ValueError("SPEAKER_AUTHKEY must be set to talk to the speaker.")
+        self.address = address
+
+    def _connect(self):
+        return Client(parse_speaker_address(self.address), authkey=SPEAKER_AUTHKEY)
+
+    def _request(self, message):
+        """One request/reply exchange. Returns the reply's value, or None if the speaker cannot be reached."""
+        try:
+            with self._connect() as conn:
+                conn.send(message)
+                return conn.recv()[1]
+        except (OSError, EOFError, AuthenticationError) as e:
+            logging.error(f"Speaker at {self.address} unavailable for '{message[0]}': {e}")
+            return None
+
+    def _forward(self, conn, stream):
+        try:
+            for chunk in stream.iter_chunks():
+                conn.send(("data", chunk))
+            conn.send(("end", stream.failed))
+        except (OSError, ValueError):
+            pass # The speaker hung up (clip skipped or speaker gone); play() reports it
+
+    def play(self, stream, label=None, on_start=None):
+        try:
+            conn = self._connect()
+        except (OSError, AuthenticationError) as e:
+            logging.error(f"Could not reach the speaker at {self.address} to play '{label}': {e}")
+            return False
+        with conn:
+            conn.send(("play", label))
+            threading.Thread(target=self._forward, args=(conn, stream), name="speaker-forward", daemon=True).start()
+            try:
+                while True:
+                    kind, value = conn.recv()
+                    if kind == "started" and on_start:
+                        on_start()
+                    elif kind == "finished":
+                        return value
+            except (OSError, EOFError):
+                logging.error(f"Lost the connection to the speaker while playing '{label}'.")
+                return False
+
+    def speak(self, text):
+        """Speak text live with the speaker's pyttsx3 engine."""
+        return bool(self._request(("speak", text)))
+
+    def skip(self):
+        return bool(self._request(("skip", None)))
+
+    def stop(self):
+        return self._request(("stop", None)) or 0
+
+    def status(self):
+        status = self._request(("status", None))
+        if status is None:
+            return {"backend": self.name, "speaker": self.address, "connected": False}
+        status.update(speaker=self.address, connected=True)
+        return status
+
+
+player = None
+player_lock = threading.Lock()
+
+
+def create_player():
+    if SPEAKER_ADDRESS:
+        return SpeakerClient(SPEAKER_ADDRESS)
+    return create_local_player()
+
+
+def create_local_player():
+    """A player for the audio device of this process, chosen by PLAYBACK_BACKEND."""
+    if PLAYBACK_BACKEND == "null":
+        logging.info("Using the null audio sink; nothing will be heard.")
+        return NullPlayer()
+    if PLAYBACK_BACKEND in ("auto", "miniaudio"):
+        if miniaudio is None:
+            if PLAYBACK_BACKEND == "miniaudio":
+                logging.error("PLAYBACK_BACKEND=miniaudio but the miniaudio package is not installed.")
+        else:
+            try:
+                return MiniaudioPlayer()
+            except Exception:
+                logging.exception("Could not open a miniaudio output device.")
+    elif PLAYBACK_BACKEND != "ffplay":
+        logging.error(f"Unknown PLAYBACK_BACKEND '{PLAYBACK_BACKEND}'.")
+    logging.info("Using ffplay for audio playback.")
+    return FfplayPlayer()
+
+
+def get_player():
+    """The process-wide player, created on first use."""
+    global player
+    with player_lock:
+        if player is None:
+            player = create_player()
+        return player
+
+
+def play_audio(stream, label=None, on_start=None):
+    """Play an AudioStream on the shared player; blocks until it has finished. on_start fires when sound begins."""
+    active_player = get_player()
+    started_at = None
+
+    def mark_start():
+        nonlocal started_at
+        started_at = time.time()
+        first_audio_seconds.observe(started_at - stream.started_at, backend=active_player.name)
+        logging.debug("Time-to-first-audio: %.0f ms", (started_at - stream.started_at) * 1000)
+        if on_start:
+            on_start()
+
+    success = active_player.play(stream, label=label, on_start=mark_start)
+    if started_at is not None:
+        playback_seconds.observe(time.time() - started_at, backend=active_player.name)
+    if not success:
+        failures.inc(engine=active_player.name)
+    return success
+
+
+# === TTS SPEAKER ===
+class AudioStream:
+    """MP3 bytes that may still be downloading. Readers block until more data arrives or the stream ends."""
+
+    def __init__(self, audio=None, cache_key=None):
+        self.cache_key = cache_key # Audio cache entry to store the finished download under
+        self.chunks = []
+        self.size = 0
+        self.done = False
+        self.failed = False
+        self.started_at = time.time() # When the request for this audio was sent
+        self.first_chunk_at = None
+        self.cond = threading.Condition()
+        if audio is not None:
+            self.append(audio)
+            self.finish()
+
+    def append(self, chunk):
+        with self.cond:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.time()
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            self.cond.notify_all()
+
+    def finish(self, failed=False):
+        with self.cond:
+            self.done = True
+            self.failed = failed or self.size == 0
+            self.cond.notify_all()
+
+    def iter_chunks(self):
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                if index >= len(self.chunks):
+                    return
+                chunk = self.chunks[index]
+            index += 1
+            yield chunk
+
+    def wait_for_data(self, timeout=None):
+        """Wait until the first chunk arrives or the stream ends. Returns True if there is audio to play."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.chunks or self.done, timeout)
+            return bool(self.chunks)
+
+    def wait_done(self):
+        """Wait for the download to finish. Returns True if it succeeded."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+            return not self.failed
+
+    def read_all(self):
+        """Wait for the download to finish. Returns the full audio, or None if it failed."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+            if self.failed:
+                return None
+            return b"".join(self.chunks)
+
+
+def build_elevenlabs_request(text):
+    """The (url, headers, payload) of an ElevenLabs text-to-speech request; shared with async_server.py."""
+    url = f"{ELEVENLABS_API_BASE}/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+    headers = {
+        "Accept": "audio/mpeg", # Explicitly accept mpeg
+        "xi-api-key": ELEVENLABS_API_KEY,
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "text": text,
+        "model_id": ELEVENLABS_MODEL_ID,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS
+    }
+    return url, headers, payload
+
+
+elevenlabs_session = requests.Session() # Keeps connections to ElevenLabs alive between announcements
+
+
+def open_elevenlabs_request(text):
+    """Send the ElevenLabs request. Returns the streaming response, or None on failure."""
+    if not text:
+        logging.warning("open_elevenlabs_request called with empty text. Skipping.")
+        return None
+
+    if not ELEVENLABS_API_KEY:
+        logging.error("ELEVENLABS_API_KEY not set. Cannot use ElevenLabs.")
+        return None
+
+    url, headers, payload = build_elevenlabs_request(text)
+    try:
+        logging.debug("Sending request to ElevenLabs API for voice %s.", ELEVENLABS_VOICE_ID)
+        response = elevenlabs_session.post(url, headers=headers, json=payload, stream=True, timeout=60) # Added timeout
+
+        logging.debug("ElevenLabs API response status code: %s", response.status_code)
+        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+        return response
+
+    except requests.exceptions.RequestException as e:
+        # Catch specific requests errors (network, timeout, etc.)
+        logging.exception(f"ElevenLabs API request failed: {e}")
+        return None
+
+
+def fill_audio_stream(response, stream):
+    """Copy the response body into stream as it arrives. Returns True if any audio was received."""
+    try:
+        for chunk in response.iter_content(chunk_size=4096):
+            if not chunk:
+                continue
+            if stream.first_chunk_at is None:
+                elevenlabs_ttfb_seconds.observe(time.time() - stream.started_at)
+                logging.debug("ElevenLabs time-to-first-byte: %.0f ms", (time.time() - stream.started_at) * 1000)
+            stream.append(chunk)
+            elevenlabs_bytes.inc(len(chunk))
+        stream.finish()
+    except Exception:
+        logging.exception("ElevenLabs audio download failed.")
+        stream.finish(failed=True)
+    finally:
+        response.close()
+
+    if stream.failed:
+        logging.warning("ElevenLabs returned an empty or broken audio stream.")
+        failures.inc(engine="elevenlabs")
+        return False
+    logging.debug("Finished downloading %s bytes of audio.", stream.size)
+    if audio_cache and stream.cache_key:
+        audio_cache.put(stream.cache_key, stream.read_all())
+    return True
+
+
+def cached_audio_stream(text, engine_name):
+    """A ready-made AudioStream from the audio cache, or None."""
+    if not audio_cache or not text:
+        return None
+    audio = audio_cache.get(audio_cache_key(text, engine_name))
+    if not audio:
+        return None
+    logging.debug("Using cached %s audio for: '%s'", engine_name, text)
+    return AudioStream(audio)
+
+
+def download_elevenlabs_audio(text, stream):
+    """Fill stream with the ElevenLabs rendering of text, reporting the outcome to the circuit breaker."""
+    response = open_elevenlabs_request(text)
+    if response is None:
+        stream.finish(failed=True)
+        failures.inc(engine="elevenlabs")
+        elevenlabs_breaker.record(False)
+        return
+    success = fill_audio_stream(response, stream)
+    # A response that took too long to start counts against ElevenLabs even if it eventually succeeded
+    slow = stream.first_chunk_at is not None and stream.first_chunk_at - stream.started_at > ELEVENLABS_SLOW_THRESHOLD
+    elevenlabs_breaker.record(success and not slow)
+
+
+def start_elevenlabs_stream(text):
+    """Start rendering text with ElevenLabs, using the audio cache when possible.
+    Returns an AudioStream right away; the download continues on a background thread."""
+    cached = cached_audio_stream(text, "elevenlabs")
+    if cached:
+        return cached
+    stream = AudioStream(cache_key=audio_cache_key(text, "elevenlabs") if audio_cache else None)
+    threading.Thread(target=download_elevenlabs_audio, args=(text, stream), daemon=True).start()
+    return stream
+
+
+def synthesize_with_elevenlabs(text):
+    """Download the ElevenLabs rendering of text. Returns the MP3 bytes, or None on failure."""
+    logging.debug("Entering synthesize_with_elevenlabs function.")
+    audio = start_elevenlabs_stream(text).read_all()
+    if audio:
+        logging.debug("Exiting synthesize_with_elevenlabs function successfully.")
+    return audio
+
+
+def speak_with_elevenlabs(text):
+    logging.debug("Entering speak_with_elevenlabs function.")
+    # Playback starts with the first chunk; with TTS_FAILOVER this may be pyttsx3 audio instead
+    stream = synthesize_speech(text)
+    if stream is None:
+        return False # Indicate failure
+
+    if not play_audio(stream, on_start=lambda: publish_clip(text, stream)):
+        return False
+
+    logging.debug("Exiting speak_with_elevenlabs function successfully.")
+    return True # Indicate success
+
+
+class Pyttsx3Worker:
+    """Owns the pyttsx3 engine, which is not thread-safe, on one dedicated thread.
+
+    Other threads hand it text through a queue, either to speak live or to render into an audio file
+    whose bytes are returned, so offline speech can be cached and played like ElevenLabs audio.
+    The engine is initialized on first use.
+    """
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.engine = None
+        self.ready = threading.Event()
+        self.start_lock = threading.Lock()
+        self.thread = None
+
+    def _ensure_started(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="pyttsx3-worker", daemon=True)
+                self.thread.start()
+        self.ready.wait()
+        return self.engine is not None
+
+    def _run(self):
+        try:
+            import pyttsx3 # Loading the speech driver is slow, so workers that never speak skip it
+            self.engine = pyttsx3.init()
+            if self.engine: # Check if init succeeded
+                 self.engine.setProperty('rate', SPEECH_RATE)
+                 logging.info(f"pyttsx3 engine initialized with rate {SPEECH_RATE}.")
+            else:
+                 logging.error("pyttsx3 engine initialization failed.")
+        except Exception:
+            logging.exception("Failed to initialize pyttsx3 engine.")
+            self.engine = None # Ensure engine is None if init fails
+        self.ready.set()
+
+        while True:
+            action, text, result = self.requests.get()
+            try:
+                if action == "say":
+                    result["value"] = self._say(text)
+                else:
+                    result["value"] = self._render(text)
+            except Exception:
+                logging.exception(f"An unexpected error occurred during pyttsx3 {action}.")
+            finally:
+                result["done"].set()
+
+    def _say(self, text):
+        logging.debug("Speaking with pyttsx3 (rate %s): '%s'", SPEECH_RATE, text)
+        self.engine.say(text)
+        self.engine.runAndWait()
+        logging.debug("pyttsx3 runAndWait finished.")
+        return True
+
+    def _render(self, text):
+        fd, tmp_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self.engine.save_to_file(text, tmp_path)
+            self.engine.runAndWait()
+            with open(tmp_path, "rb") as f:
+                audio = f.read()
+            logging.debug("pyttsx3 rendered %s bytes for: '%s'", len(audio), text)
+            return audio or None
+        finally:
+            os.remove(tmp_path)
+
+    def _submit(self, action, text, default):
+        if not self._ensure_started():
+            logging.error("pyttsx3 engine is not initialized. Cannot speak.")
+            return default
+        result = {"value": default, "done": threading.Event()}
+        self.requests.put((action, text, result))
+        result["done"].wait()
+        return result["value"]
+
+    def speak(self, text):
+        """Speak text live through the engine. Returns True on success."""
+        return self._submit("say", text, False)
+
+    def render(self, text):
+        """Render text to audio file bytes (WAV on most platforms). Returns None on failure."""
+        return self._submit("render", text, None)
+
+
+pyttsx3_worker = Pyttsx3Worker()
+
+
+def render_with_pyttsx3(text):
+    """Offline rendering through the audio cache. Returns an AudioStream, or None if the engine can't render."""
+    cached = cached_audio_stream(text, "pyttsx3")
+    if cached:
+        return cached
+    started_at = time.time()
+    audio = pyttsx3_worker.render(text)
+    if not audio:
+        failures.inc(engine="pyttsx3")
+        return None
+    pyttsx3_render_seconds.observe(time.time() - started_at)
+    if audio_cache:
+        audio_cache.put(audio_cache_key(text, "pyttsx3"), audio)
+    return AudioStream(audio)
+
+
+def speak_with_pyttsx3(text):
+    logging.debug("Entering speak_with_pyttsx3 function.")
+    if not text:
+        logging.warning("speak_with_pyttsx3 called with empty text. Skipping.")
+        return False # Indicate failure
+
+    started_at = time.time()
+    active_player = get_player()
+    spoken = active_player.speak(text) if isinstance(active_player, SpeakerClient) else pyttsx3_worker.speak(text)
+    if spoken:
+        playback_seconds.observe(time.time() - started_at, backend="pyttsx3")
+        logging.debug("Exiting speak_with_pyttsx3 function successfully.")
+        return True # Indicate success
+    failures.inc(engine="pyttsx3")
+    logging.debug("Exiting speak_with_pyttsx3 function with error.")
+    return False # Indicate failure
+
+
+def speak_text(text):
+    logging.debug("Entering speak_text function.")
+    if not text:
+        logging.warning("speak_text called with empty text.")
+        return False
+
+    success = False
+    if USE_ELEVENLABS:
+        logging.debug("Attempting TTS using ElevenLabs.")
+        success = speak_with_elevenlabs(text)
+        if not success:
+            logging.error("ElevenLabs TTS failed.")
+            if TTS_FAILOVER:
+                logging.info("Falling back to live pyttsx3 speech.")
+                publish_clip(text)
+                success = speak_with_pyttsx3(text)
+    else:
+        logging.debug("Attempting TTS using pyttsx3.")
+        publish_clip(text)
+        success = speak_with_pyttsx3(text)
+        if not success:
+             logging.error("pyttsx3 TTS failed.")
+
+    if success:
+         logging.debug("Exiting speak_text function successfully.")
+    else:
+         logging.debug("Exiting speak_text function with errors.")
+    return success
+
+
+# === TTS FAILOVER ===
+class CircuitBreaker:
+    """Stops sending requests to a failing or slow service for a cool-down period.
+
+    closed -> open after failure_threshold consecutive failures; open -> half_open once the cool-down
+    has passed, letting a single trial request through; half_open -> closed on success, open on failure.
+    """
+
+    def __init__(self, name, failure_threshold, cooldown):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.times_opened = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.trial_in_flight = False
+                logging.info(f"{self.name} circuit breaker half-open; sending a trial request.")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.consecutive_failures = 0
+                if self.state != "closed":
+                    logging.info(f"{self.name} circuit breaker closed.")
+                self.state = "closed"
+                return
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.time()
+                self.times_opened += 1
+                logging.warning(f"{self.name} circuit breaker opened for {self.cooldown:.0f} s after {self.consecutive_failures} failure(s).")
+
+    def status(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_failures": self.total_failures,
+                "times_opened": self.times_opened,
+                "opened_at": self.opened_at,
+            }
+
+
+elevenlabs_breaker = CircuitBreaker("ElevenLabs", BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+FALLBACK_REASONS = ("deadline", "error", "circuit_open") # Why announcements were spoken by pyttsx3 instead
+
+
+def synthesize_speech(text):
+    """Render text with the configured engine. Returns an AudioStream (possibly still downloading), or None.
+
+    With ElevenLabs and TTS_FAILOVER, pyttsx3 renders the announcement instead when the breaker is open,
+    the request fails, or no audio has arrived within ELEVENLABS_FIRST_BYTE_DEADLINE. A slow download
+    keeps going in the background so its result still lands in the audio cache.
+    """
+    if not USE_ELEVENLABS:
+        return render_with_pyttsx3(text)
+
+    cached = cached_audio_stream(text, "elevenlabs")
+    if cached:
+        return cached
+
+    stream = None
+    if not TTS_FAILOVER or elevenlabs_breaker.allow_request():
+        stream = start_elevenlabs_stream(text)
+        if not TTS_FAILOVER:
+            return stream if stream.wait_for_data() else None
+        if stream.wait_for_data(ELEVENLABS_FIRST_BYTE_DEADLINE):
+            return stream
+        reason = "error" if stream.done else "deadline"
+    else:
+        reason = "circuit_open"
+
+    tts_fallbacks.inc(reason=reason)
+    logging.warning(f"Falling back to pyttsx3 ({reason}) for: '{text}'")
+    fallback = render_with_pyttsx3(text)
+    if fallback:
+        return fallback
+    if stream is not None and stream.wait_for_data():
+        logging.warning("pyttsx3 could not render; waiting for ElevenLabs after all.")
+        return stream
+    return None
+
+
+def get_tts_status():
+    fallbacks = {reason: tts_fallbacks.value(reason=reason) for reason in FALLBACK_REASONS}
+    return {
+        "engine": "elevenlabs" if USE_ELEVENLABS else "pyttsx3",
+        "failover": USE_ELEVENLABS and TTS_FAILOVER,
+        "first_byte_deadline": ELEVENLABS_FIRST_BYTE_DEADLINE,
+        "breaker": elevenlabs_breaker.status(),
+        "fallbacks": fallbacks,
+    }
+
+
+# === BROADCAST ===
+# With BROADCAST on, every clip is published to remote listeners (browser tabs, thin clients in other rooms)
+# as it starts playing here. Listeners follow GET /events, a server-sent-events feed of clip metadata, and
+# fetch the audio from GET /audio/<id>, which serves the very AudioStream the speaker plays - so any number
+# of listeners costs no extra GPT, ElevenLabs or pyttsx3 work. The last BROADCAST_HISTORY clips stay in
+# memory for late joiners (GET /clips, or /events?history=N). The feed belongs to this process: it is meant
+# for a single main.py, not for workers sharing a speaker or for async_server.py.
+def audio_content_type(stream):
+    first = stream.chunks[0] if stream.chunks else b""
+    return "audio/wav" if first.startswith(b"RIFF") else "audio/mpeg" # pyttsx3 renders WAV, ElevenLabs MP3
+
+
+class Broadcaster:
+    """The most recent clips, shared by every listener."""
+
+    def __init__(self, history):
+        self.history = max(1, history)
+        self.clips = OrderedDict() # clip id -> (info, AudioStream or None), oldest first
+        self.last_id = 0
+        self.epoch = uuid.uuid4().hex[:8] # Clip ids restart with the process; event ids carry this to tell runs apart
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+    def resume_after(self, last_event_id):
+        """Clip id to resume after for a reconnecting listener's Last-Event-ID, or None if there is none."""
+        epoch, _, clip_id = last_event_id.partition("-")
+        if not clip_id.isdigit():
+            return None
+        if epoch != self.epoch:
+            return 0 # Sent by an earlier run: everything held now is new to the listener
+        with self.cond:
+            return min(int(clip_id), self.last_id)
+
+    def publish(self, text, stream=None, job_ids=()):
+        """Add a clip and wake the listeners. stream is None for speech that was never rendered (live pyttsx3)."""
+        with self.cond:
+            self.last_id += 1
+            info = {
+                "id": self.last_id,
+                "text": text,
+                "jobs": list(job_ids),
+                "published_at": time.time(),
+                "audio_url": f"/audio/{self.last_id}" if stream is not None else None,
+                "content_type": audio_content_type(stream) if stream is not None else None,
+            }
+            self.clips[self.last_id] = (info, stream)
+            while len(self.clips) > self.history:
+                self.clips.popitem(last=False)
+            self.cond.notify_all()
+        logging.debug("Broadcast clip %s: '%s'", info['id'], text)
+        return info
+
+    def get(self, clip_id):
+        with self.cond:
+            return self.clips.get(clip_id)
+
+    def recent(self, after=0):
+        """Metadata of the clips newer than clip id `after`, oldest first."""
+        with self.cond:
+            return [info for clip_id, (info, _) in self.clips.items() if clip_id > after]
+
+    def events(self, after):
+        """Server-sent events for every clip after clip id `after`, until the listener goes away."""
+        with self.cond:
+            self.subscribers += 1
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.last_id > after, timeout=BROADCAST_KEEPALIVE)
+                clips = self.recent(after)
+                if not clips:
+                    yield ": keepalive\n\n" # Also how a closed connection is noticed
+                    continue
+                for info in clips:
+                    yield f"id: {self.epoch}-{info['id']}\nevent: announcement\ndata: {json.dumps(info, ensure_ascii=False)}\n\n"
+                    after = info["id"]
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self.cond:
+            return {"subscribers": self.subscribers, "clips": len(self.clips), "last_id": self.last_id}
+
+
+broadcaster = Broadcaster(BROADCAST_HISTORY) if BROADCAST else None
+if broadcaster and SPEAKER_ADDRESS:
+    logging.warning("BROADCAST is on with SPEAKER_ADDRESS: each worker's /events only carries the clips it rendered, "
+                    "and every open event stream holds a worker. Broadcast from a single process instead.")
+broadcast_subscribers = Gauge("shadowdesk_broadcast_subscribers", "Listeners connected to GET /events.",
+                              lambda: broadcaster.stats()["subscribers"] if broadcaster else 0)
+
+
+def publish_clip(text, stream=None, job_ids=()):
+    """Hand a clip that starts playing now to the broadcast listeners, if BROADCAST is on."""
+    if broadcaster:
+        broadcaster.publish(text, stream, job_ids)
+
+
+# === INGEST LOG ===
+def encode_ingest_data(received_data):
+    """JSON-safe form of a webhook payload; raw bytes bodies are base64 encoded."""
+    if isinstance(received_data, bytes):
+        return {"raw": base64.b64encode(received_data).decode("ascii")}
+    return {"data": received_data}
+
+
+def decode_ingest_data(record):
+    if "raw" in record:
+        return base64.b64decode(record["raw"])
+    return record.get("data")
+
+
+class IngestLog:
+    """Append-only JSON Lines log of accepted webhooks, so queued jobs survive a crash or restart.
+
+    Every accepted payload is written and fsynced before the webhook is acknowledged, and a "done" marker
+    follows once its job has been announced. Writes are group-committed: one writer thread flushes
+    everything that arrived during the previous fsync with a single fsync. The log is split into numbered
+    segments; once the current one holds segment_bytes of new records, a fresh segment is started with the
+    unfinished entries copied over and the older segments are deleted.
+
+    The directory is locked for the lifetime of the process, so two servers pointed at the same log cannot
+    delete each other's segments; the second one runs without a log. With shared=True several worker
+    processes use the same directory instead: each one locks a worker-N subdirectory, and a restarted
+    worker replays whichever log it picks up.
+    """
+
+    def __init__(self, directory, segment_bytes, shared=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.shared = shared
+        self.slot_lock = None # Open lock file of the directory this process claimed
+        self.unfinished = OrderedDict() # job_id -> "accepted" record without a "done" marker yet
+        self.lines = [] # Serialized records waiting for the writer
+        self.appended = 0 # Records handed to the writer
+        self.written = 0 # Records written and fsynced
+        self.commits = 0
+        self.segment = None
+        self.segment_number = 0
+        self.segment_size = 0
+        self.carried_size = 0 # Bytes of unfinished entries copied into the current segment
+        self.cond = threading.Condition()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:08d}.jsonl")
+
+    def _segments(self):
+        """Existing segments, oldest first."""
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".jsonl"))
+
+    def _lock(self, directory):
+        """Lock directory for the lifetime of this process. Returns False if another live process holds it."""
+        lock_file = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.slot_lock = lock_file # Released when the process exits
+        return True
+
+    def _claim_slot(self):
+        """The first worker-N subdirectory that no live process has locked."""
+        for number in itertools.count():
+            directory = os.path.join(self.directory, f"worker-{number}")
+            os.makedirs(directory, exist_ok=True)
+            if self._lock(directory):
+                return directory
+
+    def recover(self):
+        """Open the log and start the writer. Returns [(job_id, received_data)] for unfinished entries, oldest first."""
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl is None:
+            logging.warning("Cannot lock the ingest log on this platform; run only one process per INGEST_LOG_DIR.")
+        elif self.shared:
+            self.directory = self._claim_slot()
+        elif not self._lock(self.directory):
+            raise RuntimeError(f"{self.directory} is in use by another process; give each server its own INGEST_LOG_DIR.")
+        segments = self._segments()
+        for path in segments:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # Torn write from a crash
+                    if record.get("type") == "accepted":
+                        self.unfinished[record["id"]] = record
+                    elif record.get("type") == "done":
+                        self.unfinished.pop(record["id"], None)
+        if segments:
+            self.segment_number = int(os.path.basename(segments[-1])[len("segment-"):-len(".jsonl")])
+        self._rotate() # Compacts whatever the previous run left behind
+        threading.Thread(target=self._writer, name="ingest-log-writer", daemon=True).start()
+        logging.info(f"Ingest log in {self.directory}: {len(self.unfinished)} unfinished job(s) to replay.")
+        return [(job_id, decode_ingest_data(record)) for job_id, record in self.unfinished.items()]
+
+    def append(self, job_id, received_data):
+        """Queue an "accepted" record for job_id. Call sync() before acknowledging the webhook."""
+        record = {"type": "accepted", "id": job_id, "accepted_at": time.time()}
+        record.update(encode_ingest_data(received_data))
+        with self.cond:
+            self.unfinished[job_id] = record
+            self._enqueue(record)
+
+    def mark_done(self, job_id):
+        """Queue a "done" marker; losing one in a crash only means the job is announced again."""
+        with self.cond:
+            if self.unfinished.pop(job_id, None) is not None:
+                self._enqueue({"type": "done", "id": job_id})
+
+    def sync(self, timeout=None):
+        """Wait until every record queued so far is on disk. Returns False on timeout."""
+        with self.cond:
+            target = self.appended
+            return self.cond.wait_for(lambda: self.written >= target, timeout)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "unfinished": len(self.unfinished),
+                "pending_writes": len(self.lines),
+                "commits": self.commits,
+                "records_written": self.written,
+                "segment": self.segment_number,
+                "segment_bytes": self.segment_size,
+            }
+
+    def _enqueue(self, record):
+        # Caller holds self.cond
+        self.lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.appended += 1
+        self.cond.notify_all()
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.lines)
+                lines = self.lines
+                self.lines = []
+                target = self.appended
+            data = "".join(lines).encode("utf-8")
+            try:
+                self.segment.write(data)
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+            except Exception:
+                logging.exception(f"Could not write ingest log segment {self.segment.name}; retrying.")
+                with self.cond:
+                    self.lines[:0] = lines # Keep the order; the records are retried with the next batch
+                time.sleep(1)
+                continue
+            self.segment_size += len(data)
+            with self.cond:
+                self.written = target
+                self.commits += 1
+                self.cond.notify_all()
+            logging.debug("Ingest log committed %s record(s) with one fsync.", len(lines))
+
+            if self.segment_size - self.carried_size >= self.segment_bytes:
+                try:
+                    self._rotate()
+                except Exception:
+                    logging.exception("Could not rotate the ingest log; staying on the current segment.")
+
+    def _rotate(self):
+        """Start a new segment holding the unfinished entries, then delete the older segments."""
+        with self.cond:
+            # Records still queued for the writer may end up in the new segment twice; replay keeps one per id
+            carried = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                              for record in self.unfinished.values()).encode("utf-8")
+        path = self._segment_path(self.segment_number + 1)
+        segment = open(path, "ab")
+        segment.write(carried)
+        segment.flush()
+        os.fsync(segment.fileno())
+        self._fsync_directory()
+
+        if self.segment:
+            self.segment.close()
+        self.segment = segment
+        self.segment_number += 1
+        self.segment_size = self.carried_size = len(carried)
+        for old_path in self._segments():
+            if old_path != path:
+                os.remove(old_path)
+        self._fsync_directory()
+        logging.info(f"Ingest log rotated to {path}, carrying {len(carried)} bytes of unfinished jobs.")
+
+    def _fsync_directory(self):
+        # Makes segment creation/removal durable; not supported on every platform
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+ingest_log = IngestLog(INGEST_LOG_DIR, INGEST_SEGMENT_BYTES, shared=bool(SPEAKER_ADDRESS)) if QUEUE_MODE and INGEST_LOG_DIR else None
+
+
+# === ADMISSION CONTROL ===
+# Every job gets a priority class - from the X-Priority header, else the first matching PRIORITY_RULES
+# entry, else DEFAULT_PRIORITY. The scheduler summarizes the most urgent waiting announcement first; a
+# full queue makes room for urgent work by dropping the newest lower-priority announcement, low-priority
+# webhooks are refused past SHED_QUEUE_DEPTH, and low-priority jobs older than LOW_PRIORITY_MAX_AGE expire.
+PRIORITY_CLASSES = ["high", "normal", "low"] # Most urgent first; the index is the scheduling rank
+PRIORITY_RULE_PATTERN = re.compile(r"^\s*([\w.\-]+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$")
+NUMERIC_COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+if DEFAULT_PRIORITY not in PRIORITY_CLASSES:
+    logging.error(f"Unknown DEFAULT_PRIORITY '{DEFAULT_PRIORITY}'; using 'normal'.")
+    DEFAULT_PRIORITY = "normal"
+
+
+class PriorityRule:
+    """One PRIORITY_RULES entry: a payload field (dotted path) compared with a value, and the class it assigns.
+    = and != compare text case-insensitively; <, <=, > and >= compare numbers."""
+
+    def __init__(self, path, op, value, priority):
+        self.path = path
+        self.op = op
+        self.value = value
+        self.priority = priority
+
+    def matches(self, payload):
+        actual = lookup_payload_path(payload, self.path)
+        if actual is None:
+            return False
+        if self.op in ("=", "!="):
+            return (actual.lower() == self.value.lower()) == (self.op == "=")
+        try:
+            return NUMERIC_COMPARISONS[self.op](float(actual), float(self.value))
+        except ValueError:
+            return False
+
+
+def parse_priority_rules(spec):
+    rules = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        condition, _, priority = item.rpartition(":")
+        match = PRIORITY_RULE_PATTERN.match(condition)
+        priority = priority.strip().lower()
+        if not match or priority not in PRIORITY_CLASSES:
+            logging.error(f"Ignoring invalid PRIORITY_RULES entry '{item.strip()}'.")
+            continue
+        rules.append(PriorityRule(match.group(1), match.group(2), match.group(3), priority))
+    return rules
+
+
+priority_rules = parse_priority_rules(PRIORITY_RULES)
+
+
+def job_priority(received_data, headers=None):
+    """Priority class of a webhook: an X-Priority header naming a class wins, then the first matching rule."""
+    header = headers.get("X-Priority", "").strip().lower() if headers is not None else ""
+    if header in PRIORITY_CLASSES:
+        return header
+    if isinstance(received_data, dict):
+        for rule in priority_rules:
+            if rule.matches(received_data):
+                return rule.priority
+    return DEFAULT_PRIORITY
+
+
+class RateLimiter:
+    """Token bucket per source: `rate` webhooks per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst, max_sources=10000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_sources = max_sources
+        self.buckets = OrderedDict() # source -> (tokens, updated_at), least recently seen first
+        self.limited = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, source):
+        """Take a token for source. Returns 0 when the webhook is admitted, else seconds until it would be."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(source, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / self.rate
+                self.limited += 1
+            self.buckets[source] = (tokens, now)
+            # A bucket idle long enough to have refilled is no different from a new one
+            refill_seconds = self.burst / self.rate
+            while self.buckets:
+                _, oldest_updated_at = next(iter(self.buckets.values()))
+                if len(self.buckets) <= self.max_sources and now - oldest_updated_at < refill_seconds:
+                    break
+                self.buckets.popitem(last=False)
+            return retry_after
+
+    def stats(self):
+        with self.lock:
+            return {"sources": len(self.buckets), "limited": self.limited}
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_SOURCE, RATE_LIMIT_BURST) if RATE_LIMIT_PER_SOURCE > 0 else None
+
+
+def forwarded_source(value):
+    """The address the outermost trusted proxy saw in a header like X-Forwarded-For, or "" if it isn't there.
+    Each proxy appends to the right, so only the last RATE_LIMIT_TRUSTED_HOPS entries can be trusted;
+    anything further left was sent by the client."""
+    entries = [entry.strip() for entry in value.split(",") if entry.strip()]
+    return entries[-RATE_LIMIT_TRUSTED_HOPS] if len(entries) >= RATE_LIMIT_TRUSTED_HOPS else ""
+
+
+def webhook_source():
+    """The rate limiting key of the current request."""
+    if RATE_LIMIT_SOURCE_HEADER:
+        source = forwarded_source(",".join(request.headers.getlist(RATE_LIMIT_SOURCE_HEADER)))
+        if source:
+            return source
+    return request.remote_addr or "unknown"
+
+
+def backlog_word_limit(depth):
+    """Word limit for an announcement with `depth` others waiting behind it, or None for the usual length."""
+    limit = None
+    for threshold, words in BACKLOG_WORD_LIMITS:
+        if depth >= threshold:
+            limit = words if limit is None else min(limit, words)
+    return limit
+
+
+# === JOB PIPELINE ===
+# Jobs are plain dicts so they can be returned as-is (minus internals) by GET /jobs/<id>.
+# Accepted jobs become "announcements" - one job, or with COALESCE_WINDOW a digest of several -
+# which move through three stages:
+#   summarize (SUMMARY_WORKERS threads) -> synthesize (SYNTH_WORKERS threads) -> playback (one thread)
+# Announcements wait for a summarize worker in priority order (see ADMISSION CONTROL) and get a sequence
+# number when one picks them up; playback speaks strictly in that order, while up to PLAYBACK_BUFFER_SIZE
+# announcements (including the one playing) may be rendered ahead.
+# Between stages an announcement travels as one or more "parts" - a single part holding the whole summary,
+# or one part per sentence when STREAM_SUMMARY is on - and the part flagged "last" ends it.
+JOB_STAGES = ["queued", "summarizing", "synthesizing", "buffered", "speaking", "done"]
+FINAL_STATUSES = ("done", "failed", "dropped")
+
+jobs = OrderedDict() # job_id -> job, oldest first
+jobs_lock = threading.Lock()
+playback_lock = threading.Lock() # Only one announcement may use the speaker at a time
+workers_lock = threading.Lock()
+workers_started = False
+
+# Shared between the stages, guarded by pipeline_cond
+pipeline_cond = threading.Condition()
+coalesce_buffer = [] # Jobs gathered for the next digest
+schedule_heap = [] # (rank, order, announcement) waiting to be summarized, most urgent and then oldest first
+schedule_order = itertools.count() # Arrival order among announcements of the same priority
+synth_heap = [] # (seq, index, part) waiting to be synthesized, lowest sequence first
+ready_parts = {} # (seq, index) -> part rendered and waiting for its turn at the speaker
+next_seq = 0 # Sequence number given to the next announcement
+next_play_seq = 0 # Sequence number the speaker is waiting for
+next_play_index = 0 # Part of that announcement the speaker is waiting for
+
+duplicates_lock = threading.Lock()
+recent_payloads = OrderedDict() # payload fingerprint -> (job id, accepted_at) for COLLAPSE_DUPLICATES
+
+
+def read_pipeline_depths():
+    with pipeline_cond:
+        return [
+            ({"stage": "coalescing"}, len(coalesce_buffer)),
+            ({"stage": "queued"}, len(schedule_heap)),
+            ({"stage": "waiting_for_synthesis"}, len(synth_heap)),
+            ({"stage": "ready_to_play"}, len(ready_parts)),
+        ]
+
+
+pipeline_depth = Gauge("shadowdesk_pipeline_depth", "Announcements (or parts) waiting at each pipeline stage.", read_pipeline_depths)
+
+
+def create_job(received_data, job_id=None, priority=None):
+    job_id = job_id or uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "priority": priority or job_priority(received_data),
+        "summary": None,
+        "error": None,
+        "timestamps": {"queued": time.time()},
+        "data": received_data,
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+        # Drop the oldest finished jobs once the history is full
+        if len(jobs) > JOB_HISTORY_SIZE:
+            finished = [jid for jid, j in jobs.items() if j["status"] in FINAL_STATUSES]
+            for old_id in finished[:len(jobs) - JOB_HISTORY_SIZE]:
+                del jobs[old_id]
+    return job
+
+
+def set_job_status(job, status, error=None):
+    with jobs_lock:
+        current = job["status"]
+        # Statuses only move forward; streamed jobs pass through the later stages once per part
+        if current in ("failed", "dropped") or (status not in ("failed", "dropped") and JOB_STAGES.index(status) <= JOB_STAGES.index(current)):
+            return
+        now = time.time()
+        job_stage_seconds.observe(now - job["timestamps"][current], stage=current)
+        job["status"] = status
+        job["timestamps"][status] = now
+        if error:
+            job["error"] = error
+    if status in FINAL_STATUSES:
+        jobs_finished.inc(status=status)
+    logging.debug("Job %s -> %s", job['id'], status)
+
+
+def set_announcement_status(announcement, status, error=None):
+    for job in announcement["jobs"]:
+        set_job_status(job, status, error)
+
+
+def describe_announcement(announcement):
+    if len(announcement["jobs"]) == 1:
+        return f"job {announcement['jobs'][0]['id']}"
+    return f"digest of {len(announcement['jobs'])} jobs"
+
+
+def get_job_view(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        view = {key: value for key, value in job.items() if key != "data"}
+        view["timestamps"] = dict(job["timestamps"])
+    return view
+
+
+def build_summary(received_data, max_words=None):
+    if not received_data:
+        logging.warning("Received empty or unparseable request body.")
+        logging.debug("Using default summary for empty request: '%s'", EMPTY_REQUEST_MESSAGE)
+        return EMPTY_REQUEST_MESSAGE
+    return summarize_with_gpt(received_data, max_words) # This function returns error messages too
+
+
+def in_playback_window(seq):
+    # Caller must hold pipeline_cond
+    return seq < next_play_seq + PLAYBACK_BUFFER_SIZE
+
+
+def queue_part(announcement, index, text, last):
+    """Hand one part of an announcement to the synthesize stage. text may be None when there is nothing to speak."""
+    seq = announcement["seq"]
+    part = {"announcement": announcement, "index": index, "text": text, "last": last, "audio": None}
+    # Parts inside the playback window skip the size limit, otherwise a full heap of later
+    # announcements could wait forever on the one the speaker needs next.
+    with pipeline_cond:
+        pipeline_cond.wait_for(lambda: len(synth_heap) < SYNTH_QUEUE_SIZE or in_playback_window(seq))
+        heapq.heappush(synth_heap, (seq, index, part))
+        pipeline_cond.notify_all()
+
+
+def summarize_announcement(announcement):
+    batch = announcement["jobs"]
+    index = 0
+    text = None
+    summary = None
+    try:
+        set_announcement_status(announcement, "summarizing")
+        if len(batch) == 1:
+            data = batch[0].pop("data", None)
+        else:
+            data = DigestPayload(job.pop("data", None) for job in batch)
+            for job in batch:
+                job["digest"] = [j["id"] for j in batch]
+
+        if STREAM_SUMMARY and data:
+            # Each fragment goes to TTS as soon as it is complete; the closing part carries no text
+            fragments = []
+            for fragment in summarize_with_gpt_stream(data, announcement["max_words"]):
+                fragments.append(fragment)
+                queue_part(announcement, index, fragment, last=False)
+                index += 1
+            summary = " ".join(fragments)
+        else:
+            text = summary = build_summary(data, announcement["max_words"])
+        for job in batch:
+            job["summary"] = summary
+        if not summary:
+            set_announcement_status(announcement, "failed", "Summary generation failed, nothing to speak.")
+    except Exception:
+        logging.exception(f"An unexpected error occurred while summarizing {describe_announcement(announcement)}.")
+        set_announcement_status(announcement, "failed", "Internal error while summarizing job.")
+    finally:
+        # Every announcement, failed or not, must reach the playback stage so the sequence keeps moving
+        queue_part(announcement, index, text, last=True)
+
+
+def drop_announcement(announcement, reason, error):
+    """Finish a waiting announcement without speaking it. Caller must hold pipeline_cond."""
+    set_announcement_status(announcement, "dropped", error)
+    jobs_dropped.inc(len(announcement["jobs"]), reason=reason)
+    if ingest_log:
+        for job in announcement["jobs"]:
+            ingest_log.mark_done(job["id"]) # Dropped on purpose; a restart must not bring it back
+    logging.warning(f"Dropped {describe_announcement(announcement)} ({reason}).")
+
+
+def is_expired(rank, announcement, now):
+    if not LOW_PRIORITY_MAX_AGE or PRIORITY_CLASSES[rank] != "low":
+        return False
+    return now - min(job["timestamps"]["queued"] for job in announcement["jobs"]) > LOW_PRIORITY_MAX_AGE
+
+
+def expire_stale_announcements():
+    """Drop every waiting low-priority announcement older than LOW_PRIORITY_MAX_AGE. Caller must hold pipeline_cond."""
+    now = time.time()
+    stale = [entry for entry in schedule_heap if is_expired(entry[0], entry[2], now)]
+    if stale:
+        schedule_heap[:] = [entry for entry in schedule_heap if not is_expired(entry[0], entry[2], now)]
+        heapq.heapify(schedule_heap)
+        for _, _, announcement in stale:
+            drop_announcement(announcement, "expired", "Waited too long in the queue.")
+
+
+def evict_lower_priority(rank):
+    """Make room for a job of the given rank by dropping the newest waiting announcement of a lower priority,
+    or a job of that priority still in the coalescing window. Returns False when there is none. Caller must
+    hold pipeline_cond."""
+    victim = max(schedule_heap, key=lambda entry: entry[:2]) if schedule_heap else None
+    # The newest buffered job of the lowest priority; buffered jobs count towards the queue depth too
+    buffered = max(enumerate(coalesce_buffer), key=lambda item: (PRIORITY_CLASSES.index(item[1]["priority"]), item[0]), default=None)
+    buffered_rank = PRIORITY_CLASSES.index(buffered[1]["priority"]) if buffered else -1
+    error = "Dropped from a full queue to make room for more urgent work."
+    if buffered_rank > rank and (victim is None or buffered_rank >= victim[0]):
+        del coalesce_buffer[buffered[0]]
+        drop_announcement({"jobs": [buffered[1]]}, "evicted", error)
+        return True
+    if victim is None or victim[0] <= rank:
+        return False
+    schedule_heap.remove(victim)
+    heapq.heapify(schedule_heap)
+    drop_announcement(victim[2], "evicted", error)
+    return True
+
+
+def next_announcement():
+    """Take the most urgent waiting announcement and give it the next place in the playback order."""
+    global next_seq
+    with pipeline_cond:
+        while True:
+            pipeline_cond.wait_for(lambda: schedule_heap)
+            rank, _, announcement = heapq.heappop(schedule_heap)
+            if is_expired(rank, announcement, time.time()):
+                drop_announcement(announcement, "expired", "Waited too long in the queue.")
+                continue
+            announcement["seq"] = next_seq
+            next_seq += 1
+            announcement["max_words"] = backlog_word_limit(len(schedule_heap) + len(coalesce_buffer))
+            pipeline_cond.notify_all()
+            return announcement
+
+
+def summarize_worker():
+    while True:
+        summarize_announcement(next_announcement())
+
+
+def synthesize_worker():
+    while True:
+        synthesize_next_part()
+
+
+def synthesize_next_part():
+    """Render the next part within the playback window and hand it to the speaker."""
+    with pipeline_cond:
+        pipeline_cond.wait_for(lambda: synth_heap and in_playback_window(synth_heap[0][0]))
+        seq, index, part = heapq.heappop(synth_heap)
+        pipeline_cond.notify_all()
+
+    announcement = part["announcement"]
+    stream = None
+    try:
+        if part["text"] and (USE_ELEVENLABS or PYTTSX3_RENDER):
+            set_announcement_status(announcement, "synthesizing")
+            stream = synthesize_speech(part["text"])
+            part["audio"] = stream # None: pyttsx3 speaks it live at playback, unless ElevenLabs failed without failover
+            if stream is None and USE_ELEVENLABS and not TTS_FAILOVER:
+                announcement["error"] = "Text-to-speech failed."
+            elif stream is not None and not STREAM_PLAYBACK:
+                stream.wait_done()
+        if part["text"]:
+            set_announcement_status(announcement, "buffered")
+    except Exception:
+        logging.exception(f"An unexpected error occurred while synthesizing {describe_announcement(announcement)}.")
+        announcement["error"] = "Internal error while synthesizing job."
+
+    with pipeline_cond:
+        ready_parts[(seq, index)] = part
+        pipeline_cond.notify_all()
+
+    # In streaming mode the speaker may already be playing the first chunks while the rest arrives;
+    # staying on the download keeps at most SYNTH_WORKERS renderings in flight
+    if stream is not None and stream.wait_done() and part["last"]:
+        with jobs_lock:
+            for job in announcement["jobs"]:
+                job["timestamps"]["rendered"] = time.time()
+
+
+def play_part(part):
+    announcement = part["announcement"]
+    if not part["text"] or all(job["status"] in ("failed", "dropped") for job in announcement["jobs"]):
+        return # Nothing left to announce, or every job was withdrawn after it was picked up
+    if USE_ELEVENLABS and part["audio"] is None and not TTS_FAILOVER:
+        return # Synthesis failed; the announcement error is already set
+
+    job_ids = [job["id"] for job in announcement["jobs"]]
+
+    def start_speaking():
+        set_announcement_status(announcement, "speaking")
+        publish_clip(part["text"], part["audio"], job_ids)
+
+    with playback_lock:
+        if part["audio"] is not None:
+            success = play_audio(part["audio"], label=describe_announcement(announcement), on_start=start_speaking)
+        else:
+            start_speaking()
+            success = speak_with_pyttsx3(part["text"])
+    if not success:
+        announcement["error"] = "Audio playback failed."
+
+
+def playback_worker():
+    while True:
+        play_next_part()
+
+
+def play_next_part():
+    """Wait for the part the speaker needs next, play it, and finish its announcement if it was the last."""
+    global next_play_seq, next_play_index
+    with pipeline_cond:
+        pipeline_cond.wait_for(lambda: (next_play_seq, next_play_index) in ready_parts)
+        part = ready_parts.pop((next_play_seq, next_play_index))
+
+    announcement = part["announcement"]
+    try:
+        play_part(part)
+    except Exception:
+        logging.exception(f"An unexpected error occurred while playing {describe_announcement(announcement)}.")
+        announcement["error"] = "Internal error while playing job."
+    finally:
+        part["audio"] = None # Release the rendered audio
+
+    if part["last"]:
+        if announcement["error"]:
+            set_announcement_status(announcement, "failed", announcement["error"])
+        else:
+            set_announcement_status(announcement, "done")
+        if ingest_log:
+            for job in announcement["jobs"]:
+                ingest_log.mark_done(job["id"])
+
+    with pipeline_cond:
+        if part["last"]:
+            next_play_seq += 1
+            next_play_index = 0
+        else:
+            next_play_index += 1
+        pipeline_cond.notify_all()
+
+
+def submit_announcement(batch):
+    """Queue one or more jobs for summarizing as one announcement. Caller must hold pipeline_cond."""
+    rank = min(PRIORITY_CLASSES.index(job["priority"]) for job in batch) # A digest is as urgent as its most urgent job
+    announcement = {"seq": None, "jobs": batch, "error": None, "max_words": None}
+    heapq.heappush(schedule_heap, (rank, next(schedule_order), announcement))
+    pipeline_cond.notify_all()
+
+
+def coalesce_worker():
+    while True:
+        coalesce_next_batch()
+
+
+def coalesce_next_batch():
+    """Group jobs arriving within COALESCE_WINDOW of the first one (up to COALESCE_MAX_BATCH) into one digest."""
+    with pipeline_cond:
+        pipeline_cond.wait_for(lambda: coalesce_buffer)
+        deadline = coalesce_buffer[0]["timestamps"]["queued"] + COALESCE_WINDOW
+        pipeline_cond.wait_for(lambda: len(coalesce_buffer) >= COALESCE_MAX_BATCH, timeout=max(0, deadline - time.time()))
+        batch = coalesce_buffer[:COALESCE_MAX_BATCH]
+        del coalesce_buffer[:COALESCE_MAX_BATCH]
+        submit_announcement(batch)
+    if len(batch) > 1:
+        logging.info(f"Coalesced {len(batch)} webhooks into one digest announcement.")
+
+
+def start_job_workers():
+    """Start the pipeline threads once; safe to call from any thread."""
+    global workers_started
+    with workers_lock:
+        if workers_started:
+            return
+        replay_ingest_log() # Queued ahead of anything the new workers will see
+        if COALESCE_WINDOW > 0:
+            threading.Thread(target=coalesce_worker, name="coalesce-worker", daemon=True).start()
+        for i in range(SUMMARY_WORKERS):
+            threading.Thread(target=summarize_worker, name=f"summarize-worker-{i}", daemon=True).start()
+        for i in range(SYNTH_WORKERS):
+            threading.Thread(target=synthesize_worker, name=f"synthesize-worker-{i}", daemon=True).start()
+        threading.Thread(target=playback_worker, name="playback-worker", daemon=True).start()
+        workers_started = True
+    start_audio_cache_warmup()
+    start_metrics_dump()
+    logging.info(f"Started pipeline with {SUMMARY_WORKERS} summarize and {SYNTH_WORKERS} synthesize worker(s).")
+
+
+def start_pipeline():
+    """Start a serving process's background work: the job pipeline (replaying the ingest log first), the
+    canned phrase warm-up and the metrics dump. Called before serving, not on the first webhook."""
+    if QUEUE_MODE:
+        start_job_workers()
+    start_audio_cache_warmup()
+    start_metrics_dump()
+
+
+def recover_ingest_log():
+    """Open the ingest log and return its unfinished jobs. If it can't be opened, carry on without it."""
+    global ingest_log
+    if not ingest_log:
+        return []
+    try:
+        return ingest_log.recover()
+    except Exception:
+        logging.exception(f"Could not open the ingest log in {ingest_log.directory}; accepted webhooks will not survive a restart.")
+        ingest_log = None
+        return []
+
+
+def replay_ingest_log():
+    """Queue the jobs a previous run accepted but never finished, under their original ids."""
+    replayed = recover_ingest_log()
+    with pipeline_cond:
+        for job_id, received_data in replayed:
+            submit_announcement([create_job(received_data, job_id)])
+    if replayed:
+        logging.warning(f"Replaying {len(replayed)} unfinished job(s) from the ingest log.")
+
+
+def bypasses_coalescing(received_data, priority):
+    """High-priority webhooks are announced on their own, right away."""
+    if not received_data:
+        return True # Empty requests have a canned announcement; nothing to merge
+    if priority == "high":
+        return True
+    event = received_data.get("event") if isinstance(received_data, dict) else None
+    return isinstance(event, str) and event.strip().lower() in COALESCE_BYPASS_EVENTS
+
+
+def queue_depth():
+    # Caller must hold pipeline_cond
+    return len(schedule_heap) + len(coalesce_buffer)
+
+
+def enqueue_job(received_data):
+    """Register and queue a job. Returns None when the queue is full, or too deep for a low-priority job."""
+    start_job_workers()
+    priority = job_priority(received_data, request.headers if has_request_context() else None)
+    with pipeline_cond:
+        if LOW_PRIORITY_MAX_AGE and queue_depth() >= (SHED_QUEUE_DEPTH or JOB_QUEUE_SIZE):
+            expire_stale_announcements()
+        if priority == "low" and SHED_QUEUE_DEPTH and queue_depth() >= SHED_QUEUE_DEPTH:
+            logging.warning(f"Shedding a low-priority webhook with {queue_depth()} announcements waiting.")
+            return None
+        if queue_depth() >= JOB_QUEUE_SIZE and not evict_lower_priority(PRIORITY_CLASSES.index(priority)):
+            return None
+        job = create_job(received_data, priority=priority)
+        if ingest_log:
+            ingest_log.append(job["id"], received_data) # The caller syncs before acknowledging
+        if COALESCE_WINDOW > 0 and not bypasses_coalescing(received_data, priority):
+            coalesce_buffer.append(job)
+            pipeline_cond.notify_all()
+        else:
+            submit_announcement([job])
+    return job
+
+
+def duplicate_fingerprint(received_data):
+    """Fingerprint used to collapse identical payloads, or None when COLLAPSE_DUPLICATES is off."""
+    if not COLLAPSE_DUPLICATES or not received_data:
+        return None
+    return payload_fingerprint(received_data)
+
+
+def find_recent_duplicate(fingerprint):
+    """Return (found, job_id) for a payload seen within DUPLICATE_WINDOW. Caller must hold duplicates_lock."""
+    now = time.time()
+    while recent_payloads and now - next(iter(recent_payloads.values()))[1] >= DUPLICATE_WINDOW:
+        recent_payloads.popitem(last=False)
+    if fingerprint in recent_payloads:
+        return True, recent_payloads[fingerprint][0]
+    return False, None
+
+
+def enqueue_unique_job(received_data):
+    """enqueue_job, collapsing duplicates. Returns (job, duplicate_of); job is None if the queue is full or it's a duplicate."""
+    fingerprint = duplicate_fingerprint(received_data)
+    with duplicates_lock:
+        if fingerprint:
+            found, duplicate_of = find_recent_duplicate(fingerprint)
+            if found:
+                return None, duplicate_of
+        job = enqueue_job(received_data)
+        if fingerprint and job:
+            recent_payloads[fingerprint] = (job["id"], time.time())
+    return job, None
+
+
+def withdraw_job(job, received_data, reason, error):
+    """Take back a job whose webhook is answered with an error after all: it is dropped from the queue and
+    the ingest log, and a retry of the same payload isn't collapsed into it. A job a worker has already
+    picked up keeps going until the speaker, which skips it. received_data is the webhook's payload; the
+    job's own copy is gone once it is summarized."""
+    fingerprint = duplicate_fingerprint(received_data)
+    with duplicates_lock:
+        if fingerprint and recent_payloads.get(fingerprint, (None,))[0] == job["id"]:
+            del recent_payloads[fingerprint]
+    with pipeline_cond:
+        if any(waiting is job for waiting in coalesce_buffer):
+            coalesce_buffer[:] = [waiting for waiting in coalesce_buffer if waiting is not job]
+        for entry in schedule_heap:
+            jobs = entry[2]["jobs"]
+            if any(queued is job for queued in jobs):
+                if len(jobs) == 1:
+                    schedule_heap.remove(entry)
+                    heapq.heapify(schedule_heap)
+                else:
+                    jobs[:] = [queued for queued in jobs if queued is not job]
+                break
+        drop_announcement({"jobs": [job]}, reason, error)
+
+
+def speak_streamed_summary(received_data):
+    """Synchronous-mode streaming: speak each fragment while GPT keeps writing the rest."""
+    fragments = queue.Queue()
+
+    def produce():
+        try:
+            for fragment in summarize_with_gpt_stream(received_data):
+                fragments.put(fragment)
+        finally:
+            fragments.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    spoken = []
+    with playback_lock:
+        while True:
+            fragment = fragments.get()
+            if fragment is None:
+                break
+            spoken.append(fragment)
+            speak_text(fragment)
+    return " ".join(spoken)
+
+
+# === WEBHOOK ENDPOINT ===
+def parse_webhook_body():
+    """Read the request body. Returns (received_data, error_response); error_response is None on success."""
+    received_data = None
+    content_type = request.content_type
+
+    logging.debug("Request Content-Type: %s", content_type)
+    logging.debug("Request Headers: %s", request.headers) # Formatted only when DEBUG is on
+
+    if content_type and 'application/json' in content_type: # More robust check
+        try:
+            received_data = request.get_json() # Use get_json for better error handling
+            if received_data is None:
+                 logging.warning("Content-Type is JSON, but parsing returned None. Check JSON validity.")
+                 # Log raw body if possible (might be large)
+                 if logging.getLogger().isEnabledFor(logging.DEBUG):
+                     logging.debug(f"Raw request body (first 500 chars): {request.get_data(as_text=True)[:500]}")
+            else:
+                 logging.debug("Successfully parsed JSON data.")
+                 logging.debug("Received JSON data structure: %s", received_data)
+
+        except RequestEntityTooLarge:
+            raise # Answered with 413 by the caller, not as invalid JSON
+        except Exception as json_error: # Catch potential JSON parsing errors
+             logging.exception("Error parsing JSON request body.")
+             # Log raw body if possible (might be large)
+             if logging.getLogger().isEnabledFor(logging.DEBUG):
+                 logging.debug(f"Raw request body (first 500 chars): {request.get_data(as_text=True)[:500]}")
+             return None, (jsonify({"error": "Invalid JSON format"}), 400) # Return specific error
+
+    elif content_type and 'text/plain' in content_type:
+        try:
+            received_data = request.data.decode('utf-8')
+            logging.debug("Successfully decoded text/plain data.")
+            logging.debug("Received text data (first 500 chars): %.500s", received_data)
+        except UnicodeDecodeError:
+             logging.exception("Error decoding request body as UTF-8 text.")
+             return None, (jsonify({"error": "Invalid UTF-8 encoding in text body"}), 400)
+        except Exception:
+             logging.exception("Error reading text request body.")
+             return None, (jsonify({"error": "Could not read text request body"}), 400)
+    else:
+        # Handle unsupported or missing Content-Type
+        logging.warning(f"Unsupported or missing Content-Type: {content_type}. Attempting to read raw data as text.")
+        try:
+            # Try decoding as text, but don't assume it will work
+            received_data = request.data.decode('utf-8')
+            logging.debug("Read raw data (decoded as text fallback).")
+            logging.debug("Received raw fallback data (first 500 chars): %.500s", received_data)
+        except Exception:
+            # If decoding fails, maybe it's binary or empty
+             received_data = request.data
+             logging.warning(f"Could not decode raw data as text (length: {len(received_data)} bytes). Passing raw bytes might fail later.")
+             # You might want to reject binary data here if you don't expect it
+             # return jsonify({"error": "Unsupported content type and failed to read as text"}), 415
+
+    return received_data, None
+
+
+def webhook_body_too_large():
+    if request.content_length is not None:
+        return request.content_length > MAX_WEBHOOK_BYTES
+    # Chunked bodies have no Content-Length; reading (and caching for the parser) stops one byte past the limit
+    try:
+        return len(request.get_data(cache=True)) > MAX_WEBHOOK_BYTES
+    except RequestEntityTooLarge:
+        return True
+
+
+@app.route('/webhook', methods=['POST'])
+def handle_webhook():
+    logging.debug("--- Webhook request received ---")
+
+    try:
+        if webhook_body_too_large():
+            logging.warning(f"Rejecting webhook body over {MAX_WEBHOOK_BYTES} bytes (Content-Length: {request.content_length}).")
+            webhook_requests.inc(outcome="too_large")
+            return jsonify({"error": f"Request body exceeds {MAX_WEBHOOK_BYTES} bytes"}), 413
+
+        if rate_limiter:
+            source = webhook_source()
+            retry_after = rate_limiter.acquire(source)
+            if retry_after:
+                logging.debug("Rate limiting webhooks from %s; retry in %.1fs.", source, retry_after)
+                webhook_requests.inc(outcome="rate_limited")
+                return jsonify({"error": "Too many webhooks from this source"}), 429, {"Retry-After": str(math.ceil(retry_after))}
+
+        started_at = time.time()
+        try:
+            received_data, error_response = parse_webhook_body()
+        except RequestEntityTooLarge:
+            webhook_requests.inc(outcome="too_large")
+            return jsonify({"error": f"Request body exceeds {MAX_WEBHOOK_BYTES} bytes"}), 413
+        webhook_parse_seconds.observe(time.time() - started_at)
+        if error_response:
+            webhook_requests.inc(outcome="bad_request")
+            return error_response
+
+        if QUEUE_MODE:
+            job, duplicate_of = enqueue_unique_job(received_data)
+            if duplicate_of:
+                logging.debug("--- Duplicate webhook collapsed into job %s ---", duplicate_of)
+                webhook_requests.inc(outcome="duplicate")
+                status_url = url_for('get_job', job_id=duplicate_of)
+                return jsonify({"job_id": duplicate_of, "status": "duplicate", "status_url": status_url}), 202, {"Location": status_url}
+            if job is None:
+                logging.error("Job queue is full; rejecting webhook.") # Or shed: low priority past SHED_QUEUE_DEPTH
+                webhook_requests.inc(outcome="rejected")
+                return jsonify({"error": "Job queue is full, try again later"}), 503
+            # Waiting outside the queue locks lets concurrent webhooks share one fsync
+            if ingest_log and not ingest_log.sync(INGEST_SYNC_TIMEOUT):
+                logging.error(f"Job {job['id']} did not reach the ingest log in time; rejecting webhook.")
+                withdraw_job(job, received_data, "not_durable", "Not recorded in the ingest log in time.")
+                webhook_requests.inc(outcome="not_durable")
+                return jsonify({"error": "Could not record the webhook, try again later"}), 503
+            status_url = url_for('get_job', job_id=job["id"])
+            logging.debug("--- Webhook accepted as job %s ---", job['id'])
+            webhook_requests.inc(outcome="accepted")
+            return jsonify({"job_id": job["id"], "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+        # --- Synchronous mode: summarize and speak before responding ---
+        fingerprint = duplicate_fingerprint(received_data)
+        if fingerprint:
+            with duplicates_lock:
+                found, _ = find_recent_duplicate(fingerprint)
+                if not found:
+                    recent_payloads[fingerprint] = (None, time.time())
+            if found:
+                logging.debug("--- Duplicate webhook ignored ---")
+                webhook_requests.inc(outcome="duplicate")
+                return '', 204
+
+        if STREAM_SUMMARY and received_data:
+            if not speak_streamed_summary(received_data):
+                logging.error("Summary generation failed, nothing to speak.")
+            logging.debug("--- Webhook request processing complete ---")
+            webhook_requests.inc(outcome="spoken")
+            return '', 204
+
+        summary = build_summary(received_data)
+
+        # --- Speak the summary (or error message from GPT) ---
+        if summary: # Check if summary is not None or empty
+            with playback_lock:
+                speak_text(summary)
+        else:
+             logging.error("Summary generation failed, nothing to speak.")
+             # Potentially speak a generic error message here?
+             # speak_text("ShadowDesk apologizes, an internal error occurred.")
+
+        logging.debug("--- Webhook request processing complete ---")
+        webhook_requests.inc(outcome="spoken")
+        # Return "204 No Content" only if everything seemed okay, otherwise Flask default is 200 OK
+        # Or consider returning the summary or an error status in the response body.
+        return '', 204
+
+    except Exception as e:
+        # Catch-all for any unexpected errors during request handling
+        logging.exception("An unexpected error occurred in the main webhook handler.")
+        webhook_requests.inc(outcome="error")
+        # Return a generic server error response
+        return jsonify({"error": "Internal Server Error"}), 500
+
+
+@app.route('/status', methods=['GET'])
+def get_status():
+    with pipeline_cond:
+        pipeline = {
+            "coalescing": len(coalesce_buffer),
+            "queued": len(schedule_heap),
+            "waiting_for_synthesis": len(synth_heap),
+            "ready_to_play": len(ready_parts),
+        }
+    return jsonify({
+        "pipeline": pipeline,
+        "summary_cache": summary_cache.stats() if summary_cache else None,
+        "audio_cache": audio_cache.stats() if audio_cache else None,
+        "ingest_log": ingest_log.stats() if ingest_log else None,
+        "rate_limiter": rate_limiter.stats() if rate_limiter else None,
+        "broadcast": broadcaster.stats() if broadcaster else None,
+        "tts": get_tts_status(),
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if request.args.get("format") == "json":
+        return jsonify(metrics_snapshot()), 200
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.route('/tts', methods=['GET'])
+def get_tts():
+    return jsonify(get_tts_status()), 200
+
+
+@app.route('/playback', methods=['GET'])
+def get_playback():
+    return jsonify(get_player().status()), 200
+
+
+@app.route('/playback/skip', methods=['POST'])
+def skip_playback():
+    return jsonify({"skipped": get_player().skip()}), 200
+
+
+@app.route('/playback/stop', methods=['POST'])
+def stop_playback():
+    return jsonify({"stopped": get_player().stop()}), 200
+
+
+@app.route('/events', methods=['GET'])
+def broadcast_events():
+    """Server-sent events for announcements as they start playing. ?history=N first replays the last N clips."""
+    if not broadcaster:
+        return jsonify({"error": "Broadcast mode is off"}), 404
+    after = broadcaster.resume_after(request.headers.get("Last-Event-ID", "")) # A reconnecting listener picks up where it left off
+    if after is None:
+        history = max(0, request.args.get("history", 0, type=int)) # A negative count would skip upcoming clips
+        after = max(0, broadcaster.stats()["last_id"] - history)
+    return Response(broadcaster.events(after), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/clips', methods=['GET'])
+def get_broadcast_clips():
+    if not broadcaster:
+        return jsonify({"error": "Broadcast mode is off"}), 404
+    return jsonify({"clips": broadcaster.recent()}), 200
+
+
+def count_broadcast_bytes(chunks):
+    for chunk in chunks:
+        broadcast_bytes.inc(len(chunk))
+        yield chunk
+
+
+@app.route('/audio/<int:clip_id>', methods=['GET'])
+def get_broadcast_audio(clip_id):
+    """A recent clip's audio, from memory. Supports Range requests once the clip has finished rendering."""
+    clip = broadcaster.get(clip_id) if broadcaster else None
+    if clip is None or clip[1] is None:
+        return jsonify({"error": "Clip not found"}), 404
+    info, stream = clip
+    if request.range is None and not stream.done:
+        # Still downloading: pass the audio through as it arrives, just like the local speaker gets it
+        return Response(count_broadcast_bytes(stream.iter_chunks()), mimetype=info["content_type"],
+                        headers={"Cache-Control": "no-cache"})
+    audio = stream.read_all()
+    if audio is None:
+        return jsonify({"error": "Audio rendering failed"}), 404
+    response = Response(audio, mimetype=info["content_type"], headers={"Cache-Control": "no-cache"})
+    response.set_etag(f"clip-{clip_id}-{info['published_at']}")
+    response.make_conditional(request, accept_ranges=True, complete_length=len(audio)) # 206/304/416 as needed
+    broadcast_bytes.inc(response.content_length or 0)
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_view(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
 
 
 # === RUN SERVER ===
 if __name__ == '__main__':
+    start_pipeline()
     logging.info(f"--- Starting Flask server on host 0.0.0.0 port {LISTEN_PORT} ---")
     # Turn off Flask's default debugging in production if desired,
     # but keep it on for development debugging (provides interactive debugger in browser).
     # Set debug=True for development, debug=False for production.
     # Use debug=os.environ.get('FLASK_DEBUG', 'False').lower() == 'true' to control via env var
-    app.run(host='0.0.0.0', port=LISTEN_PORT, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=LISTEN_PORT, debug=False)
@@ -0,0 +1,170 @@
+"""ShadowDesk speaker: the one process that owns the audio device when main.py runs as several workers.
+
+Start the speaker once, then any number of HTTP workers pointed at the same address:
+
+    export SPEAKER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    SPEAKER_ADDRESS=127.0.0.1:6100 python speaker.py
+    SPEAKER_ADDRESS=127.0.0.1:6100 gunicorn -w 4 -b 0.0.0.0:5000 main:app
+
+Workers accept webhooks, summarize and render announcements, and hand the audio over a local
+multiprocessing.connection channel (see main.SpeakerClient), authenticated with SPEAKER_AUTHKEY.
+The speaker plays clips one at a time, in the order they reach it, so announcements from different
+workers never talk over each other.
+PLAYBACK_BACKEND and the pyttsx3 settings apply here; the workers never open an audio device.
+"""
+import logging
+import os
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+import main
+
+# === CONFIGURATION ===
+SPEAKER_ADDRESS = main.SPEAKER_ADDRESS or "127.0.0.1:6100" # Where workers connect; same format as in main.py
+
+
+# === SPEAKER ===
+class SpeakerClip:
+    """One announcement handed over by a worker: streamed audio, or text to speak live with pyttsx3."""
+
+    def __init__(self, conn, label=None, text=None):
+        self.conn = conn
+        self.label = label
+        self.text = text
+        self.stream = main.AudioStream() if text is None else None
+        self.success = False
+        self.finished = threading.Event()
+
+    def notify_start(self):
+        try:
+            self.conn.send(("started", None))
+        except (OSError, ValueError):
+            pass # The worker went away; the clip still plays
+
+
+class Speaker:
+    """Plays the clips of every connected worker on this process's player, strictly one at a time."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.clips = deque() # Waiting to play, in arrival order
+        self.current = None
+        self.workers = 0 # Open connections
+
+    def submit(self, clip):
+        with self.cond:
+            self.clips.append(clip)
+            self.cond.notify_all()
+
+    def playback_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.clips)
+                clip = self.current = self.clips.popleft()
+            try:
+                if clip.text is not None:
+                    clip.success = main.speak_with_pyttsx3(clip.text)
+                else:
+                    clip.success = main.play_audio(clip.stream, label=clip.label, on_start=clip.notify_start)
+            except Exception:
+                logging.exception(f"Unexpected error playing '{clip.label}'.")
+            finally:
+                with self.cond:
+                    self.current = None
+                clip.finished.set()
+
+    def skip(self):
+        with self.cond:
+            if self.current is None or self.current.text is not None:
+                return False # Live pyttsx3 speech cannot be interrupted
+        return main.get_player().skip()
+
+    def stop(self):
+        """Drop every waiting clip and skip the one playing. Returns how many were dropped."""
+        with self.cond:
+            dropped = list(self.clips)
+            self.clips.clear()
+        for clip in dropped:
+            clip.success = True # Dropped on purpose, not a playback failure
+            clip.finished.set()
+        return len(dropped) + main.get_player().stop()
+
+    def status(self):
+        status = main.get_player().status()
+        with self.cond:
+            status.update(speaker_queue=len(self.clips), workers=self.workers)
+        return status
+
+    def receive_audio(self, conn, stream):
+        try:
+            while True:
+                kind, value = conn.recv()
+                if kind == "data":
+                    stream.append(value)
+                elif kind == "end":
+                    stream.finish(failed=value)
+                    return
+        except (OSError, EOFError):
+            stream.finish(failed=True) # Play whatever arrived before the worker went away
+            raise
+
+    def serve(self, conn):
+        """Handle one worker request; every clip and every control call uses its own connection."""
+        with self.cond:
+            self.workers += 1
+        try:
+            with conn:
+                kind, value = conn.recv()
+                if kind in ("play", "speak"):
+                    clip = SpeakerClip(conn, label=value) if kind == "play" else SpeakerClip(conn, label=value, text=value)
+                    self.submit(clip) # Queued on arrival, so playback can begin while the audio still streams in
+                    if clip.stream is not None:
+                        self.receive_audio(conn, clip.stream)
+                    clip.finished.wait()
+                    conn.send(("finished", clip.success))
+                elif kind == "skip":
+                    conn.send(("skipped", self.skip()))
+                elif kind == "stop":
+                    conn.send(("stopped", self.stop()))
+                elif kind == "status":
+                    conn.send(("status", self.status()))
+                else:
+                    logging.warning(f"Ignoring unknown speaker request '{kind}'.")
+        except (OSError, EOFError, ValueError):
+            logging.debug("Worker disconnected from the speaker.")
+        finally:
+            with self.cond:
+                self.workers -= 1
+
+
+def run_speaker():
+    if not main.SPEAKER_AUTHKEY:
+        # multiprocessing.connection unpickles every message, so the speaker never listens without a secret
+        logging.critical("FATAL: SPEAKER_AUTHKEY environment variable not set.")
+        raise SystemExit(1)
+    address = main.parse_speaker_address(SPEAKER_ADDRESS)
+    if isinstance(address, str) and os.path.exists(address) and not address.startswith("\\\\"):
+        os.unlink(address) # Stale Unix socket from a previous run
+    with main.player_lock:
+        main.player = main.create_local_player() # This process owns the device, whatever SPEAKER_ADDRESS says
+    speaker = Speaker()
+    threading.Thread(target=speaker.playback_loop, name="speaker-playback", daemon=True).start()
+    with Listener(address, authkey=main.SPEAKER_AUTHKEY) as listener:
+        logging.info(f"--- Speaker listening on {SPEAKER_ADDRESS} with the {main.player.name} player ---")
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logging.warning("Rejected a speaker connection with the wrong SPEAKER_AUTHKEY.")
+                continue
+            except OSError:
+                logging.exception("Failed to accept a speaker connection.")
+                continue
+            threading.Thread(target=speaker.serve, args=(conn,), name="speaker-connection", daemon=True).start()
+
+
+# === RUN SPEAKER ===
+if __name__ == "__main__":
+    run_speaker()
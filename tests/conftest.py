@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# main.py reads its configuration at import time: no audio device, no ingest log, no disk caches
+os.environ.update(
+    PLAYBACK_BACKEND="null",
+    NULL_PLAYBACK_RATE="0",
+    INGEST_LOG_DIR="",
+    AUDIO_CACHE_MAX_BYTES="0",
+    SUMMARY_CACHE_PATH="",
+    SPEAKER_ADDRESS="",
+    BROADCAST="false",
+    DATA_DIR=tempfile.mkdtemp(prefix="shadowdesk-tests-"),
+    LOG_LEVEL="CRITICAL",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
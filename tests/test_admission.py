@@ -0,0 +1,163 @@
+import itertools
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """A fresh, empty pipeline with no worker threads; tests take announcements with next_announcement()."""
+    monkeypatch.setattr(main, "start_job_workers", lambda: None)
+    monkeypatch.setattr(main, "schedule_heap", [])
+    monkeypatch.setattr(main, "coalesce_buffer", [])
+    monkeypatch.setattr(main, "schedule_order", itertools.count())
+    monkeypatch.setattr(main, "next_seq", 0)
+    monkeypatch.setattr(main, "ingest_log", None)
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 0)
+    monkeypatch.setattr(main, "JOB_QUEUE_SIZE", 3)
+    monkeypatch.setattr(main, "SHED_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(main, "LOW_PRIORITY_MAX_AGE", 0)
+    monkeypatch.setattr(main, "BACKLOG_WORD_LIMITS", [])
+    monkeypatch.setattr(main, "priority_rules", main.parse_priority_rules("level=high:high,level=low:low"))
+
+
+def job_ids(announcement):
+    return [job["id"] for job in announcement["jobs"]]
+
+
+def test_priority_rules():
+    rules = main.parse_priority_rules("rating<=2:high, event=Heartbeat:low, data.rating>=4:low, bogus, x=1:urgent")
+    assert [(rule.path, rule.op, rule.value, rule.priority) for rule in rules] == [
+        ("rating", "<=", "2", "high"), ("event", "=", "Heartbeat", "low"), ("data.rating", ">=", "4", "low"),
+    ]
+    assert [rule.priority for rule in rules if rule.matches({"rating": 1})] == ["high"]
+    assert [rule.priority for rule in rules if rule.matches({"event": "heartbeat"})] == ["low"]
+    assert [rule.priority for rule in rules if rule.matches({"data": {"rating": "5"}})] == ["low"]
+    assert [rule.priority for rule in rules if rule.matches({"rating": "abc"})] == []
+
+
+def test_priority_header_wins_over_rules(pipeline):
+    assert main.job_priority({"level": "low"}, {"X-Priority": "High"}) == "high"
+    assert main.job_priority({"level": "low"}, {"X-Priority": "bogus"}) == "low"
+    assert main.job_priority("text body") == main.DEFAULT_PRIORITY
+
+
+def test_rate_limiter_allows_bursts_then_refills(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    limiter = main.RateLimiter(rate=2, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    assert limiter.acquire("b") == 0 # Sources have separate buckets
+    clock[0] += 0.5
+    assert limiter.acquire("a") == 0
+    assert limiter.stats() == {"sources": 2, "limited": 1}
+
+
+def test_rate_limiter_forgets_idle_and_excess_sources(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    limiter = main.RateLimiter(rate=1, burst=2, max_sources=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+    assert list(limiter.buckets) == ["b", "c"] # Least recently seen goes first
+    clock[0] += 2 # Long enough for every bucket to refill
+    limiter.acquire("d")
+    assert list(limiter.buckets) == ["d"]
+
+
+def test_announcements_are_taken_most_urgent_first(pipeline):
+    low = main.enqueue_job({"level": "low"})
+    normal = main.enqueue_job({"level": "normal"})
+    high = main.enqueue_job({"level": "high"})
+    taken = [main.next_announcement() for _ in range(3)]
+    assert [job_ids(a) for a in taken] == [[high["id"]], [normal["id"]], [low["id"]]]
+    assert [a["seq"] for a in taken] == [0, 1, 2]
+
+
+def test_full_queue_evicts_newest_lower_priority_job(pipeline):
+    first_low = main.enqueue_job({"level": "low"})
+    newest_low = main.enqueue_job({"level": "low"})
+    normal = main.enqueue_job({"level": "normal"})
+    assert main.enqueue_job({"level": "low"}) is None # Nothing of lower priority to make room
+    high = main.enqueue_job({"level": "high"})
+    assert high is not None
+    assert newest_low["status"] == "dropped"
+    assert first_low["status"] == "queued"
+    taken = [job_ids(main.next_announcement()) for _ in range(3)]
+    assert taken == [[high["id"]], [normal["id"]], [first_low["id"]]]
+
+
+def test_full_coalescing_window_makes_room_for_urgent_jobs(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 30)
+    normal = main.enqueue_job({"level": "normal"})
+    newest_low = main.enqueue_job({"level": "low"})
+    low = main.enqueue_job({"level": "low"})
+    assert main.coalesce_buffer == [normal, newest_low, low]
+    assert main.enqueue_job({"level": "normal"}) is not None # Evicts the newest buffered low-priority job
+    assert low["status"] == "dropped"
+    high = main.enqueue_job({"level": "high"}) # Skips the window
+    assert newest_low["status"] == "dropped"
+    assert [job_ids(main.next_announcement())] == [[high["id"]]]
+    newest_normal = main.enqueue_job({"level": "normal"})
+    assert main.enqueue_job({"level": "high"}) is not None # Only normal jobs left: the newest one goes
+    assert newest_normal["status"] == "dropped"
+    assert normal["status"] == "queued"
+
+
+def test_low_priority_webhooks_are_shed(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "SHED_QUEUE_DEPTH", 1)
+    assert main.enqueue_job({"level": "normal"}) is not None
+    assert main.enqueue_job({"level": "low"}) is None
+    assert main.enqueue_job({"level": "normal"}) is not None
+
+
+def test_stale_low_priority_jobs_expire(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "LOW_PRIORITY_MAX_AGE", 60)
+    stale = main.enqueue_job({"level": "low"})
+    stale["timestamps"]["queued"] -= 61
+    fresh = main.enqueue_job({"level": "low"})
+    normal = main.enqueue_job({"level": "normal"})
+    normal["timestamps"]["queued"] -= 61 # Only low-priority jobs expire
+    assert job_ids(main.next_announcement()) == [normal["id"]]
+    assert job_ids(main.next_announcement()) == [fresh["id"]]
+    assert stale["status"] == "dropped"
+    assert main.schedule_heap == []
+
+
+def test_full_queue_expires_stale_jobs_before_refusing(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "LOW_PRIORITY_MAX_AGE", 60)
+    stale = [main.enqueue_job({"level": "low"}) for _ in range(3)]
+    for job in stale:
+        job["timestamps"]["queued"] -= 61
+    assert main.enqueue_job({"level": "low"}) is not None
+    assert [job["status"] for job in stale] == ["dropped"] * 3
+
+
+def test_backlog_shortens_announcements(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "BACKLOG_WORD_LIMITS", [(1, 20), (2, 10)])
+    for _ in range(3):
+        main.enqueue_job({"level": "normal"})
+    assert [main.next_announcement()["max_words"] for _ in range(3)] == [10, 20, None]
+
+
+def test_webhook_source_trusts_only_the_proxy_entries(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_SOURCE_HEADER", "X-Forwarded-For")
+    headers = [("X-Forwarded-For", "1.1.1.1, 2.2.2.2"), ("X-Forwarded-For", "3.3.3.3")]
+    with main.app.test_request_context("/webhook", headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+        assert main.webhook_source() == "3.3.3.3" # The client wrote 1.1.1.1 and 2.2.2.2 itself
+        monkeypatch.setattr(main, "RATE_LIMIT_TRUSTED_HOPS", 2)
+        assert main.webhook_source() == "2.2.2.2"
+        monkeypatch.setattr(main, "RATE_LIMIT_TRUSTED_HOPS", 4)
+        assert main.webhook_source() == "10.0.0.1" # Fewer entries than proxies: the header can't be trusted
+
+
+def test_webhooks_over_the_rate_get_429(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(rate=1, burst=1))
+    client = main.app.test_client()
+    assert client.post("/webhook", json={"issue": "printer jam"}).status_code == 202
+    response = client.post("/webhook", json={"issue": "printer jam again"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+import async_server
+
+
+def post_webhook(headers, body=b""):
+    """Run one POST /webhook through the ASGI app; returns (status, response body)."""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/webhook", "client": ("127.0.0.1", 5000),
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]}
+    asyncio.run(async_server.app(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+def test_empty_json_body_is_invalid_like_flask():
+    assert async_server.decode_webhook_body("application/json", b"") == (None, "Invalid JSON format")
+    assert post_webhook({"Content-Type": "application/json", "Content-Length": "0"})[0] == 400
+
+
+def test_non_numeric_content_length_is_a_bad_request():
+    assert post_webhook({"Content-Type": "application/json", "Content-Length": "lots"}, b"{}")[0] == 400
@@ -0,0 +1,44 @@
+import os
+
+import main
+
+
+def age(cache, key, seconds_ago):
+    path = os.path.join(cache.directory, key + ".audio")
+    stamp = os.path.getmtime(path) - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+def test_hits_and_misses(tmp_path):
+    cache = main.AudioCache(str(tmp_path / "cache"), 100)
+    assert cache.get("a") is None
+    cache.put("a", b"audio")
+    assert "a" in cache
+    assert cache.get("a") == b"audio"
+    assert cache.stats() == {"entries": 1, "bytes": 5, "hits": 1, "misses": 1}
+    cache.put("big", b"x" * 101) # Larger than the whole budget
+    assert "big" not in cache
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = main.AudioCache(str(tmp_path), 10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+    assert cache.get("a") == b"1234" # Now the most recently used
+    cache.put("c", b"1234")
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_processes_sharing_a_directory_share_the_budget(tmp_path):
+    first = main.AudioCache(str(tmp_path), 10)
+    second = main.AudioCache(str(tmp_path), 10)
+    first.put("a", b"123456")
+    age(first, "a", 10)
+    assert second.get("a") == b"123456" # Written by the other process
+    age(second, "a", 10)
+    second.put("b", b"123456")
+    assert "a" not in first # Evicted by the other process to stay within one budget
+    assert first.stats()["bytes"] == 6
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def broadcaster(monkeypatch):
+    broadcaster = main.Broadcaster(history=3)
+    monkeypatch.setattr(main, "broadcaster", broadcaster)
+    monkeypatch.setattr(main, "BROADCAST_KEEPALIVE", 0.01)
+    return broadcaster
+
+
+def open_events(url, headers=None):
+    """The announcement ids /events sends, one at a time."""
+    response = main.app.test_client().get(url, headers=headers, buffered=False)
+    assert response.status_code == 200
+    chunks = response.iter_encoded()
+    assert next(chunks).startswith(b"retry:")
+
+    def next_clip_id(keepalives=50):
+        for chunk in chunks:
+            lines = chunk.decode().splitlines()
+            if lines[0].startswith("id:"):
+                return json.loads(lines[2][len("data: "):])["id"]
+            keepalives -= 1
+            if keepalives == 0:
+                return None # Nothing arrived
+    return response, next_clip_id
+
+
+def test_history_replays_recent_clips(broadcaster):
+    for text in ("one", "two", "three", "four"):
+        broadcaster.publish(text)
+    assert [clip["id"] for clip in broadcaster.recent()] == [2, 3, 4] # Only history=3 clips are kept
+    response, next_clip_id = open_events("/events?history=2")
+    assert [next_clip_id(), next_clip_id()] == [3, 4]
+    response.close()
+
+
+def test_negative_history_still_gets_new_clips(broadcaster):
+    broadcaster.publish("old")
+    response, next_clip_id = open_events("/events?history=-3")
+    broadcaster.publish("new")
+    assert next_clip_id() == 2
+    response.close()
+
+
+def test_last_event_id_resumes_after_that_clip(broadcaster):
+    for text in ("one", "two", "three"):
+        broadcaster.publish(text)
+    response, next_clip_id = open_events("/events", {"Last-Event-ID": f"{broadcaster.epoch}-2"})
+    assert next_clip_id() == 3
+    response.close()
+    response, next_clip_id = open_events("/events", {"Last-Event-ID": "otherrun-2"}) # An earlier run's ids
+    assert next_clip_id() == 1
+    response.close()
+
+
+def test_finished_audio_supports_range_requests(broadcaster):
+    info = broadcaster.publish("clip", main.AudioStream(b"ID3 0123456789"))
+    client = main.app.test_client()
+    response = client.get(info["audio_url"], headers={"Range": "bytes=4-7"})
+    assert response.status_code == 206
+    assert response.data == b"0123"
+    assert client.get(info["audio_url"]).data == b"ID3 0123456789"
+    assert client.get("/audio/99").status_code == 404
+    assert client.get("/clips").get_json()["clips"][0]["content_type"] == "audio/mpeg"
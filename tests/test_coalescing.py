@@ -0,0 +1,69 @@
+import itertools
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def summarized(monkeypatch):
+    """An empty pipeline with a short coalescing window and no worker threads; returns what GPT was given."""
+    monkeypatch.setattr(main, "start_job_workers", lambda: None)
+    monkeypatch.setattr(main, "schedule_heap", [])
+    monkeypatch.setattr(main, "coalesce_buffer", [])
+    monkeypatch.setattr(main, "schedule_order", itertools.count())
+    monkeypatch.setattr(main, "synth_heap", [])
+    monkeypatch.setattr(main, "ready_parts", {})
+    monkeypatch.setattr(main, "next_seq", 0)
+    monkeypatch.setattr(main, "next_play_seq", 0)
+    monkeypatch.setattr(main, "next_play_index", 0)
+    monkeypatch.setattr(main, "ingest_log", None)
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 0.05)
+    monkeypatch.setattr(main, "COALESCE_MAX_BATCH", 10)
+    monkeypatch.setattr(main, "STREAM_SUMMARY", False)
+    monkeypatch.setattr(main, "USE_ELEVENLABS", False)
+    monkeypatch.setattr(main, "PYTTSX3_RENDER", True)
+    monkeypatch.setattr(main, "synthesize_speech", lambda text: main.AudioStream(b"RIFF audio"))
+    monkeypatch.setattr(main, "play_audio", lambda stream, label=None, on_start=None: on_start() or True)
+    inputs = []
+    monkeypatch.setattr(main, "summarize_with_gpt", lambda data, max_words=None: inputs.append(data) or f"{len(data)} requests.")
+    return inputs
+
+
+def post(payload, headers=None):
+    response = main.app.test_client().post("/webhook", json=payload, headers=headers)
+    assert response.status_code == 202
+    return response.get_json()["job_id"]
+
+
+def test_burst_becomes_one_digest_for_every_job(summarized):
+    job_ids = [post({"issue": f"printer jam {n}"}) for n in range(3)]
+    main.coalesce_next_batch() # Waits out the window
+    announcement = main.next_announcement()
+    assert [job["id"] for job in announcement["jobs"]] == job_ids
+    main.summarize_announcement(announcement)
+    main.synthesize_next_part()
+    main.play_next_part()
+
+    [digest] = summarized
+    assert isinstance(digest, main.DigestPayload)
+    assert [payload["issue"] for payload in digest] == ["printer jam 0", "printer jam 1", "printer jam 2"]
+    for job_id in job_ids:
+        job = main.get_job_view(job_id)
+        assert (job["status"], job["summary"], job["digest"]) == ("done", "3 requests.", job_ids)
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window(summarized, monkeypatch):
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 60)
+    monkeypatch.setattr(main, "COALESCE_MAX_BATCH", 2)
+    job_ids = [post({"issue": f"printer jam {n}"}) for n in range(3)]
+    main.coalesce_next_batch()
+    assert [job["id"] for job in main.next_announcement()["jobs"]] == job_ids[:2]
+    assert [job["id"] for job in main.coalesce_buffer] == job_ids[2:]
+
+
+def test_high_priority_webhooks_skip_the_window(summarized):
+    post({"issue": "printer jam"})
+    urgent = post({"issue": "server room flooding"}, {"X-Priority": "high"})
+    assert [job["id"] for job in main.next_announcement()["jobs"]] == [urgent]
+    assert len(main.coalesce_buffer) == 1
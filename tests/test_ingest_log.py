@@ -0,0 +1,169 @@
+import json
+import os
+
+import pytest
+
+import main
+
+
+def open_log(directory, segment_bytes=1 << 20):
+    log = main.IngestLog(str(directory), segment_bytes)
+    return log, log.recover()
+
+
+def restart(log, segment_bytes=1 << 20):
+    """Release log's directory as its process exiting would, and open it again."""
+    log.slot_lock.close()
+    return open_log(log.directory, segment_bytes)
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def test_recover_replays_unfinished_jobs_in_order(tmp_path):
+    log, replay = open_log(tmp_path)
+    assert replay == []
+    log.append("a", {"n": 1})
+    log.append("b", b"\xff\xfe")
+    log.append("c", "plain text")
+    log.mark_done("a")
+    assert log.sync(5)
+
+    _, replay = restart(log)
+    assert replay == [("b", b"\xff\xfe"), ("c", "plain text")]
+
+
+def test_mark_done_of_unknown_job_writes_nothing(tmp_path):
+    log, _ = open_log(tmp_path)
+    log.mark_done("missing")
+    assert log.sync(5)
+    assert log.stats()["records_written"] == 0
+
+
+def test_torn_write_is_skipped_on_replay(tmp_path):
+    log, _ = open_log(tmp_path)
+    log.append("a", {"n": 1})
+    log.append("b", {"n": 2})
+    assert log.sync(5)
+    path = os.path.join(tmp_path, segments(tmp_path)[-1])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "accepted", "id": "c", "da') # Crash in the middle of a record
+
+    _, replay = restart(log)
+    assert replay == [("a", {"n": 1}), ("b", {"n": 2})]
+
+
+def test_recover_compacts_into_a_single_segment(tmp_path):
+    log, _ = open_log(tmp_path)
+    for i in range(4):
+        log.append(f"j{i}", {"n": i})
+    log.mark_done("j0")
+    log.mark_done("j2")
+    assert log.sync(5)
+
+    _, replay = restart(log)
+    assert [job_id for job_id, _ in replay] == ["j1", "j3"]
+    names = segments(tmp_path)
+    assert names == ["segment-00000002.jsonl"]
+    with open(os.path.join(tmp_path, names[0]), encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["j1", "j3"]
+
+
+def test_rotation_carries_only_unfinished_jobs(tmp_path):
+    log, _ = open_log(tmp_path, segment_bytes=300)
+    for i in range(10):
+        log.append(f"j{i}", {"n": i, "pad": "x" * 40})
+        if i % 2 == 0:
+            log.mark_done(f"j{i}")
+        assert log.sync(5)
+    log.mark_done("j9") # Too small to rotate again; once it is written, the writer has finished rotating
+    assert log.sync(5)
+
+    assert log.stats()["segment"] > 1
+    assert len(segments(tmp_path)) == 1
+    _, replay = restart(log)
+    assert [job_id for job_id, _ in replay] == ["j1", "j3", "j5", "j7"]
+
+
+def test_shared_logs_claim_separate_slots(tmp_path):
+    first = main.IngestLog(str(tmp_path), 1 << 20, shared=True)
+    second = main.IngestLog(str(tmp_path), 1 << 20, shared=True)
+    first.recover()
+    second.recover()
+    assert os.path.basename(first.directory) == "worker-0"
+    assert os.path.basename(second.directory) == "worker-1"
+
+
+def test_second_process_on_the_same_directory_gets_no_log(tmp_path, monkeypatch):
+    log, _ = open_log(tmp_path)
+    log.append("a", {"n": 1})
+    assert log.sync(5)
+    other = main.IngestLog(str(tmp_path), 1 << 20)
+    with pytest.raises(RuntimeError):
+        other.recover()
+
+    monkeypatch.setattr(main, "ingest_log", other)
+    assert main.recover_ingest_log() == []
+    assert main.ingest_log is None
+    log.append("b", {"n": 2}) # The first log keeps its segments
+    assert log.sync(5)
+    _, replay = restart(log)
+    assert [job_id for job_id, _ in replay] == ["a", "b"]
+
+
+def test_unwritable_directory_disables_the_log(tmp_path, monkeypatch):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(main, "ingest_log", main.IngestLog(str(blocker / "log"), 1 << 20))
+    assert main.recover_ingest_log() == []
+    assert main.ingest_log is None
+
+
+def test_webhook_not_in_the_log_in_time_is_rejected_and_dropped(tmp_path, monkeypatch):
+    log, _ = open_log(tmp_path)
+    monkeypatch.setattr(main, "ingest_log", log)
+    monkeypatch.setattr(main, "start_job_workers", lambda: None)
+    monkeypatch.setattr(main, "schedule_heap", [])
+    monkeypatch.setattr(main, "coalesce_buffer", [])
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 0)
+    monkeypatch.setattr(main, "COLLAPSE_DUPLICATES", True)
+    monkeypatch.setattr(main, "recent_payloads", main.OrderedDict())
+    synced = log.sync
+    monkeypatch.setattr(log, "sync", lambda timeout: False)
+    client = main.app.test_client()
+
+    response = client.post("/webhook", json={"issue": "printer jam"})
+    assert response.status_code == 503
+    assert main.schedule_heap == []
+
+    monkeypatch.setattr(log, "sync", synced)
+    response = client.post("/webhook", json={"issue": "printer jam"}) # The retry isn't collapsed into the dropped job
+    assert response.status_code == 202
+    assert response.get_json()["status"] == "queued"
+    _, replay = restart(log)
+    assert [job_id for job_id, _ in replay] == [response.get_json()["job_id"]]
+
+
+def test_job_withdrawn_after_pickup_is_not_spoken(tmp_path, monkeypatch):
+    log, _ = open_log(tmp_path)
+    monkeypatch.setattr(main, "ingest_log", log)
+    monkeypatch.setattr(main, "start_job_workers", lambda: None)
+    monkeypatch.setattr(main, "schedule_heap", [])
+    monkeypatch.setattr(main, "coalesce_buffer", [])
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 0)
+    spoken = []
+    monkeypatch.setattr(main, "speak_with_pyttsx3", lambda text: spoken.append(text) or True)
+    monkeypatch.setattr(main, "play_audio", lambda stream, label=None, on_start=None: spoken.append(label) or True)
+
+    received_data = {"issue": "printer jam"}
+    job = main.enqueue_job(received_data)
+    announcement = main.next_announcement()
+    announcement["jobs"][0].pop("data") # As the summarize worker does
+    main.withdraw_job(job, received_data, "not_durable", "Not recorded in the ingest log in time.")
+    assert job["status"] == "dropped"
+
+    main.play_part({"announcement": announcement, "text": "Hark, a printer jam.", "audio": None, "last": True})
+    assert spoken == []
+    _, replay = restart(log)
+    assert replay == []
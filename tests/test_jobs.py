@@ -0,0 +1,64 @@
+import itertools
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """An empty pipeline with no worker threads; tests run each stage by hand."""
+    monkeypatch.setattr(main, "start_job_workers", lambda: None)
+    monkeypatch.setattr(main, "schedule_heap", [])
+    monkeypatch.setattr(main, "coalesce_buffer", [])
+    monkeypatch.setattr(main, "schedule_order", itertools.count())
+    monkeypatch.setattr(main, "synth_heap", [])
+    monkeypatch.setattr(main, "ready_parts", {})
+    monkeypatch.setattr(main, "next_seq", 0)
+    monkeypatch.setattr(main, "next_play_seq", 0)
+    monkeypatch.setattr(main, "next_play_index", 0)
+    monkeypatch.setattr(main, "ingest_log", None)
+    monkeypatch.setattr(main, "COALESCE_WINDOW", 0)
+    monkeypatch.setattr(main, "STREAM_SUMMARY", False)
+    monkeypatch.setattr(main, "USE_ELEVENLABS", False)
+    monkeypatch.setattr(main, "PYTTSX3_RENDER", True)
+    monkeypatch.setattr(main, "summarize_with_gpt", lambda data, max_words=None: f"Hark: {data['issue']}.")
+    monkeypatch.setattr(main, "synthesize_speech", lambda text: main.AudioStream(b"RIFF audio"))
+    monkeypatch.setattr(main, "play_audio", lambda stream, label=None, on_start=None: on_start() or True)
+
+
+def run_pipeline():
+    """Take the next announcement through every stage."""
+    main.summarize_announcement(main.next_announcement())
+    main.synthesize_next_part()
+    main.play_next_part()
+
+
+def test_webhook_is_queued_then_done(pipeline):
+    client = main.app.test_client()
+    response = client.post("/webhook", json={"issue": "printer jam"})
+    assert response.status_code == 202
+    status_url = response.headers["Location"]
+    assert status_url == response.get_json()["status_url"]
+    assert client.get(status_url).get_json()["status"] == "queued"
+
+    run_pipeline()
+    job = client.get(status_url).get_json()
+    assert job["status"] == "done"
+    assert job["summary"] == "Hark: printer jam."
+    assert set(job["timestamps"]) == {"queued", "summarizing", "synthesizing", "buffered", "rendered", "speaking", "done"}
+    assert job["timestamps"]["queued"] <= job["timestamps"]["speaking"] <= job["timestamps"]["done"]
+    assert "data" not in job
+
+
+def test_failed_playback_marks_the_job_failed(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "play_audio", lambda stream, label=None, on_start=None: False)
+    client = main.app.test_client()
+    status_url = client.post("/webhook", json={"issue": "printer jam"}).headers["Location"]
+    run_pipeline()
+    job = client.get(status_url).get_json()
+    assert (job["status"], job["error"]) == ("failed", "Audio playback failed.")
+
+
+def test_unknown_job_is_404():
+    assert main.app.test_client().get("/jobs/nope").status_code == 404
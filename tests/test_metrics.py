@@ -0,0 +1,53 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(main, "metrics", [])
+    return main.metrics
+
+
+def test_counter_counts_per_label_set(registry):
+    counter = main.Counter("test_total", "Test counter.")
+    counter.inc(outcome="accepted")
+    counter.inc(2, outcome="accepted")
+    counter.inc(outcome="rejected")
+    assert counter.value(outcome="accepted") == 3
+    assert counter.value(outcome="missing") == 0
+    assert main.render_metrics() == (
+        "# HELP test_total Test counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{outcome="accepted"} 3\n'
+        'test_total{outcome="rejected"} 1\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = main.Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, stage="x")
+    lines = main.render_metrics().splitlines()
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="x",le="0.1"} 1',
+        'test_seconds_bucket{stage="x",le="1"} 3',
+        'test_seconds_bucket{stage="x",le="+Inf"} 4',
+        'test_seconds_sum{stage="x"} 6.05',
+        'test_seconds_count{stage="x"} 4',
+    ]
+    [snapshot] = histogram.snapshot()
+    assert (snapshot["count"], snapshot["p50"], snapshot["p95"]) == (4, 1, float("inf"))
+
+
+def test_gauge_and_label_escaping(registry):
+    main.Gauge("test_depth", "Test gauge.", lambda: [({"stage": 'a"b'}, 2)])
+    assert main.render_metrics().splitlines()[2] == 'test_depth{stage="a\\"b"} 2'
+
+
+def test_metrics_endpoint_serves_both_formats():
+    client = main.app.test_client()
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE shadowdesk_webhook_requests_total counter" in response.get_data(as_text=True)
+    assert "shadowdesk_webhook_requests_total" in client.get("/metrics?format=json").get_json()["metrics"]
@@ -0,0 +1,54 @@
+import main
+
+
+def test_clean_email_text_drops_quotes_and_signature():
+    email = (
+        "Hi team,\r\n\r\n"
+        "My   laptop won't boot since this morning.\r\n\r\n"
+        "Thanks,\r\nBob Smith\r\nFinance\r\n\r\nBuilding 2\r\n555-1234\r\n\r\n"
+        "On Mon, Jan 1, 2024 at 10:00 AM Alice <a@example.com> wrote:\r\n> old stuff\r\n"
+    )
+    assert main.clean_email_text(email) == "Hi team,\n\nMy laptop won't boot since this morning.\n\nThanks,\nBob Smith\nFinance\nBuilding 2"
+
+
+def test_clean_email_text_strips_html_and_disclaimers():
+    disclaimer = "This message is confidential and intended solely for the addressee. " * 3
+    email = f"<p>The <b>VPN</b> is down &amp; nobody can log in.</p><style>p {{}}</style><p>{disclaimer}</p>"
+    assert main.clean_email_text(email) == "The VPN is down & nobody can log in."
+
+
+def test_clean_email_text_keeps_problem_paragraphs_that_sound_like_disclaimers():
+    issue = ("I think my laptop might have a virus because pop-ups keep appearing every few minutes, "
+             "and a confidential spreadsheet I was working on this morning has vanished from my desktop.")
+    disclaimer = "This email and any attachments are confidential and intended solely for the addressee. " * 2
+    email = f"Hi,\n\n{issue}\n\nThanks,\nJane\nFinance\n\n{disclaimer}"
+    assert main.clean_email_text(email) == f"Hi,\n\n{issue}\n\nThanks,\nJane\nFinance"
+
+
+def test_clean_email_text_keeps_forwarded_message_headers_at_the_top():
+    email = "From: Jane Doe <jane@corp.com>\nSent: Monday\n\nThe third floor printer is jammed again."
+    assert main.clean_email_text(email).endswith("The third floor printer is jammed again.")
+    assert main.clean_email_text("Printer jammed.\nFrom: Jane Doe <jane@corp.com>\nold stuff") == "Printer jammed."
+
+
+def test_compact_content_falls_back_when_cleaning_leaves_nothing():
+    assert main.compact_content("> only quoted text\n> here") == "> only quoted text\n> here"
+
+
+def test_clean_email_text_stops_at_signature_delimiter():
+    assert main.clean_email_text("Server room is hot.\n--\nBob\nIT") == "Server room is hot."
+    assert main.clean_email_text("Server room is hot.\nSent from my iPhone") == "Server room is hot."
+
+
+def test_compact_payload_drops_empty_and_irrelevant_keys():
+    payload = {
+        "id": 5,
+        "Name": " Ann ",
+        "empty": "",
+        "none": None,
+        "tags": ["", "urgent", {}],
+        "data": {"html_url": "https://example.com", "message": "Printer jam\n\n--\nAnn"},
+        "meta": {"avatar_url": "x"},
+    }
+    assert main.compact_payload(payload) == {"Name": "Ann", "tags": ["urgent"], "data": {"message": "Printer jam"}}
+    assert main.compact_content(payload) == '{"Name":"Ann","tags":["urgent"],"data":{"message":"Printer jam"}}'
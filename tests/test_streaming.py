@@ -0,0 +1,21 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("text, fragments, rest", [
+    ("Hark, Sir Cody! The printer is jammed. More", ["Hark, Sir Cody!", "The printer is jammed."], "More"),
+    ("Dr. Smith of Finance reports a problem. Next", ["Dr. Smith of Finance reports a problem."], "Next"),
+    ("J. R. Tolkien called. Then", ["J. R. Tolkien called."], "Then"),
+    ("Wait... what? ", ["Wait...", "what?"], ""),
+    ('He said "stop." Then', ['He said "stop."'], "Then"),
+    ("No trailing space.", [], "No trailing space."),
+])
+def test_split_fragments_at_sentence_ends(text, fragments, rest):
+    assert main.split_fragments(text) == (fragments, rest)
+
+
+def test_split_fragments_at_clauses_only_when_long_enough(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_MIN_FRAGMENT_CHARS", 20)
+    assert main.split_fragments("Short, then the rest") == ([], "Short, then the rest")
+    assert main.split_fragments("This clause is long enough, so it goes") == (["This clause is long enough,"], "so it goes")
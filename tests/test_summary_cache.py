@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    return now
+
+
+def lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = main.SummaryCache(max_entries=10, ttl=60)
+    cache.put("a", "Summary A")
+    clock[0] += 59
+    assert cache.get("a") == "Summary A"
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = main.SummaryCache(max_entries=2, ttl=60)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+
+def test_reload_skips_torn_and_expired_lines_and_compacts(tmp_path, clock):
+    path = tmp_path / "summaries.jsonl"
+    cache = main.SummaryCache(max_entries=10, ttl=60, path=str(path))
+    cache.put("old", "Old")
+    clock[0] += 30
+    cache.put("a", "A")
+    cache.put("a", "A again")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "torn", "summ') # A crash mid-write
+
+    clock[0] += 40 # "old" is now past the TTL
+    reloaded = main.SummaryCache(max_entries=10, ttl=60, path=str(path))
+    assert reloaded.get("a") == "A again"
+    assert reloaded.get("old") is None
+    assert [record["key"] for record in lines(path)] == ["a"]
+
+
+def test_appends_are_compacted_once_the_file_grows(tmp_path, clock):
+    path = tmp_path / "summaries.jsonl"
+    cache = main.SummaryCache(max_entries=2, ttl=60, path=str(path))
+    for n in range(5):
+        cache.put(f"k{n}", f"S{n}")
+    assert [record["key"] for record in lines(path)] == ["k3", "k4"] # Rewritten after the 5th append
+
+
+def test_cache_keys_ignore_key_order_and_whitespace():
+    first = main.summary_cache_key({"Name": "Ann", "Issue": "printer  jam"})
+    assert first == main.summary_cache_key({"Issue": " printer jam ", "Name": "Ann"})
+    assert first != main.summary_cache_key({"Name": "Ann", "Issue": "printer jam"}, max_words=10)
+    assert first != main.summary_cache_key("Name: Ann")
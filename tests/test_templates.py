@@ -0,0 +1,52 @@
+import main
+
+
+def make_template():
+    return main.AnnouncementTemplate(
+        "test",
+        {"name": ["data.name", "name"], "issue": ["Issue Description"], "where": ["location"]},
+        ["name", "issue"],
+        ["{name} at {where}: {issue}.", "{name} reports: {issue}."],
+    )
+
+
+def test_template_extract_matches_paths_loosely():
+    template = make_template()
+    payload = {"data": {"NAME": "  Ann   Lee "}, "issue_description": "Printer jam!!", "location": True}
+    assert template.extract(payload) == {"name": "Ann Lee", "issue": "Printer jam"}
+    assert template.extract({"name": "Ann"}) is None # Missing a required field
+
+
+def test_template_extract_leaves_long_values_to_gpt(monkeypatch):
+    monkeypatch.setattr(main, "TEMPLATE_MAX_FIELD_CHARS", 10)
+    assert make_template().extract({"name": "Ann", "Issue Description": "x" * 11}) is None
+
+
+def test_template_render_rotates_usable_phrasings():
+    template = make_template()
+    template.next_index = 0
+    values = {"name": "Ann", "issue": "Printer jam", "where": "HQ"}
+    assert [template.render(values) for _ in range(3)] == [
+        "Ann at HQ: Printer jam.", "Ann reports: Printer jam.", "Ann at HQ: Printer jam.",
+    ]
+    assert template.render({"name": "Ann", "issue": "Printer jam"}) == "Ann reports: Printer jam."
+
+
+def test_render_from_template_respects_event_routes(monkeypatch):
+    payload = {"event": "Test", "data": {"name": "Cody", "message": "This is a test"}}
+    monkeypatch.setattr(main, "USE_TEMPLATES", True)
+    monkeypatch.setattr(main, "TEMPLATE_EVENT_ROUTES", {})
+    assert "Cody" in main.render_from_template(payload)
+    assert main.render_from_template({"unknown": "shape"}) is None
+    monkeypatch.setattr(main, "TEMPLATE_EVENT_ROUTES", {"test": "gpt"})
+    assert main.render_from_template(payload) is None
+    monkeypatch.setattr(main, "USE_TEMPLATES", False)
+    monkeypatch.setattr(main, "TEMPLATE_EVENT_ROUTES", {"test": "template"})
+    assert "Cody" in main.render_from_template(payload)
+
+
+def test_known_payloads_skip_gpt(monkeypatch):
+    monkeypatch.setattr(main, "USE_TEMPLATES", True)
+    monkeypatch.setattr(main, "TEMPLATE_EVENT_ROUTES", {})
+    prompt, announcement = main.choose_gpt_prompt({"event": "Test", "data": {"name": "Cody", "message": "This is a test"}})
+    assert prompt is None and "Cody" in announcement
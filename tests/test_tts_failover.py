@@ -0,0 +1,90 @@
+import main
+
+
+def make_breaker(monkeypatch, clock):
+    monkeypatch.setattr(main.time, "time", lambda: clock[0])
+    return main.CircuitBreaker("test", failure_threshold=3, cooldown=30)
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    clock = [1000.0]
+    breaker = make_breaker(monkeypatch, clock)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record(False)
+    assert breaker.state == "closed"
+    breaker.record(True) # A success resets the count
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.status()["times_opened"] == 1
+    assert not breaker.allow_request()
+
+
+def test_half_open_lets_one_trial_through(monkeypatch):
+    clock = [1000.0]
+    breaker = make_breaker(monkeypatch, clock)
+    for _ in range(3):
+        breaker.record(False)
+    clock[0] += 29
+    assert not breaker.allow_request()
+    clock[0] += 1
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request() # Only one trial at a time
+
+
+def test_half_open_closes_on_success(monkeypatch):
+    clock = [1000.0]
+    breaker = make_breaker(monkeypatch, clock)
+    for _ in range(3):
+        breaker.record(False)
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_half_open_reopens_on_failure(monkeypatch):
+    clock = [1000.0]
+    breaker = make_breaker(monkeypatch, clock)
+    for _ in range(3):
+        breaker.record(False)
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.record(False) # One failed trial is enough
+    assert breaker.state == "open"
+    assert breaker.status()["times_opened"] == 2
+    assert breaker.status()["opened_at"] == clock[0]
+    assert not breaker.allow_request()
+
+
+def stub_engines(monkeypatch, elevenlabs_stream):
+    monkeypatch.setattr(main, "USE_ELEVENLABS", True)
+    monkeypatch.setattr(main, "TTS_FAILOVER", True)
+    monkeypatch.setattr(main, "ELEVENLABS_FIRST_BYTE_DEADLINE", 0.01)
+    monkeypatch.setattr(main, "audio_cache", None)
+    monkeypatch.setattr(main, "elevenlabs_breaker", main.CircuitBreaker("test", failure_threshold=1, cooldown=30))
+    monkeypatch.setattr(main, "start_elevenlabs_stream", lambda text: elevenlabs_stream)
+    fallback = main.AudioStream(b"RIFF fallback")
+    monkeypatch.setattr(main, "render_with_pyttsx3", lambda text: fallback)
+    return fallback
+
+
+def test_slow_elevenlabs_falls_back_to_pyttsx3(monkeypatch):
+    fallback = stub_engines(monkeypatch, main.AudioStream()) # No first byte before the deadline
+    assert main.synthesize_speech("Hello") is fallback
+
+
+def test_open_breaker_skips_elevenlabs(monkeypatch):
+    fallback = stub_engines(monkeypatch, None)
+    main.elevenlabs_breaker.record(False)
+    assert main.synthesize_speech("Hello") is fallback
+
+
+def test_fast_elevenlabs_is_used(monkeypatch):
+    stream = main.AudioStream(b"ID3 audio")
+    stub_engines(monkeypatch, stream)
+    assert main.synthesize_speech("Hello") is stream